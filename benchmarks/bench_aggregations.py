@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Comparison of the aggregations made in Python on Log objects (legacy path),
+the aggregations made by SQLite (Log.sql_* methods) and the ones made
+by NumPy (analytics_numpy; skipped if NumPy is not installed).
+
+Usage:
+    python3 -m benchmarks.bench_aggregations --rows 5000000
+"""
+
+# Standard imports
+import argparse
+import tempfile
+import time
+import tracemalloc
+# Custom imports
+from irc_bot import database as db
+from benchmarks.synthetic import create_database
+
+Log = db.Log
+
+
+def legacy_aggregations(session):
+    """Aggregations made on Log objects with Counters"""
+    prev_day_msgs  = Log.get_day_messages(session, previous=True)
+    prev_week_msgs = Log.get_week_messages(session, previous=True)
+    day_msgs       = Log.get_day_messages(session)
+    week_msgs      = Log.get_week_messages(session)
+    return [
+        Log.get_top_posters(day_msgs),
+        Log.get_top_posters(prev_day_msgs),
+        Log.get_top_posters(week_msgs),
+        Log.get_messages_per_hour(prev_week_msgs),
+        Log.get_messages_per_hour(week_msgs),
+        Log.get_messages_per_hour(prev_day_msgs),
+        Log.get_messages_per_hour(day_msgs),
+        Log.get_average_msgs_per_day(Log.get_all(session)),
+    ]
+
+
+def sql_aggregations(session):
+    """Aggregations made by SQLite"""
+    prev_day  = Log.get_day_range(previous=True)
+    prev_week = Log.get_week_range(previous=True)
+    day       = Log.get_day_range()
+    week      = Log.get_week_range()
+    return [
+        Log.sql_top_posters(session, *day),
+        Log.sql_top_posters(session, *prev_day),
+        Log.sql_top_posters(session, *week),
+        Log.sql_messages_per_hour(session, *prev_week),
+        Log.sql_messages_per_hour(session, *week),
+        Log.sql_messages_per_hour(session, *prev_day),
+        Log.sql_messages_per_hour(session, *day),
+        Log.sql_average_msgs_per_day(session),
+    ]
+
+
+def numpy_aggregations(session):
+    """Aggregations made by NumPy on columns of the logs"""
+    top_posters, per_hour, average = db.get_analytics_functions('numpy')
+    prev_day  = Log.get_day_range(previous=True)
+    prev_week = Log.get_week_range(previous=True)
+    day       = Log.get_day_range()
+    week      = Log.get_week_range()
+    return [
+        top_posters(session, *day),
+        top_posters(session, *prev_day),
+        top_posters(session, *week),
+        per_hour(session, *prev_week),
+        per_hour(session, *week),
+        per_hour(session, *prev_day),
+        per_hour(session, *day),
+        average(session),
+    ]
+
+
+# Compared aggregations
+PATHS = {
+    'legacy': legacy_aggregations,
+    'sql': sql_aggregations,
+    'numpy': numpy_aggregations,
+}
+
+
+def measure(func, session):
+    """Return the duration (seconds) & the peak of memory (bytes) of func.
+
+    ..Note: Memory is measured in a second run, since tracemalloc
+        slows down the allocations.
+    """
+    session.expunge_all()
+    start = time.perf_counter()
+    func(session)
+    duration = time.perf_counter() - start
+
+    session.expunge_all()
+    tracemalloc.start()
+    func(session)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    session.expunge_all()
+    return duration, peak
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=5000000,
+                        help="Number of synthetic logs")
+    parser.add_argument('--days', type=int, default=730,
+                        help="Number of days covered by the logs")
+    parser.add_argument('--paths', nargs='+', default=list(PATHS),
+                        choices=list(PATHS),
+                        help="Aggregation paths to compare (the first one "
+                             "is the reference of speedups); the legacy path "
+                             "loads all the logs in memory")
+    args = parser.parse_args()
+
+    paths = [path for path in args.paths
+             if path != 'numpy' or 'numpy' in db.get_installed_backends()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        session = create_database(directory, args.rows, days=args.days)
+
+        if 'numpy' in paths:
+            # Same results as SQLite
+            assert numpy_aggregations(session) == sql_aggregations(session)
+        results = [(path, measure(PATHS[path], session)) for path in paths]
+
+        reference = results[0][1]
+        print("{:<8} {:>12} {:>16} {:>10} {:>10}".format(
+            "path", "time (s)", "peak (MiB)", "speedup", "memory"))
+        for path, (duration, peak) in results:
+            print("{:<8} {:>12.3f} {:>16.1f} {:>9.1f}x {:>9.1f}/".format(
+                path, duration, peak / 2**20, reference[0] / duration,
+                reference[1] / peak))
+
+
+if __name__ == "__main__":
+
+    main()
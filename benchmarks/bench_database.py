@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the aggregations of database.py & of forge_data().
+"""
+
+# Standard imports
+import importlib
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import database as db
+from irc_bot import graph_metrics
+from irc_bot import graph_pruning
+from benchmarks.common import measure
+
+Log = db.Log
+
+
+def bench_aggregations(session, repeat):
+    """Time each Log.* aggregation on the current week.
+
+    ..Note: The legacy Python aggregations are measured on the Log objects
+        loaded by get_week_messages() (loading excluded).
+    ..Note: NumPy aggregations are skipped if NumPy is not installed.
+
+    :return: List of results.
+    :rtype: <list <dict>>
+    """
+    week = Log.get_week_range()
+    logs = Log.get_week_messages(session)
+    session.expunge_all()
+
+    benchs = [
+        ('Log.get_week_messages', Log.get_week_messages, (session,)),
+        ('Log.get_top_posters', Log.get_top_posters, (logs,)),
+        ('Log.get_messages_per_hour', Log.get_messages_per_hour, (logs,)),
+        ('Log.sql_top_posters', Log.sql_top_posters, (session,) + week),
+        ('Log.sql_messages_per_hour', Log.sql_messages_per_hour,
+         (session,) + week),
+        ('Log.sql_average_msgs_per_day', Log.sql_average_msgs_per_day,
+         (session,)),
+        ('HourlyRollup.get_top_posters', db.HourlyRollup.get_top_posters,
+         (session,) + week),
+        ('HourlyRollup.get_messages_per_hour',
+         db.HourlyRollup.get_messages_per_hour, (session,) + week),
+        ('DailyRollup.get_average_msgs_per_day',
+         db.DailyRollup.get_average_msgs_per_day, (session,)),
+    ]
+    if 'numpy' in db.get_installed_backends():
+        top_posters, per_hour, average = db.get_analytics_functions('numpy')
+        benchs += [
+            ('numpy.get_top_posters', top_posters, (session,) + week),
+            ('numpy.get_messages_per_hour', per_hour, (session,) + week),
+            ('numpy.get_average_msgs_per_day', average, (session,)),
+        ]
+    results = list()
+    for name, func, args in benchs:
+        results.append(dict(benchmark=name, **measure(func, *args,
+                                                      repeat=repeat)))
+        session.expunge_all()
+    return results
+
+
+def bench_graph(session, repeat):
+    """Time Edge.get_graph (plain & NetworkX paths) & RelationGraph.
+
+    ..Note: The NetworkX path is skipped if the module is not installed.
+
+    :return: List of results.
+    :rtype: <list <dict>>
+    """
+    edges = db.Edge.get_all(session)
+    results = list()
+
+    use_networkx = cm.USE_NETWORKX
+    paths = [('plain', False)]
+    try:
+        # Edge.get_graph imports networkx only if USE_NETWORKX is True
+        importlib.import_module('networkx')
+        paths.append(('networkx', True))
+    except ImportError:
+        pass
+
+    for path, flag in paths:
+        cm.USE_NETWORKX = flag
+        results.append(dict(benchmark='Edge.get_graph[' + path + ']',
+                            **measure(db.Edge.get_graph, edges,
+                                      repeat=repeat)))
+    cm.USE_NETWORKX = use_networkx
+    session.expunge_all()
+
+    def load_graph():
+        graph = db.RelationGraph()
+        graph.update(session)
+        return graph.get_dot()
+
+    results.append(dict(benchmark='RelationGraph.update+get_dot',
+                        **measure(load_graph, repeat=repeat)))
+
+    # Computed in the current thread (the pool only moves the work)
+    graph = db.RelationGraph()
+    graph.update(session)
+    results.append(dict(benchmark='graph_metrics.compute_metrics',
+                        **measure(graph_metrics.compute_metrics, graph.edges,
+                                  cm.GRAPH_BETWEENNESS_SAMPLES,
+                                  repeat=repeat)))
+
+    # Levels of detail (done once per forge of data)
+    graph.update_metrics()
+    nodes, edges = graph.export()
+    results.append(dict(benchmark='graph_pruning.prune_levels',
+                        **measure(graph_pruning.prune_levels, nodes, edges,
+                                  repeat=repeat)))
+    return results
+
+
+def bench_forge_data(session, repeat):
+    """Time forge_data() end to end with each analytics backend.
+
+    ..Note: The relationship graph is loaded once before measures
+        (incremental updates are measured).
+    ..Note: Backends whose dependencies are not installed are skipped.
+
+    :return: List of results.
+    :rtype: <list <dict>>
+    """
+    graph = db.RelationGraph()
+    graph.update(session)
+    results = list()
+    for backend in db.get_installed_backends():
+        results.append(dict(benchmark='forge_data[' + backend + ']',
+                            **measure(db.forge_data, session, backend, graph,
+                                      repeat=repeat)))
+        session.expunge_all()
+    return results
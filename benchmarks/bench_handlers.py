@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the IRC event handlers of IRCAnalytics.
+
+A synthetic stream of pubmsg/join/part events is replayed through the
+handlers with a fake ServerConnection (no network).
+"""
+
+# Standard imports
+import time
+import random
+import logging
+from irc.client import Event, NickMask
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot.connection import IRCAnalytics
+from benchmarks.common import percentile
+
+
+class FakeServerConnection():
+    """ServerConnection which only counts the calls of its methods"""
+
+    def __init__(self, nickname=cm.BOT_NAME):
+        self.nickname = nickname
+        self.calls = 0
+
+    def get_nickname(self):
+        return self.nickname
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.calls += 1
+        return method
+
+
+def iter_events(number, pseudos, channel=cm.CHANNEL):
+    """Yield (handler name, Event) tuples.
+
+    80% of messages (30% of them are addressed to someone),
+    10% of joins, 10% of parts.
+    """
+    for i in range(number):
+        author = random.choice(pseudos)
+        source = NickMask(author + '!user@host')
+        draw = random.random()
+        if draw < 0.1:
+            yield 'on_join', Event('join', source, channel)
+        elif draw < 0.2:
+            yield 'on_part', Event('part', source, channel)
+        elif draw < 0.44:
+            message = random.choice(pseudos) + ': message number ' + str(i)
+            yield 'on_pubmsg', Event('pubmsg', source, channel, [message])
+        else:
+            message = 'message number ' + str(i)
+            yield 'on_pubmsg', Event('pubmsg', source, channel, [message])
+
+
+def bench_handlers(nb_events, nb_pseudos=300, channel=cm.CHANNEL):
+    """Replay synthetic events through the handlers of the bot.
+
+    ..Note: The database is the current cm.DIR_DATA one.
+    ..Note: Logs of the bot are disabled during the measure.
+    ..Note: Logs are not archived (the thread would compete with
+        the handlers for the database).
+
+    :return: Events per second & latencies of handlers (microseconds),
+        and the time needed to commit pending events at the end.
+    :rtype: <dict>
+    """
+    pseudos = ['user_{}'.format(i) for i in range(nb_pseudos)]
+    serv = FakeServerConnection()
+    cm.ENABLE_ARCHIVES = False
+    bot = IRCAnalytics(server_list=[('localhost', 6667)],
+                       nickname=cm.BOT_NAME,
+                       realname=cm.BOT_REALNAME)
+
+    # Fill the channel (all the handlers of the reactor are called)
+    bot.reactor._handle_event(serv, Event('join', NickMask(cm.BOT_NAME + '!b@h'),
+                                          channel))
+    for pseudo in pseudos:
+        bot.reactor._handle_event(serv, Event('join', NickMask(pseudo + '!u@h'),
+                                              channel))
+
+    events = list(iter_events(nb_events, pseudos, channel))
+    handlers = {name: getattr(bot, name) for name in ('on_join', 'on_part',
+                                                      'on_pubmsg')}
+
+    logger = logging.getLogger(cm.LOGGER_NAME)
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+
+    latencies = list()
+    start = time.perf_counter()
+    for name, event in events:
+        t0 = time.perf_counter_ns()
+        handlers[name](serv, event)
+        latencies.append(time.perf_counter_ns() - t0)
+    duration = time.perf_counter() - start
+
+    t0 = time.perf_counter()
+    bot.shutdown()
+    drain = time.perf_counter() - t0
+    logger.setLevel(level)
+
+    return {
+        'benchmark': 'IRCAnalytics.handlers',
+        'events': nb_events,
+        'events_per_second': nb_events / duration,
+        'latency_us': {
+            'p50': percentile(latencies, 50) / 1000,
+            'p99': percentile(latencies, 99) / 1000,
+            'max': max(latencies) / 1000,
+        },
+        'drain_seconds': drain,
+    }
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of the import of client logs (irc_bot.log_import).
+
+A synthetic log file is written in the given format, then imported
+in an empty database; the aggregates built by the import are compared
+with a full backfill.
+
+Usage:
+    python3 -m benchmarks.bench_import --lines 2000000 --format irssi
+"""
+
+# Standard imports
+import os
+import argparse
+import datetime
+import random
+import resource
+import tempfile
+import time
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import database as db
+from irc_bot.log_import import import_logs
+from benchmarks.synthetic import make_pseudos
+
+
+def irssi_lines(events):
+    """Yield the lines of an irssi log of the given events"""
+    day = None
+    for timestamp, kind, nick, text in events:
+        if timestamp.date() != day:
+            day = timestamp.date()
+            yield timestamp.strftime('--- Day changed %a %b %d %Y')
+        clock = timestamp.strftime('%H:%M:%S')
+        if kind == 'msg':
+            yield clock + ' < ' + nick + '> ' + text
+        elif kind == 'join':
+            yield clock + ' -!- ' + nick + ' [~u@host] has joined #chan'
+        elif kind == 'part':
+            yield clock + ' -!- ' + nick + ' [~u@host] has left #chan []'
+        else:
+            yield clock + ' -!- ' + nick + ' is now known as ' + text
+
+
+def weechat_lines(events):
+    """Yield the lines of a weechat log of the given events"""
+    for timestamp, kind, nick, text in events:
+        prefix = timestamp.strftime('%Y-%m-%d %H:%M:%S') + '\t'
+        if kind == 'msg':
+            yield prefix + nick + '\t' + text
+        elif kind == 'join':
+            yield prefix + '-->\t' + nick + ' (~u@host) has joined #chan'
+        elif kind == 'part':
+            yield prefix + '<--\t' + nick + ' (~u@host) has left #chan'
+        else:
+            yield prefix + '--\t' + nick + ' is now known as ' + text
+
+
+def znc_lines(events):
+    """Yield the lines of a ZNC log of the given events
+
+    ..Note: All the events are written in the file of their first day.
+    """
+    for timestamp, kind, nick, text in events:
+        prefix = timestamp.strftime('[%H:%M:%S] ')
+        if kind == 'msg':
+            yield prefix + '<' + nick + '> ' + text
+        elif kind == 'join':
+            yield prefix + '*** Joins: ' + nick + ' (~u@host)'
+        elif kind == 'part':
+            yield prefix + '*** Parts: ' + nick + ' (~u@host) ()'
+        else:
+            yield prefix + '*** ' + nick + ' is now known as ' + text
+
+
+WRITERS = {
+    'irssi': irssi_lines,
+    'weechat': weechat_lines,
+    'znc': znc_lines,
+}
+
+
+def iter_events(number, pseudos, days, seed=0):
+    """Yield (timestamp, kind, nick, text) events in chronological order
+
+    ..Note: 1 event out of 10 is a join, a part or a nick change;
+        1 message out of 5 is addressed to another user.
+    """
+    rand = random.Random(seed)
+    timestamp = datetime.datetime.now() - datetime.timedelta(days=days)
+    step = days * 86400 / number
+    for _ in range(number):
+        timestamp += datetime.timedelta(seconds=rand.random() * 2 * step)
+        nick = rand.choice(pseudos)
+        draw = rand.random()
+        if draw < 0.04:
+            yield timestamp, 'join', nick, None
+        elif draw < 0.08:
+            yield timestamp, 'part', nick, None
+        elif draw < 0.1:
+            yield timestamp, 'nick', nick, rand.choice(pseudos)
+        elif draw < 0.28:
+            yield timestamp, 'msg', nick, rand.choice(pseudos) + ': hello there'
+        else:
+            yield timestamp, 'msg', nick, 'some message'
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=2000000,
+                        help="Number of events in the log file")
+    parser.add_argument('--format', choices=list(WRITERS), default='irssi',
+                        help="Format of the log file")
+    parser.add_argument('--days', type=int, default=365,
+                        help="Number of days covered by the logs")
+    args = parser.parse_args()
+
+    # Pages of the database mapped in memory would be counted in the RSS
+    cm.SQLITE_PROFILES[cm.SQLITE_PROFILE].pop('mmap_size', None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cm.DIR_DATA = os.path.join(directory, '')
+        session = db.loading_sql(reuse=False)()
+        path = os.path.join(directory, '#chan_20200101.log')
+        with open(path, 'w') as file:
+            for line in WRITERS[args.format](iter_events(
+                    args.lines, make_pseudos(300), args.days)):
+                file.write(line + '\n')
+
+        start = time.perf_counter()
+        lines, logs, edges = import_logs(session, [path], args.format)
+        duration = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        hourly = session.execute('SELECT * FROM rollup_hourly '
+                                 'ORDER BY 1, 2, 3, 4, 5, 6').fetchall()
+        db.backfill_rollups(session)
+        assert hourly == session.execute('SELECT * FROM rollup_hourly '
+                                         'ORDER BY 1, 2, 3, 4, 5, 6').fetchall()
+
+        print("{} lines, {} logs, {} edges in {:.1f}s: {:.2f}M lines/min, "
+              "max RSS {:.0f} MiB".format(lines, logs, edges, duration,
+                                          lines / duration * 60 / 1e6,
+                                          peak / 1024))
+
+
+if __name__ == "__main__":
+
+    main()
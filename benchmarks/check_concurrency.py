@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrency check of the SQLite profiles: the write-behind buffer of the bot
+commits events while several processes (Gunicorn workers) forge data
+with read-only connections.
+
+For each profile, the write throughput, the latencies of the readers
+and the "database is locked" errors are reported.
+The exit status is 1 if the current profile (SQLITE_PROFILE) got errors,
+or if a reader didn't finish in time (hung process).
+
+Usage:
+    python3 -m benchmarks.check_concurrency --readers 8 --seconds 10
+"""
+
+# Standard imports
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from queue import Empty
+from sqlalchemy.exc import OperationalError
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import database as db
+from irc_bot import metrics
+from irc_bot.write_behind import WriteBehind
+from benchmarks.common import percentile
+from benchmarks.synthetic import create_database, make_pseudos
+
+# Delay (in seconds) given to the readers after the end of the check
+# to send their results & exit
+READERS_TIMEOUT = 60
+
+
+def reader(seconds, results):
+    """Forge data in a loop with a read-only session (child process)"""
+    # Graph metrics in-process: the readers measure SQLite, not the pool
+    cm.GRAPH_METRICS_PROCESSES = 0
+    session = db.loading_sql(read_only=True)
+    latencies, errors = list(), 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            db.forge_all_data(session)
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            errors += 1
+        session.remove()
+    results.put((latencies, errors))
+
+
+def writer(seconds, rate):
+    """Queue events at the given rate (events/s) in the write-behind buffer
+
+    :return: Number of queued events.
+    :rtype: <int>
+    """
+    session = db.loading_sql()
+    buffer = WriteBehind(session, db.prepare_commit)
+    buffer.start()
+    pseudos = make_pseudos(300)
+    network, channel = cm.default_channel()
+    queued = 0
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        # Catch up with the expected number of events
+        for _ in range(int((time.monotonic() - start) * rate) - queued):
+            buffer.add(db.Log(pseudos[queued % len(pseudos)], cm.IRC_MSG,
+                              network, channel))
+            queued += 1
+        time.sleep(0.01)
+    buffer.stop()
+    return queued
+
+
+def check_profile(profile, nb_readers, seconds, rate, nb_logs):
+    """Run the writer & the readers on a synthetic database
+
+    :return: Results of the profile.
+    :rtype: <dict>
+    :raise: <TimeoutError> If a reader didn't finish in time.
+    """
+    cm.SQLITE_PROFILE = profile
+    failures = dict(metrics.COMMIT_FAILURES._values)
+    commits = list(metrics.COMMIT_SECONDS._values.get((), [0, 0.0]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        session = create_database(directory, nb_logs, nb_logs // 10)
+        journal_mode = session.execute('PRAGMA journal_mode').scalar()
+        session.remove()
+
+        results = multiprocessing.Queue()
+        readers = [multiprocessing.Process(target=reader,
+                                           args=(seconds, results))
+                   for _ in range(nb_readers)]
+        for process in readers:
+            process.start()
+        queued = writer(seconds, rate)
+
+        latencies, errors, received = list(), 0, 0
+        deadline = time.monotonic() + READERS_TIMEOUT
+        try:
+            for _ in readers:
+                reader_latencies, reader_errors = results.get(
+                    timeout=max(deadline - time.monotonic(), 0))
+                latencies += reader_latencies
+                errors += reader_errors
+                received += 1
+        except Empty:
+            pass
+        for process in readers:
+            process.join(max(deadline - time.monotonic(), 0))
+        hung = [process for process in readers if process.is_alive()]
+        for process in hung:
+            process.kill()
+            process.join()
+        if received < len(readers) or hung:
+            raise TimeoutError(
+                "{}: {} reader(s) without results, {} still running after "
+                "{}s".format(profile, len(readers) - received, len(hung),
+                             READERS_TIMEOUT))
+
+    retried = metrics.COMMIT_FAILURES._values.get(('retried',), 0) - \
+        failures.get(('retried',), 0)
+    # Number & total duration of the commits made during the check
+    counts = metrics.COMMIT_SECONDS._values[()]
+    nb_commits = sum(counts[:-1]) - sum(commits[:-1])
+    return {
+        'profile': profile,
+        'journal_mode': journal_mode,
+        'queued_events': queued,
+        'commit_mean_ms': (counts[-1] - commits[-1]) / nb_commits * 1000,
+        'commit_retries': retried,
+        'forges': len(latencies),
+        'forge_p50_ms': percentile(latencies, 50) * 1000,
+        'forge_p99_ms': percentile(latencies, 99) * 1000,
+        'reader_errors': errors,
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--profiles', nargs='+',
+                        default=sorted(cm.SQLITE_PROFILES),
+                        choices=sorted(cm.SQLITE_PROFILES),
+                        help="SQLite profiles to check")
+    parser.add_argument('--readers', type=int, default=8,
+                        help="Number of reader processes")
+    parser.add_argument('--seconds', type=int, default=10,
+                        help="Duration of each check")
+    parser.add_argument('--rate', type=int, default=2000,
+                        help="Events queued per second by the writer")
+    parser.add_argument('--logs', type=int, default=200000,
+                        help="Number of synthetic logs")
+    args = parser.parse_args()
+
+    # Errors are counted; don't flood the console
+    logging.getLogger(cm.LOGGER_NAME).setLevel(logging.CRITICAL)
+    current_profile = cm.SQLITE_PROFILE
+
+    failed = False
+    print("{:<10} {:>8} {:>8} {:>12} {:>8} {:>8} {:>10} {:>10} {:>8}".format(
+        "profile", "journal", "events", "commit (ms)", "retries", "forges",
+        "p50 (ms)", "p99 (ms)", "errors"))
+    for profile in args.profiles:
+        try:
+            result = check_profile(profile, args.readers, args.seconds,
+                                   args.rate, args.logs)
+        except TimeoutError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print("{profile:<10} {journal_mode:>8} {queued_events:>8} "
+              "{commit_mean_ms:>12.1f} {commit_retries:>8} {forges:>8} {forge_p50_ms:>10.1f} {forge_p99_ms:>10.1f} "
+              "{reader_errors:>8}".format(**result))
+        if profile == current_profile and \
+            (result['reader_errors'] or result['commit_retries']):
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+
+    main()
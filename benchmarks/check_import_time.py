@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time budget of the modules of irc_bot.
+
+Each module is imported in a fresh interpreter (python -X importtime),
+from an empty directory: importing a module must not read the files
+of the project (whitelist, admins, database, logs), start a thread,
+create a database engine, attach handlers to the logger or load
+networkx/pydotplus. Gunicorn workers & tools (log_import, benchmarks)
+import these modules; only entry points call commons.init() or
+website.create_app().
+
+The cumulative import time of each module (best of --repeat runs)
+is compared with its budget (milliseconds, multiplied by --scale on slow
+hardware). The exit status is 1 if a budget is exceeded or if
+a side effect is detected.
+
+..Note: irc_bot.connection is not checked: its import time is the one
+    of the irc library.
+
+Usage:
+    python3 -m benchmarks.check_import_time --repeat 3
+"""
+
+# Standard imports
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# Module: budget of its cumulative import time (ms)
+BUDGETS = {
+    'irc_bot.commons': 50,
+    'irc_bot.metrics': 60,
+    'irc_bot.data_caching': 60,
+    'irc_bot.graph_metrics': 80,
+    'irc_bot.graph_pruning': 60,
+    'irc_bot.database': 300,
+    'irc_bot.purge': 300,
+    'irc_bot.log_import': 300,
+    'irc_bot.website': 450,
+}
+
+# Executed in the child process after the import of the module
+PROBE = """
+import gc, sys, json, logging, threading
+engine = sys.modules.get('sqlalchemy.engine')
+print(json.dumps({
+    'threads': threading.active_count() - 1,
+    'handlers': len(logging.getLogger('irc_bot').handlers),
+    'engines': sum(isinstance(obj, engine.Engine) for obj in gc.get_objects())
+               if engine else 0,
+    'networkx': 'networkx' in sys.modules or 'pydotplus' in sys.modules,
+}))
+"""
+
+
+def import_module(module, directory):
+    """Import the given module in a new interpreter
+
+    ..Note: If the import fails (a file of the project is read...),
+        the error is returned as a side effect.
+
+    :return: Cumulative import time (ms) & side effects.
+    :rtype: <tuple <float>, <dict>>
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.getcwd()] + ([env['PYTHONPATH']] if 'PYTHONPATH' in env else []))
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import ' + module + '\n' + PROBE],
+        cwd=directory, env=env, universal_newlines=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode:
+        error = process.stderr.splitlines()[-1]
+        return float('inf'), {'error: ' + error: True}
+
+    # import time: self [us] | cumulative | imported package
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module:
+            return int(cumulative) / 1000, json.loads(process.stdout)
+    raise RuntimeError(module + ": import time not found")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--modules', nargs='+', default=sorted(BUDGETS),
+                        choices=sorted(BUDGETS), help="Modules to check")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of imports of each module")
+    parser.add_argument('--scale', type=float, default=1,
+                        help="Factor applied to the budgets")
+    args = parser.parse_args()
+
+    failed = False
+    print("{:<22} {:>10} {:>12}  {}".format(
+        "module", "time (ms)", "budget (ms)", "side effects"))
+    with tempfile.TemporaryDirectory() as directory:
+        for module in args.modules:
+            results = [import_module(module, directory)
+                       for _ in range(args.repeat)]
+            duration = min(duration for duration, _ in results)
+            budget = BUDGETS[module] * args.scale
+            side_effects = [key for key, value in results[0][1].items()
+                            if value]
+            if os.listdir(directory):
+                side_effects.append('files: ' +
+                                    ', '.join(os.listdir(directory)))
+            print("{:<22} {:>10.1f} {:>12.0f}  {}".format(
+                module, duration, budget, ', '.join(side_effects) or '-'))
+            if duration > budget or side_effects:
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by benchmarks.
+"""
+
+# Standard imports
+import time
+import statistics
+
+
+def measure(func, *args, repeat=3):
+    """Call the given function several times & return its durations.
+
+    :param arg1: Function to be measured.
+    :param arg2: Positional arguments of the function.
+    :param arg3: Number of calls.
+    :type arg1: <callable>
+    :type arg3: <int>
+    :return: Minimum & median durations (seconds).
+    :rtype: <dict>
+    """
+    durations = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - start)
+    return {'min': min(durations),
+            'median': statistics.median(durations),
+            'repeat': repeat}
+
+
+def percentile(values, percent):
+    """Return the given percentile of a list of values (nearest rank)"""
+    values = sorted(values)
+    if not values:
+        return 0
+    rank = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[rank]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of pirc_bot.
+
+Synthetic databases are generated for each size, then database aggregations,
+graph generation, forge_data() & IRC handlers are measured.
+Results are emitted as JSON in order to track regressions.
+
+Usage:
+    python3 -m benchmarks.run --sizes small medium --output results.json
+"""
+
+# Standard imports
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot.info import PACKAGE_VERSION
+from benchmarks.synthetic import create_database
+from benchmarks.bench_database import bench_aggregations, bench_graph, \
+    bench_forge_data
+from benchmarks.bench_handlers import bench_handlers
+
+LOGGER = cm.logger()
+
+# Number of logs & edges for each size
+SIZES = {
+    'small':  {'logs': 10000,    'edges': 1000},
+    'medium': {'logs': 1000000,  'edges': 100000},
+    'large':  {'logs': 10000000, 'edges': 1000000},
+}
+
+
+def run_size(name, repeat, nb_events):
+    """Run all benchmarks on a synthetic database of the given size.
+
+    :return: List of results.
+    :rtype: <list <dict>>
+    """
+    size = SIZES[name]
+    results = list()
+
+    with tempfile.TemporaryDirectory() as directory:
+        LOGGER.info("Benchmarks: generate <" + name + "> database...")
+        session = create_database(directory, size['logs'], size['edges'])
+
+        results += bench_aggregations(session, repeat)
+        results += bench_graph(session, repeat)
+        results += bench_forge_data(session, repeat)
+        session.remove()
+
+        results.append(bench_handlers(nb_events))
+
+    for result in results:
+        result.update(size=name, logs=size['logs'], edges=size['edges'])
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', nargs='+', default=['small'],
+                        choices=sorted(SIZES),
+                        help="Sizes of the synthetic databases")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of measures of each benchmark")
+    parser.add_argument('--events', type=int, default=20000,
+                        help="Number of IRC events replayed")
+    parser.add_argument('--output', help="JSON file (default: stdout)")
+    args = parser.parse_args()
+
+    results = list()
+    for name in args.sizes:
+        results += run_size(name, args.repeat, args.events)
+
+    report = {
+        'version': PACKAGE_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Generation of synthetic databases used by benchmarks.
+
+Rows are inserted with executemany() on the raw SQLite connection,
+in the format used by SQLAlchemy (timestamps as 'YYYY-MM-DD HH:MM:SS.ffffff').
+"""
+
+# Standard imports
+import os
+import random
+import datetime
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import database as db
+
+LOGGER = cm.logger()
+
+# Proportion of each event in synthetic logs
+EVENTS = [cm.IRC_MSG] * 17 + [cm.IRC_JOIN, cm.IRC_QUIT, cm.IRC_KICK]
+
+
+def make_pseudos(number):
+    """Return a list of fake pseudonyms"""
+    return ['user_{}'.format(i) for i in range(number)]
+
+
+def iter_logs(number, user_ids, days):
+    """Yield (timestamp, user id, event) tuples spread over the last days.
+
+    :param arg1: Number of logs.
+    :param arg2: List of user ids.
+    :param arg3: Number of days covered by the logs.
+    :type arg1: <int>
+    :type arg2: <list <int>>
+    :type arg3: <int>
+    """
+    now = datetime.datetime.now()
+    period = days * 86400
+    for _ in range(number):
+        timestamp = now - datetime.timedelta(seconds=random.random() * period)
+        yield (timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'),
+               random.choice(user_ids),
+               random.choice(EVENTS))
+
+
+def iter_edges(number, users, days):
+    """Yield (timestamp, user1 id, user2 id) tuples spread over the last days.
+
+    ..Note: Users are sorted by pseudo like in the Edge constructor.
+
+    :param arg2: List of (pseudo, user id).
+    :type arg2: <list <tuple <str>, <int>>>
+    """
+    now = datetime.datetime.now()
+    period = days * 86400
+    for _ in range(number):
+        timestamp = now - datetime.timedelta(seconds=random.random() * period)
+        (_, user1_id), (_, user2_id) = sorted(random.sample(users, 2))
+        yield (timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'), user1_id, user2_id)
+
+
+def create_database(directory, nb_logs, nb_edges=0, nb_pseudos=300, days=730,
+                    chunk=100000, seed=0):
+    """Create a synthetic bdd.sqlite in the given directory.
+
+    ..Note: The directory is used as cm.DIR_DATA from now on.
+    ..Note: All the rows belong to the default channel.
+
+    :param arg1: Directory of the database.
+    :param arg2: Number of logs.
+    :param arg3: Number of edges.
+    :param arg4: Number of distinct pseudonyms.
+    :param arg5: Number of days covered by the data.
+    :type arg1: <str>
+    :type arg2: <int>
+    :type arg3: <int>
+    :type arg4: <int>
+    :type arg5: <int>
+    :return: SQLAlchemy session on the new database.
+    :rtype: <SQL session object>
+    """
+    random.seed(seed)
+    cm.DIR_DATA = os.path.join(directory, '')
+    session = db.loading_sql(reuse=False)
+    pseudos = make_pseudos(nb_pseudos)
+    channel = cm.default_channel()
+
+    connection = session.connection().connection
+    cursor = connection.cursor()
+
+    cursor.executemany("INSERT INTO user (name) VALUES (?)",
+                       ((pseudo,) for pseudo in pseudos))
+    users = cursor.execute("SELECT name, id FROM user").fetchall()
+    user_ids = [user_id for _, user_id in users]
+
+    logs = iter_logs(nb_logs, user_ids, days)
+    inserted = 0
+    while inserted < nb_logs:
+        rows = [channel + row for _, row in zip(range(chunk), logs)]
+        cursor.executemany(
+            "INSERT INTO log (network, channel, timestamp, user_id, event) "
+            "VALUES (?, ?, ?, ?, ?)", rows)
+        inserted += len(rows)
+
+    cursor.executemany(
+        "INSERT INTO edge (network, channel, timestamp, user1_id, user2_id) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (channel + row for row in iter_edges(nb_edges, users, days)))
+    connection.commit()
+    session.commit()
+
+    db.backfill_rollups(session)
+    LOGGER.info("Synthetic database: " + str(nb_logs) + " logs, " + \
+                str(nb_edges) + " edges")
+    return session
@@ -20,6 +20,38 @@ def irc_bot_start(args):
     param = args_to_param(args)
     connection.main(**param)
 
+def rollup_backfill(args):
+    """Build the aggregates used by the website from existing logs"""
+    from irc_bot import database as db
+    with db.SQLA_Wrapper() as session:
+        db.backfill_rollups(session)
+
+def archive_logs(args):
+    """Move the logs of closed months into archives"""
+    from irc_bot import database as db
+    with db.SQLA_Wrapper() as session:
+        db.archive_logs(session)
+
+def log_import(args):
+    """Import the logs of an IRC client (irssi, weechat, ZNC)"""
+    from irc_bot import database as db
+    from irc_bot.log_import import import_logs
+    with db.SQLA_Wrapper() as session:
+        import_logs(session, args.files, args.format, args.network,
+                    args.channel)
+        if commons.ENABLE_ARCHIVES:
+            # Imported logs of closed months
+            db.archive_logs(session)
+
+def data_caching_start(args):
+    """Forge data for the website in a dedicated process"""
+    from irc_bot import database as db
+    from irc_bot.data_caching import DataCaching
+    thread = DataCaching(db.loading_sql(read_only=commons.WEBSITE_READ_ONLY),
+                         db.forge_all_data, db.Revision.get)
+    thread.start()
+    thread.join()
+
 def args_to_param(args):
     """Return argparse namespace as a dict {variable name: value}"""
     return {k: v for k, v in vars(args).items() if k != 'func'}
@@ -56,6 +88,35 @@ if __name__ == '__main__':
                                         help=irc_bot_start.__doc__, )
     load_ircbot.set_defaults(func=irc_bot_start)
 
+    # subparser: build rollups
+    backfill = subparsers.add_parser('rollup_backfill',
+                                     help=rollup_backfill.__doc__, )
+    backfill.set_defaults(func=rollup_backfill)
+
+    # subparser: archive logs of closed months
+    archives = subparsers.add_parser('archive_logs',
+                                     help=archive_logs.__doc__, )
+    archives.set_defaults(func=archive_logs)
+
+    # subparser: import logs of IRC clients
+    importer = subparsers.add_parser('log_import', help=log_import.__doc__, )
+    importer.add_argument('files', nargs='+',
+                          help="Log files of one channel, in chronological "
+                               "order ('-': standard input)")
+    importer.add_argument('--format', choices=('irssi', 'weechat', 'znc'),
+                          default='irssi', help="Format of the files")
+    importer.add_argument('--network', help="Network name "
+                          "(default: the first network)")
+    importer.add_argument('--channel', help="Channel "
+                          "(default: the first channel)")
+    importer.set_defaults(func=log_import)
+
+    # subparser: forge data for the website
+    caching = subparsers.add_parser('data_caching_start',
+                                    help=data_caching_start.__doc__, )
+    caching.set_defaults(func=data_caching_start)
+
     # get program args and launch associated command
     args = parser.parse_args()
+    commons.init()
     args.func(args)
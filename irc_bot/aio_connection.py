@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio engine of the bot.
+
+The IRC socket is watched by an asyncio event loop instead of the select()
+loop of the irc library; blocking work (database deletions, backups, flushes)
+is done in a thread pool, so that the loop always answers PING in time.
+
+The handlers of IRCAnalytics are reused as is.
+"""
+
+# Standard imports
+import asyncio
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from irc.client import Reactor, ServerConnection
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import metrics
+from irc_bot.connection import IRCAnalytics, open_database, create_bots
+
+LOGGER = cm.logger()
+
+
+class AioServerConnection(ServerConnection):
+    """ServerConnection whose messages are always sent from the event loop.
+
+    ..Note: Handlers executed in the thread pool can reply safely.
+    """
+
+    def send_raw(self, string):
+        """Send raw string to the server (see ServerConnection.send_raw)"""
+        if self.reactor.in_loop():
+            ServerConnection.send_raw(self, string)
+        else:
+            self.reactor.loop.call_soon_threadsafe(
+                ServerConnection.send_raw, self, string
+            )
+
+
+class AioReactor(Reactor):
+    """Reactor driven by an asyncio event loop.
+
+    The irc library provides hooks for external event loops: sockets are
+    registered as readers of the loop, and delayed commands (reconnection...)
+    are scheduled with call_later().
+
+    Attributes:
+        - public: loop, asyncio event loop
+        - private: _fds, file descriptors watched by the loop
+            <dict <socket>: <int>>
+        - private: _loop_thread, identifier of the thread running the loop
+            (the one which creates the reactor)
+    """
+
+    def __init__(self, loop=None):
+        """Constructor
+        :param: Optional event loop (default: the current loop).
+        :type: <asyncio.AbstractEventLoop>
+        """
+        self.loop = loop or asyncio.get_event_loop()
+        self._fds = dict()
+        self._loop_thread = threading.get_ident()
+        Reactor.__init__(self,
+                         on_connect=self._add_socket,
+                         on_disconnect=self._remove_socket,
+                         on_schedule=self._schedule)
+        # Closed sockets must be removed from the loop
+        self.add_global_handler("disconnect", self._on_socket_closed, -20)
+
+    def server(self):
+        """Create and return an AioServerConnection object"""
+        connection = AioServerConnection(self)
+        with self.mutex:
+            self.connections.append(connection)
+        return connection
+
+    def in_loop(self):
+        """Return True if the caller is the thread running the loop"""
+        return self._loop_thread == threading.get_ident()
+
+    def _add_socket(self, sock):
+        """Watch the given socket"""
+        self._fds[sock] = sock.fileno()
+        self.loop.add_reader(self._fds[sock], self.process_data, [sock])
+
+    def _remove_socket(self, sock):
+        """Stop watching the given socket"""
+        fd = self._fds.pop(sock, None)
+        if fd is not None:
+            self.loop.remove_reader(fd)
+
+    def _on_socket_closed(self, connection, event):
+        """Stop watching the sockets closed by a disconnection"""
+        for sock in [sock for sock in self._fds if sock.fileno() == -1]:
+            self._remove_socket(sock)
+
+    def _schedule(self, delay):
+        """Call process_timeout() after the given delay (in seconds).
+
+        ..Note: Commands can be scheduled from any thread.
+        ..Note: A small margin avoids a wake-up before the command is due.
+        """
+        self.loop.call_soon_threadsafe(
+            self.loop.call_later, delay + 0.01, self.process_timeout
+        )
+
+    def process_forever(self, timeout=0.2):
+        """Run the event loop until SIGINT or SIGTERM is received
+
+        ..Note: Signals may be received by other threads; the loop
+            is woken up by its own handlers.
+        """
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.loop.stop)
+        self.loop.run_forever()
+        LOGGER.info("Event loop stopped !")
+
+
+class AioIRCAnalytics(IRCAnalytics):
+    """IRCAnalytics bot driven by an asyncio event loop.
+
+    Blocking calls of the handlers are done by a single thread
+    (their order is kept).
+
+    Attributes:
+        - private: _executor, thread pool used for blocking calls
+    """
+
+    reactor_class = AioReactor
+
+    def __init__(self, **kwargs):
+        """Pass arguments to the constructor of the parent class"""
+        IRCAnalytics.__init__(self, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def run_blocking(self, func, *args):
+        """Call the given function in the thread pool.
+
+        ..Note: The event loop is never blocked.
+        """
+        future = self.reactor.loop.run_in_executor(self._executor, func, *args)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        """Log the exception raised by a blocking call (if any)"""
+        if not future.cancelled() and future.exception() is not None:
+            LOGGER.error("Blocking call failed; " + str(future.exception()))
+
+    def shutdown(self):
+        """Wait for the blocking calls, then save pending events"""
+        self._executor.shutdown(wait=True)
+        IRCAnalytics.shutdown(self)
+
+
+def main():
+    """Start the bots (one per network) with the asyncio engine
+
+    ..Note: All the bots share the same event loop.
+    """
+
+    # Log records are written to files by a dedicated thread
+    cm.log_in_background()
+
+    db_session, writer = open_database()
+    metrics.MetricsExporter().start()
+    bots = create_bots(AioIRCAnalytics, db_session, writer)
+
+    # Start the bots
+    try:
+        for bot_instance in bots[1:]:
+            # Same as start() without running the loop
+            bot_instance._connect()
+        bots[0].start()
+    finally:
+        # Pending events are saved on exit (KeyboardInterrupt, SystemExit...)
+        for bot_instance in bots:
+            bot_instance.shutdown()
+        LOGGER.info("Saving pending events...")
+        writer.stop()
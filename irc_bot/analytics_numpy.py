@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregation of logs with NumPy (analytics backend 'numpy').
+
+Columns of the logs (epoch seconds, user id) are read in bulk from SQLite
+into NumPy arrays; histograms, averages & top posters are computed
+with bincount().
+The results are the same as the ones of the 'sql' backend.
+
+..Note: NumPy is an optional dependency, only needed by this backend.
+"""
+
+# Standard imports
+import itertools as it
+# Custom imports
+import numpy as np
+from sqlalchemy import select, and_, cast, func, Integer
+from irc_bot import commons as cm
+from irc_bot import database as db
+from irc_bot import metrics
+
+LOGGER = cm.logger()
+
+# Number of seconds in a day & in an hour
+DAY  = 86400
+HOUR = 3600
+# Weekday of 1970-01-01 (Thursday; 0 is Monday)
+EPOCH_WEEKDAY = 3
+
+
+def sql_epoch(column):
+    """SQL expression of the given timestamp column in seconds since 1970.
+
+    ..Note: Timestamps are local times, read as UTC times: days & hours
+        computed from these seconds are the local ones.
+    """
+    return cast(func.strftime('%s', column), Integer)
+
+
+def load_column(session, column, start=None, end=None, network=None,
+                channel=None, event=None):
+    """Read the given column of the logs into an array.
+
+    ..Note: Rows are read from the DBAPI cursor; no Python object
+        is built for them.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Callable returning the SQL expression to read
+        for a log table (see iter_log_tables()).
+    :param arg3: Optional beginning of the range (included).
+    :param arg4: Optional end of the range (excluded).
+    :param arg5: Optional network name (default: all networks).
+    :param arg6: Optional channel (default: all channels).
+    :param arg7: Optional type of event (default: all events).
+    :type arg1: <SQL session object>
+    :type arg2: <callable>
+    :type arg3: <datetime>
+    :type arg4: <datetime>
+    :type arg5: <str>
+    :type arg6: <str>
+    :type arg7: <int>
+    :return: Values of the column.
+    :rtype: <numpy.ndarray <int64>>
+    """
+    arrays = list()
+    for table in db.iter_log_tables(session, start, end):
+        conditions = db.channel_filter(table.c, network, channel)
+        if start is not None:
+            conditions.append(table.c.timestamp >= start)
+        if end is not None:
+            conditions.append(table.c.timestamp < end)
+        if event is not None:
+            conditions.append(table.c.event == event)
+
+        cursor = session.execute(
+            select([column(table)]).where(and_(*conditions))).cursor
+        arrays.append(np.fromiter(it.chain.from_iterable(cursor),
+                                  dtype=np.int64))
+    return np.concatenate(arrays)
+
+
+@metrics.timed(metrics.AGGREGATION_SECONDS, 'numpy.get_messages_per_hour')
+def get_messages_per_hour(session, start, end, network=None, channel=None):
+    """Get the number of messages per hour of the day in the given range.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Beginning of the range (included).
+    :param arg3: End of the range (excluded).
+    :param arg4: Optional network name (default: all networks).
+    :param arg5: Optional channel (default: all channels).
+    :type arg1: <SQL session object>
+    :type arg2: <datetime>
+    :type arg3: <datetime>
+    :type arg4: <str>
+    :type arg5: <str>
+    :return: Lists of hours & number of messages
+    :rtype: [[labels], [values]]
+
+    """
+    epochs = load_column(session, lambda table: sql_epoch(table.c.timestamp),
+                         start, end, network, channel, cm.IRC_MSG)
+    numbers = np.bincount(epochs // HOUR % 24, minlength=24)
+
+    all_messages_by_hours = [tuple(range(00,24)), tuple(numbers.tolist())]
+    LOGGER.debug("Messages per hour : " + str(all_messages_by_hours))
+    return all_messages_by_hours
+
+
+@metrics.timed(metrics.AGGREGATION_SECONDS, 'numpy.get_top_posters')
+def get_top_posters(session, start, end, network=None, channel=None):
+    """Get pseudo & number of messages in the given range.
+
+    ..Note: 15 most common
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Beginning of the range (included).
+    :param arg3: End of the range (excluded).
+    :param arg4: Optional network name (default: all networks).
+    :param arg5: Optional channel (default: all channels).
+    :type arg1: <SQL session object>
+    :type arg2: <datetime>
+    :type arg3: <datetime>
+    :type arg4: <str>
+    :type arg5: <str>
+    :return: Lists of labels & number of messages
+    :rtype: [[labels], [values]]
+
+    """
+    user_ids = load_column(session, lambda table: table.c.user_id,
+                           start, end, network, channel, cm.IRC_MSG)
+    # Ids of users are small integers: count them by index
+    numbers = np.bincount(user_ids)
+    posters = np.flatnonzero(numbers)
+    # Most messages first, then the oldest users (lowest ids)
+    top = posters[np.lexsort((posters, -numbers[posters]))[:15]]
+
+    return db.top_posters_names(session, zip(top.tolist(),
+                                             numbers[top].tolist()))
+
+
+@metrics.timed(metrics.AGGREGATION_SECONDS, 'numpy.get_average_msgs_per_day')
+def get_average_msgs_per_day(session, network=None, channel=None):
+    """Return a list of average messages per day
+    since the beginning of the logging
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Optional network name (default: all networks).
+    :param arg3: Optional channel (default: all channels).
+    :type arg1: <SQL session object>
+    :type arg2: <str>
+    :type arg3: <str>
+    :return: List of values.
+    :rtype: <list>
+
+    """
+    days = load_column(session, lambda table: sql_epoch(table.c.timestamp),
+                       network=network, channel=channel) // DAY
+    # Number of events & of days for each day of the week
+    numbers = np.bincount((days + EPOCH_WEEKDAY) % 7, minlength=7)
+    nb_days = np.bincount((np.unique(days) + EPOCH_WEEKDAY) % 7, minlength=7)
+
+    averages = [number / nb_day if nb_day else 0.0
+                for number, nb_day in zip(numbers.tolist(), nb_days.tolist())]
+    LOGGER.debug("Average per day:" + str(averages))
+    return averages
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Online backup of the database with the backup API of SQLite.
+
+The copy is made page by page in a background thread, from a consistent
+snapshot of the database: the bot keeps committing events meanwhile.
+"""
+
+# Standard imports
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+import datetime
+from threading import Thread, Lock
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import database as db
+
+LOGGER = cm.logger()
+
+# Only one backup at a time (the database can be shared by several bots)
+_RUNNING = Lock()
+
+
+class DatabaseBackup(Thread):
+    """Overriding the Thread class and only override the __init__()
+    and run() methods of this class.
+
+    This class is used to load an independant thread able to copy
+    the database in BACKUP_DIR, BACKUP_STEP_PAGES pages at a time.
+
+    - In WAL mode, a read transaction is held during the copy: pages are
+        read from the same snapshot, and writers are never blocked.
+    - In rollback journal mode, the database is copied in a single step
+        (writers wait for the end of the copy).
+
+    The backup is compressed (gzip) if BACKUP_COMPRESS is set, and only
+    the BACKUP_KEEP most recent backups are kept.
+    Archives of logs are copied once in BACKUP_DIR/archives/.
+
+    Attributes:
+        - private: _report, optional callable used to send messages
+            about the progress of the backup (called from this thread).
+        - public: path, path of the backup (once done) <str>
+    """
+
+    def __init__(self, report=None):
+        """Constructor
+        :param: Optional callable taking a message.
+        :type: <callable>
+        """
+        Thread.__init__(self, name="DatabaseBackup", daemon=True)
+        self._report = report
+        self._next_report = cm.BACKUP_REPORT_PERCENT
+        self.path = None
+
+    def report(self, message):
+        """Send the given message (if a callable is given) & log it"""
+        LOGGER.info("Backup: " + message)
+        if self._report is not None:
+            self._report(message)
+
+    def _progress(self, status, remaining, total):
+        """Called by SQLite after each step of the copy"""
+        done = 100 * (total - remaining) // max(total, 1)
+        if remaining and done >= self._next_report:
+            self.report("{}% done".format(done))
+            while self._next_report <= done:
+                self._next_report += cm.BACKUP_REPORT_PERCENT
+        # Leave disk bandwidth to the bot
+        time.sleep(cm.BACKUP_STEP_DELAY)
+
+    def copy(self, tmp_path):
+        """Copy the database in the given file with the backup API
+
+        :param: Path of the copy.
+        :type: <str>
+        """
+        source = sqlite3.connect(
+            db.sqlite_uri(cm.DIR_DATA + 'bdd.sqlite', read_only=True),
+            uri=True
+        )
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.execute('PRAGMA busy_timeout = 5000')
+            wal = source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            pages = -1
+            if wal:
+                # Snapshot: the copy is never restarted by new commits
+                source.execute('BEGIN')
+                source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+                pages = cm.BACKUP_STEP_PAGES
+            source.backup(target, pages=pages, progress=self._progress)
+        finally:
+            target.close()
+            source.close()
+
+    @staticmethod
+    def compress(path, gz_path):
+        """Compress the given file (gzip) & remove it
+
+        ..Note: On failure, the partial compressed file is removed
+            & the given file is kept.
+
+        :param arg1: Path of the file.
+        :param arg2: Path of the compressed file.
+        :type arg1: <str>
+        :type arg2: <str>
+        :return: Path of the compressed file.
+        :rtype: <str>
+        """
+        try:
+            with open(path, 'rb') as file, gzip.open(gz_path, 'wb') as gz_file:
+                shutil.copyfileobj(file, gz_file, 1024 * 1024)
+        except OSError:
+            if os.path.exists(gz_path):
+                os.remove(gz_path)
+            raise
+        os.remove(path)
+        return gz_path
+
+    @staticmethod
+    def remove_old_backups():
+        """Keep the BACKUP_KEEP most recent backups
+
+        :return: Number of removed backups.
+        :rtype: <int>
+        """
+        backups = sorted(name for name in os.listdir(cm.BACKUP_DIR)
+                         if name.startswith('bdd.sqlite_') and
+                         not name.endswith('.tmp'))
+        old_backups = backups[:-cm.BACKUP_KEEP] if cm.BACKUP_KEEP else []
+        for name in old_backups:
+            os.remove(os.path.join(cm.BACKUP_DIR, name))
+        return len(old_backups)
+
+    def run(self):
+        """Heart of the class; This method makes the backup."""
+
+        if not _RUNNING.acquire(blocking=False):
+            self.report("a backup is already running")
+            return
+
+        start = time.monotonic()
+        os.makedirs(cm.BACKUP_DIR, exist_ok=True)
+        path = cm.BACKUP_DIR + 'bdd.sqlite_' + \
+            datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
+        tmp_path = path + '.tmp'
+        try:
+            self.report("started")
+            self.copy(tmp_path)
+            if cm.BACKUP_COMPRESS:
+                # Temporary name: ignored by remove_old_backups()
+                path += '.gz'
+                tmp_path = self.compress(tmp_path, path + '.tmp')
+            os.replace(tmp_path, path)
+            self.path = path
+
+            db.backup_archives(cm.BACKUP_DIR + 'archives/')
+            self.remove_old_backups()
+            self.report("done in {:.0f}s: {} ({:.1f} MiB)".format(
+                time.monotonic() - start,
+                os.path.basename(path),
+                os.path.getsize(path) / 2**20))
+        except (OSError, sqlite3.Error) as e:
+            self.report("failed; " + str(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            _RUNNING.release()
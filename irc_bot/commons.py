@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from queue import Queue
 from irc_bot import info
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # Directory paths
 DIR_LOGS         = 'logs/'
@@ -28,10 +29,20 @@ BOT_MESSAGE      = "#BIG Analytics " + info.PACKAGE_VERSION + \
     " - http://pro-domo.ddns.net/pirc_bot"
 CHANNEL          = "#big_rennes"
 #CHANNEL          = "#big_test"
-# During the import, variables are filled with pseudodyms in corresponding files
+# All the networks & channels watched by the bot:
+# (network name, server url, server port, [channels])
+# The first channel is the default one (website, events logged before
+# the support of several channels).
+NETWORKS         = [
+    ('freenode', SERVER_URL, SERVER_PORT, [CHANNEL]),
+#    ('oftc', "irc.oftc.net", 6667, ["#my_channel", "#my_other_channel"]),
+]
+# During init(), sets are filled with pseudodyms in corresponding files
 ENABLE_USERS_WHITELIST = False
-USERS_WHITELIST  = DIR_DATA + "pseudos_whitelist.txt"
-ADMINS_LIST      = DIR_DATA + "admins.txt"
+USERS_WHITELIST_FILE = DIR_DATA + "pseudos_whitelist.txt"
+ADMINS_LIST_FILE = DIR_DATA + "admins.txt"
+USERS_WHITELIST  = set()
+ADMINS_LIST      = set()
 ADMINS_HOSTS_REG = ''
 
 # Nginx prefix
@@ -40,10 +51,158 @@ NGINX_PREFIX     = "/pirc_bot"
 STATIC_PREFIX   = NGINX_PREFIX + '/static'
 
 # Disable real-time generation of graphs
-# A thread will be used to generate data,
-# according to the following delay (in seconds)
+# A thread will be used to generate data when the database is modified:
+# - at most once every CACHE_MIN_INTERVAL seconds,
+# - after CACHE_DEBOUNCE seconds without new event,
+# - at most CACHE_MAX_STALENESS seconds after a new event.
+# DELAY (in seconds) is used only if the revision of data is not available.
 ENABLE_REALTIME  = False
 DELAY            = 40
+CACHE_MIN_INTERVAL  = 5
+CACHE_DEBOUNCE      = 2
+CACHE_MAX_STALENESS = 20
+# Data is forged by only one process & shared with the others
+# through a snapshot file (Gunicorn workers)
+CACHE_SNAPSHOT   = DIR_DATA + 'forged_data.pickle'
+CACHE_LOCK_FILE  = DIR_DATA + 'forged_data.lock'
+# Delay (in seconds) between two checks of the revision of the database
+# (leader) or of the snapshot (other processes)
+CACHE_POLL_DELAY = 1
+# Delay (in seconds) before a new attempt when data can't be forged
+# (database locked...)
+CACHE_RETRY_DELAY = 10
+# Switch to True if data is forged by a dedicated process
+# (make data_caching_start); workers will only read the snapshot.
+CACHE_EXTERNAL_PRODUCER = False
+
+# SQLite tuning profile applied on each connection (see SQLITE_PROFILES):
+# - 'wal': write-ahead log; the bot (writer) & the website (readers)
+#   don't block each other,
+# - 'default': rollback journal & settings of SQLite.
+SQLITE_PROFILE   = 'wal'
+# PRAGMA statements of each profile (journal_mode is persistent,
+# cache_size < 0: size in KiB)
+SQLITE_PROFILES  = {
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -16000,
+        'busy_timeout': 5000,
+    },
+    'default': {
+        'journal_mode': 'DELETE',
+        'busy_timeout': 5000,
+    },
+}
+# The website opens the database in read-only mode
+WEBSITE_READ_ONLY = True
+
+# Aggregation of data for the website:
+# - 'rollup': read the aggregates maintained by the bot (fastest),
+# - 'sql': let SQLite count the raw logs,
+# - 'numpy': read the columns of the raw logs into NumPy arrays
+#   & count them with NumPy (requires NumPy).
+ANALYTICS_BACKEND = 'rollup'
+
+# JSON API
+# Time (in seconds) during which caches can use a response without revalidation
+API_MAX_AGE = {
+    'top_posters': 5,
+    'hourly': 5,
+    'average': 300,
+    'graph': 30,
+}
+# Number of items sent in each chunk of streamed responses
+API_CHUNK_SIZE = 500
+
+# Metrics of the graphs of relationships (degree, PageRank, betweenness,
+# communities) used to size & colour the nodes; computed only when the edges
+# change, by GRAPH_METRICS_PROCESSES processes (0: by the thread which forges
+# data). The betweenness is approximated from GRAPH_BETWEENNESS_SAMPLES
+# random sources (0: exact).
+GRAPH_METRICS_PROCESSES = 1
+GRAPH_BETWEENNESS_SAMPLES = 64
+
+# Levels of detail of the graphs of relationships (see graph_pruning.prune()),
+# pruned along with the forge of data. The website shows GRAPH_DEFAULT_LEVEL
+# unless another level is requested (?level=...); top_edges bounds the size
+# of the graph sent to browsers. A graph within the top_edges of a level
+# is sent in full.
+GRAPH_LEVELS = {
+    'full': {},
+    'high': {'top_edges': 5000, 'collapse_leaves': True},
+    'medium': {'top_edges': 1500, 'min_weight': 2, 'collapse_leaves': True},
+    'low': {'top_edges': 300, 'min_weight': 2, 'k_core': 2,
+            'collapse_leaves': True},
+}
+GRAPH_DEFAULT_LEVEL = 'medium'
+
+# Engine of the bot:
+# - 'reactor': select() loop of the irc library,
+# - 'asyncio': asyncio event loop; admin commands are done in a thread pool
+#   and never delay the answers to the server (PING).
+# Deletions of users & backups always run in background threads.
+IRC_ENGINE       = 'reactor'
+
+# Minimum delay (in seconds) between two dumps of the connected users
+# of a channel (debug level)
+NICKS_LOG_DELAY  = 60
+
+# Write-behind buffer of IRC events
+# Events are committed in bulk when the buffer reaches WRITE_BATCH_SIZE rows,
+# or WRITE_FLUSH_DELAY seconds after the first pending event.
+# If the database stays locked, at most WRITE_MAX_PENDING events are kept
+# for the next attempts (the oldest ones are dropped).
+# On shutdown, the last commit is retried for at most WRITE_STOP_TIMEOUT
+# seconds before the remaining events are dropped.
+WRITE_BATCH_SIZE   = 200
+WRITE_FLUSH_DELAY  = 2
+WRITE_MAX_PENDING  = 20000
+WRITE_STOP_TIMEOUT = 30
+
+# Archives of logs
+# Logs of closed months are moved from the database to read-only files
+# (DIR_DATA/archives/log_<year>_<month>.sqlite) by the bot, once every
+# ARCHIVE_CHECK_DELAY seconds; the current month & the ARCHIVE_HOT_MONTHS - 1
+# previous ones stay in the database. Aggregates of the website are kept.
+# Archived logs are deleted like purged users (by ranges of PURGE_CHUNK_SIZE
+# ids). Set ENABLE_ARCHIVES to False to keep all the logs in the database.
+ENABLE_ARCHIVES   = True
+ARCHIVE_HOT_MONTHS = 2
+ARCHIVE_CHECK_DELAY = 3600 * 6
+
+# Backups of the database (admin command 37)
+# The database is copied BACKUP_STEP_PAGES pages at a time
+# (BACKUP_STEP_DELAY seconds between steps) in BACKUP_DIR; the progress
+# is reported every BACKUP_REPORT_PERCENT %. Only the BACKUP_KEEP most recent
+# backups are kept (0: keep all).
+BACKUP_DIR        = DIR_DATA + 'backups/'
+BACKUP_COMPRESS   = True
+BACKUP_KEEP       = 7
+BACKUP_STEP_PAGES = 1024
+BACKUP_STEP_DELAY = 0.01
+BACKUP_REPORT_PERCENT = 25
+
+# Deletion of users (admin commands 34 to 36 & 38)
+# Logs & relationships are deleted in background, by ranges of
+# PURGE_CHUNK_SIZE ids (one transaction per range, PURGE_STEP_DELAY seconds
+# between them); the progress is reported every PURGE_REPORT_PERCENT %.
+PURGE_CHUNK_SIZE  = 20000
+PURGE_STEP_DELAY  = 0.01
+PURGE_REPORT_PERCENT = 25
+
+# Import of the logs of IRC clients (python -m irc_bot log_import)
+# Rows are inserted IMPORT_BATCH_SIZE at a time (one transaction each).
+IMPORT_BATCH_SIZE = 100000
+
+# Metrics of the bot (Prometheus text format)
+# Written every METRICS_EXPORT_DELAY seconds in METRICS_FILE
+# (textfile collector of node_exporter; None to disable),
+# and served on the Unix socket METRICS_SOCKET (None to disable).
+METRICS_FILE      = DIR_DATA + 'pirc_bot.prom'
+METRICS_SOCKET    = None
+METRICS_EXPORT_DELAY = 15
 
 # Logging
 LOGGER_NAME      = info.PACKAGE_NAME
@@ -56,6 +215,23 @@ IRC_QUIT = 1
 IRC_KICK = 2
 IRC_MSG  = 3
 
+def get_channels():
+    """Return all the watched channels.
+
+    :return: List of (network name, channel).
+    :rtype: <list <tuple <str>, <str>>>
+    """
+    return [(network, channel)
+            for network, _, _, channels in NETWORKS for channel in channels]
+
+def default_channel():
+    """Return the default channel (the first one of NETWORKS)
+
+    :return: Network name & channel.
+    :rtype: <tuple <str>, <str>>
+    """
+    return get_channels()[0]
+
 # IRC config loading
 def load_users(file):
     """Return a list of users in the given text file"""
@@ -64,11 +240,8 @@ def load_users(file):
 
 def update_users():
     """Refresh the whitelist file with the current whitelist"""
-    with open(DIR_DATA + "pseudos_whitelist.txt", 'w') as file:
+    with open(USERS_WHITELIST_FILE, 'w') as file:
         [file.write(user + '\n') for user in USERS_WHITELIST]
-
-USERS_WHITELIST = load_users(USERS_WHITELIST)
-ADMINS_LIST = load_users(ADMINS_LIST)
 ################################################################################
 
 def logger(name=LOGGER_NAME, logfilename=None):
@@ -81,26 +254,45 @@ def logger(name=LOGGER_NAME, logfilename=None):
 
 
 _logger = logging.getLogger(LOGGER_NAME)
-_logger.setLevel(LOG_LEVEL)
-
-# log file
-formatter    = logging.Formatter(
-    '%(asctime)s :: %(levelname)s :: %(message)s'
-)
-file_handler = RotatingFileHandler(
-    DIR_LOGS + LOGGER_NAME + '.log',
-    'a', 1000000, 1
-)
-file_handler.setLevel(LOG_LEVEL)
-file_handler.setFormatter(formatter)
-_logger.addHandler(file_handler)
-
-# terminal log
-stream_handler = logging.StreamHandler()
-formatter      = logging.Formatter('%(levelname)s: %(message)s')
-stream_handler.setFormatter(formatter)
-stream_handler.setLevel(LOG_LEVEL)
-_logger.addHandler(stream_handler)
+_initialized = False
+
+
+def init():
+    """Load the lists of users & attach the handlers of the logger.
+
+    Importing this module has no side effect: entry points (bot, website,
+    commands) call this function before anything else.
+    Next calls do nothing.
+    """
+    global _initialized
+    if _initialized:
+        return
+    _initialized = True
+
+    # The sets are filled in place (modules may hold a reference)
+    USERS_WHITELIST.update(load_users(USERS_WHITELIST_FILE))
+    ADMINS_LIST.update(load_users(ADMINS_LIST_FILE))
+
+    _logger.setLevel(LOG_LEVEL)
+
+    # log file
+    formatter    = logging.Formatter(
+        '%(asctime)s :: %(levelname)s :: %(message)s'
+    )
+    file_handler = RotatingFileHandler(
+        DIR_LOGS + LOGGER_NAME + '.log',
+        'a', 1000000, 1
+    )
+    file_handler.setLevel(LOG_LEVEL)
+    file_handler.setFormatter(formatter)
+    _logger.addHandler(file_handler)
+
+    # terminal log
+    stream_handler = logging.StreamHandler()
+    formatter      = logging.Formatter('%(levelname)s: %(message)s')
+    stream_handler.setFormatter(formatter)
+    stream_handler.setLevel(LOG_LEVEL)
+    _logger.addHandler(stream_handler)
 
 
 def log_level(level):
@@ -112,5 +304,18 @@ def log_level(level):
         handler.setLevel(level.upper())
 
 
+def log_in_background():
+    """Write log records from a dedicated thread.
 
+    The handlers of the logger are replaced by a queue; the caller is never
+    blocked by the writing of files.
 
+    :return: Listener of the queue (already started).
+    :rtype: <QueueListener>
+    """
+    log_queue = Queue()
+    listener  = QueueListener(log_queue, *_logger.handlers,
+                              respect_handler_level=True)
+    _logger.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
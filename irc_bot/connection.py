@@ -8,9 +8,11 @@ It saves all events in database.
 # Standard imports
 import datetime
 import re
-from shutil import copyfile
+import time
+from threading import Thread
 from functools import wraps
 from irc.bot import *
+from sqlalchemy.exc import OperationalError
 # Tuto:
 # https://openclassrooms.com/courses/programmer-un-bot-irc-simplement-avec-ircbot
 # IRC events:
@@ -19,6 +21,11 @@ from irc.bot import *
 # Custom imports
 from irc_bot import commons as cm
 from irc_bot import database as db
+from irc_bot import metrics
+from irc_bot.write_behind import WriteBehind
+from irc_bot.backup import DatabaseBackup
+from irc_bot.purge import UserPurge
+from irc_bot.nick_tracker import NickTracker, ADDRESSEE_REG
 
 LOGGER = cm.logger()
 
@@ -42,6 +49,47 @@ def param_not_none(func):
     return modified_func
 
 
+def open_database():
+    """Open the database & start the write-behind thread.
+
+    ..Note: The buffer can be shared by several bots (one per network).
+
+    :return: SQLAlchemy session & write-behind buffer.
+    :rtype: <tuple <SQL session object>, <WriteBehind>>
+    """
+    db_session = db.loading_sql()
+    if db.rollups_are_missing(db_session):
+        LOGGER.info("Building rollups from existing logs...")
+        db.backfill_rollups(db_session)
+    # Events are committed in bulk outside of the reactor thread;
+    # aggregates & revision of data are updated in the same transaction
+    writer = WriteBehind(db_session, db.prepare_commit)
+    writer.start()
+    if cm.ENABLE_ARCHIVES:
+        Thread(target=archive_periodically, args=(db_session,),
+               name="Archives", daemon=True).start()
+    return db_session, writer
+
+
+def archive_periodically(db_session):
+    """Move the logs of closed months into archives every
+    ARCHIVE_CHECK_DELAY seconds (dedicated thread).
+
+    :param: SQLAlchemy scoped session.
+    :type: <SQL session object>
+    """
+    while True:
+        try:
+            db.archive_logs(db_session)
+        except (OSError, OperationalError) as e:
+            # Retry later (database locked, disk full...)
+            LOGGER.error("Archives: logs not archived; " + str(e))
+            db_session.rollback()
+        finally:
+            db_session.remove()
+        time.sleep(cm.ARCHIVE_CHECK_DELAY)
+
+
 class IRCAnalytics(SingleServerIRCBot):
     """
     Inherit from SingleServerIRCBot:
@@ -51,18 +99,52 @@ class IRCAnalytics(SingleServerIRCBot):
     serv <irc.ServerConnection>: permits to communicate with the server
     ev <irc.Event>: informations about the event
 
+    One bot is connected to one network; it can watch several channels.
+    Events are saved with their network & channel.
+
     """
 
-    def __init__(self, **kwargs):
-        """Pass arguments to the constructor of the parent class"""
+    def __init__(self, network=None, channels=None, db_session=None,
+                 writer=None, **kwargs):
+        """Pass arguments to the constructor of the parent class
+
+        :param arg1: Optional network name
+            (default: the first network of NETWORKS in commons).
+        :param arg2: Optional channels to join (default: the ones of the
+            first network).
+        :param arg3: Optional SQLAlchemy session shared by the bots.
+        :param arg4: Optional write-behind buffer shared by the bots;
+            by default the bot opens the database & owns its buffer.
+        :type arg1: <str>
+        :type arg2: <list <str>>
+        :type arg3: <SQL session object>
+        :type arg4: <WriteBehind>
+        """
         # Tweak reconnection delay
         kwargs['reconnection_interval'] = 6
         SingleServerIRCBot.__init__(self, **kwargs)
 
+        if network is None:
+            network, _, _, channels = cm.NETWORKS[0]
+        self._network  = network
+        self._channels = channels
+        # Admin replies are sent on the first channel
+        self._home_channel = channels[0]
+        # Connected users of each channel
+        self._nicks = NickTracker()
+        self._nicks.register(self.connection)
+        # Events received (by type)
+        self.connection.add_global_handler("all_events", self._count_event,
+                                           -30)
+
         # Initialize database
-        self._db_session = db.loading_sql()
+        self._owns_writer = writer is None
+        if writer is None:
+            db_session, writer = open_database()
+        self._db_session = db_session
+        self._writer = writer
         # Init regex for names in conversation
-        self._expr_reg = re.compile('^(\w*): (.*)$')
+        self._expr_reg = ADDRESSEE_REG
         # Init regex for admin commands
 #        self._admin_reg = re.compile('^(?P<command>3[\d]{1})( (?P<param>.*))?$')
         # Init regex for admin hosts
@@ -75,29 +157,66 @@ class IRCAnalytics(SingleServerIRCBot):
                                  '35' : self.user_remove_relationships,
                                  '36' : self.full_remove_asshole,
                                  '37' : self.db_backup,
+                                 '38' : self.batch_remove,
                                 }
 
     def get_current_date(self):
         """Return string with current date"""
         return datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
 
-    def insert_in_database(self, pseudo, event):
-        """Insert the event in database & commit it"""
-        log = db.Log(pseudo, event)
-        self._db_session.add(log)
-        self._db_session.commit()
+    @staticmethod
+    def _count_event(serv, ev):
+        metrics.IRC_EVENTS.inc(ev.type)
+
+    @metrics.timed(metrics.HANDLER_SECONDS, 'insert_in_database')
+    def insert_in_database(self, pseudo, event, channel):
+        """Queue the event; it will be committed by the write-behind thread"""
+        self._writer.add(db.Log(pseudo, event, self._network, channel))
+
+    def run_blocking(self, func, *args):
+        """Call the given function which may block (database, disk...).
+
+        ..Note: The function is called immediately; the asyncio engine
+            calls it in a thread pool (see aio_connection.py).
+        """
+        return func(*args)
+
+    def shutdown(self):
+        """Commit all pending events & stop the write-behind thread
+
+        ..Note: A shared buffer is stopped by its owner (see main()).
+        """
+        if not self._owns_writer:
+            self._writer.flush()
+            return
+        LOGGER.info("Saving pending events...")
+        self._writer.stop()
+
+    def die(self, msg="Bye, cruel world!"):
+        """Let the bot die; pending events are saved before"""
+        self.shutdown()
+        SingleServerIRCBot.die(self, msg)
+
+    def on_disconnect(self, serv, ev):
+        """Called when the bot is disconnected from the server.
+
+        Pending events are saved; the reconnection is handled by the parent class.
+        """
+        LOGGER.info("Bot disconnected from server <" + str(ev.source) + ">")
+        self.run_blocking(self._writer.flush)
 
     def on_welcome(self, serv, ev):
         """Called when the bot is connected to the server.
 
-        This method permits to join a specifica channel
+        This method permits to join the channels of the network
         """
         LOGGER.info("Bot connected on server <" + ev.source + \
                     ">, nick : <" + ev.target + ">")
         # LOGGER.info(*ev.arguments)
 
-        # Join channel
-        serv.join(cm.CHANNEL)
+        # Join channels
+        for channel in self._channels:
+            serv.join(channel)
 
     def on_whoisuser(self, serv, ev):
         """Print server response to the command "serv.whois([author])"""
@@ -120,22 +239,21 @@ class IRCAnalytics(SingleServerIRCBot):
         #Handle admin commands
         LOGGER.info("<" + ev.source.nick + "> is an admin")
 
-        # If there is no/bad command or no parameter => an exception is raised
-        # (because of access to a bad index in list ev.arguments)
         if len(ev.arguments) == 0:
             return
 
-        try:
-            # Find the correct function according to the command code
-            # See the constructor for the mapping code <=> function
-            func = self._admin_functions[ev.arguments[0]]
-            # If the code is not unknown we call the function
-            func(serv, ev.arguments[1])
-        except:
-            # Some func may accept None (a decorator will filter the call)
-            func(serv, None)
-            pass
+        # Find the correct function according to the command code
+        # See the constructor for the mapping code <=> function
+        func = self._admin_functions.get(ev.arguments[0])
+        if func is None:
+            return
 
+        # Some func may accept None (a decorator will filter the call)
+        param = ev.arguments[1] if len(ev.arguments) > 1 else None
+        # Admin commands may be slow (files, start of background jobs)
+        self.run_blocking(func, serv, param)
+
+    @metrics.timed(metrics.HANDLER_SECONDS, 'on_pubmsg')
     def on_pubmsg(self, serv, ev):
         """Called when a user posts a message"""
         author = ev.source.nick
@@ -149,39 +267,21 @@ class IRCAnalytics(SingleServerIRCBot):
         LOGGER.info(self.get_current_date() + " - <" + \
                      author + "> : " + message)
 
-        # Detection of relationships
-        try:
-            # Raise an exception if message is not a relationship
-            groups = self._expr_reg.match(message).groups()
-            dest = groups[0]
-
-            # Someone is speaking to the bot
-            if dest == cm.BOT_NAME:
-                self.handle_bot_dialog(serv, author, groups[1])
-                #return # TODO: return ?
-
-            # Return on micro message
-            if len(groups[1]) <= 3:
-                return
-
-            # Verify if dest is a connected on the channel
-            connected_users = list(self.channels[ev.target].users())
-            LOGGER.debug("Connected users: " + str(connected_users))
-            if dest not in connected_users:
-                return
-
-            # Add the detected relationship in database
+        # Someone is speaking to the bot
+        match = self._expr_reg.match(message)
+        if match is not None and match.group(1) == cm.BOT_NAME:
+            self.handle_bot_dialog(serv, author, match.group(2), ev.target)
+
+        # Detection of relationships: one edge per distinct connected user
+        # mentioned in the message
+        self._nicks.log_users(ev.target)
+        for dest in self._nicks.get_addressees(ev.target, author, message):
             LOGGER.info("Relation between <" + author + \
                 "> and <" + dest + ">")
-
-            self._db_session.add(db.Edge(author, dest))
-            self._db_session.commit()
-        except AttributeError:
-            # The message was not a relationship
-            pass
+            self._writer.add(db.Edge(author, dest, self._network, ev.target))
 
         # Insert the message event in database
-        self.insert_in_database(author, cm.IRC_MSG)
+        self.insert_in_database(author, cm.IRC_MSG, ev.target)
 
     def on_join(self, serv, ev):
         """Called when a user joins the channel"""
@@ -193,7 +293,7 @@ class IRCAnalytics(SingleServerIRCBot):
             #users = [user for user in self.channels[ev.target].users()]
 
             LOGGER.info(self.get_current_date() + " - The bot <" + \
-                     author + "> joined the channel <" + cm.CHANNEL + ">")
+                     author + "> joined the channel <" + ev.target + ">")
             #LOGGER.info("Users on the channel : " + str(",".join(users)))
 
             # Send message on channel
@@ -202,10 +302,10 @@ class IRCAnalytics(SingleServerIRCBot):
             return
 
         LOGGER.info(self.get_current_date() + " - <" + \
-                     author + "> joined the channel")
+                     author + "> joined the channel <" + ev.target + ">")
 
         # Insert in database
-        self.insert_in_database(author, cm.IRC_JOIN)
+        self.insert_in_database(author, cm.IRC_JOIN, ev.target)
 
     def on_part(self, serv, ev):
         """Called when a user leaves the channel"""
@@ -215,14 +315,26 @@ class IRCAnalytics(SingleServerIRCBot):
         if author == cm.BOT_NAME:
             return
         LOGGER.info(self.get_current_date() + " - <" + \
-                     author + "> left the channel")
+                     author + "> left the channel <" + ev.target + ">")
 
         # Insert in database
-        self.insert_in_database(author, cm.IRC_QUIT)
+        self.insert_in_database(author, cm.IRC_QUIT, ev.target)
 
     def on_quit(self, serv, ev):
-        """Called when a user leaves the server. Same as on_part event."""
-        self.on_part(serv, ev)
+        """Called when a user leaves the server.
+
+        Same as on_part event for each channel of the user.
+        """
+        author = ev.source.nick
+
+        if author == cm.BOT_NAME:
+            return
+        LOGGER.info(self.get_current_date() + " - <" + \
+                     author + "> left the server")
+
+        # The user is removed from the channels after this handler
+        for channel in self._nicks.get_channels(author):
+            self.insert_in_database(author, cm.IRC_QUIT, channel)
 
     def on_kick(self, serv, ev):
         """Called when a user was kicked by another"""
@@ -230,9 +342,8 @@ class IRCAnalytics(SingleServerIRCBot):
 
         # Filter the bot activity (on exit ??)
         if author == cm.BOT_NAME:
-            # Save the session
-            self._db_session.flush()
-            self._db_session.commit()
+            # Save pending events
+            self.run_blocking(self._writer.flush)
             return
 
         # Print only victim's name
@@ -240,13 +351,14 @@ class IRCAnalytics(SingleServerIRCBot):
                      ev.arguments[0] + "> kicked by <" + author + ">")
 
         # Insert in database
-        self.insert_in_database(ev.arguments[0], cm.IRC_KICK)
+        self.insert_in_database(ev.arguments[0], cm.IRC_KICK, ev.target)
 
 
-    def handle_bot_dialog(self, serv, author, message):
+    def handle_bot_dialog(self, serv, author, message, channel):
         """Someone is speaking to the bot.
 
         This function can handle admin commands and help questions.
+        The answer is sent on the given channel.
 
         """
 #        match_admin = self._admin_reg.match(message)
@@ -257,20 +369,20 @@ class IRCAnalytics(SingleServerIRCBot):
             response += " ".join("{}: {} <param/user>".format(k, v.__name__)
                                  for k, v in self._admin_functions.items()) + ']'
 
-            serv.action(cm.CHANNEL, response)
+            serv.action(channel, response)
             return
 
         elif message == 'website' or message == '2':
             """Send anchors of the website"""
-            serv.action(cm.CHANNEL,
+            serv.action(channel,
                 " - Barplots: http://pro-domo.ddns.net/pirc_bot#")
-            serv.action(cm.CHANNEL,
+            serv.action(channel,
                 " - Messages during weeks: http://pro-domo.ddns.net/pirc_bot#line_week")
-            serv.action(cm.CHANNEL,
+            serv.action(channel,
                 " - Messages during days: http://pro-domo.ddns.net/pirc_bot#line_day")
-            serv.action(cm.CHANNEL,
+            serv.action(channel,
                 " - Number of messages per day: http://pro-domo.ddns.net/pirc_bot#data_average")
-            serv.action(cm.CHANNEL,
+            serv.action(channel,
                 " - Graph of relationships: http://pro-domo.ddns.net/pirc_bot#mynetwork")
             return
 
@@ -295,7 +407,7 @@ class IRCAnalytics(SingleServerIRCBot):
         ..Note: Command is <bot name>: 31 <1/0>
         """
         cm.ENABLE_USERS_WHITELIST = True if param == '1' else False
-        serv.action(cm.CHANNEL, "Whitelist protection state is: <" + \
+        serv.action(self._home_channel, "Whitelist protection state is: <" + \
                                 str(cm.ENABLE_USERS_WHITELIST) + ">")
         LOGGER.info("ADMIN: Whitelist state: <" + \
                     str(cm.ENABLE_USERS_WHITELIST) + \
@@ -309,7 +421,7 @@ class IRCAnalytics(SingleServerIRCBot):
         """
         cm.USERS_WHITELIST.add(param)
         cm.update_users()
-        serv.action(cm.CHANNEL, "User <" + param + "> is now authorized.")
+        serv.action(self._home_channel, "User <" + param + "> is now authorized.")
         LOGGER.info("ADMIN: User add: <" + param + ">")
 
     @param_not_none
@@ -324,60 +436,148 @@ class IRCAnalytics(SingleServerIRCBot):
             cm.update_users()
         except KeyError:
             pass
-        serv.action(cm.CHANNEL, "User <" + param + "> is banned.")
+        serv.action(self._home_channel, "User <" + param + "> is banned.")
         LOGGER.info("ADMIN: User remove: <" + param + ">")
 
+    def purge_users(self, serv, names=(), pattern=None, logs=True,
+                    edges=True):
+        """Delete the logs and/or the relationships of the given users
+        in background.
+
+        ..Note: The progress is reported on the first channel;
+            messages are sent by the reactor (see UserPurge).
+
+        :param arg1: Server connection.
+        :param arg2: Optional iterable of pseudos.
+        :param arg3: Optional regular expression matching whole pseudos.
+        :param arg4: Optional boolean; if False logs are kept.
+        :param arg5: Optional boolean; if False relationships are kept.
+        :type arg1: <irc.ServerConnection>
+        :type arg2: <iterable <str>>
+        :type arg3: <str>
+        :type arg4: <boolean>
+        :type arg5: <boolean>
+        """
+        def report(message):
+            self.reactor.execute_delayed(0, serv.action,
+                                         (self._home_channel,
+                                          "User purge: " + message))
+
+        # Pending events are committed by the purge itself
+        UserPurge(self._db_session, names, pattern, logs, edges,
+                  self._writer, report).start()
+
     @param_not_none
     def user_remove_logs(self, serv, param):
-        """Remove the logs for the given user.
+        """Remove the logs for the given user (in background).
 
         ..Note: Command is <bot name>: 34 <user>
         """
-        number = db.Log.delete_user(self._db_session, param)
-        serv.action(cm.CHANNEL,
-                    str(number) + " deleted logs for <" + param + \
-                    ">. Have a nice day.")
+        self.purge_users(serv, [param], edges=False)
         LOGGER.info("ADMIN: Remove logs: <" + param + ">")
 
     @param_not_none
     def user_remove_relationships(self, serv, param):
-        """Remove the relationships for the given user.
+        """Remove the relationships for the given user (in background).
 
         ..Note: Command is <bot name>: 35 <user>
         """
-        number = db.Edge.delete_user(self._db_session, param)
-        serv.action(cm.CHANNEL,
-                    str(number) + " deleted edges for <" + param + \
-                    ">  Have a nice day.")
+        self.purge_users(serv, [param], logs=False)
         LOGGER.info("ADMIN: Remove relations: <" + param + ">")
 
     @param_not_none
     def full_remove_asshole(self, serv, param):
-        """Remove logs & relationships for the given user"""
-        self.user_remove_logs(serv, param)
-        self.user_remove_relationships(serv, param)
+        """Remove logs & relationships for the given user (in background).
+
+        ..Note: Command is <bot name>: 36 <user>
+        """
+        self.purge_users(serv, [param])
+        LOGGER.info("ADMIN: Remove logs & relations: <" + param + ">")
+
+    @param_not_none
+    def batch_remove(self, serv, param):
+        """Remove logs & relationships for several users in a single pass
+        (in background).
+
+        Users are given by their pseudos (separated by spaces or commas),
+        or by a regular expression matching the whole pseudos
+        (prefixed by 're:').
+
+        ..Note: Command is <bot name>: 38 <user1,user2 ...>
+            or <bot name>: 38 re:<regex>
+        """
+        if param.startswith('re:'):
+            self.purge_users(serv, pattern=param[3:])
+        else:
+            self.purge_users(serv, re.split(r'[\s,]+', param.strip(', ')))
+        LOGGER.info("ADMIN: Batch remove: <" + param + ">")
 
     def db_backup(self, serv, param):
-        """Do a backup of the sqlite database.
+        """Do a backup of the sqlite database in background.
 
         ..Note: The name is chosen from current date.
-        ..Note: Command is <bot name>: 36 <user>
+        ..Note: The progress is reported on the first channel;
+            messages are sent by the reactor (see DatabaseBackup).
+        ..Note: Command is <bot name>: 37
         """
-        copyfile(cm.DIR_DATA + 'bdd.sqlite',
-                 cm.DIR_DATA + 'bdd.sqlite_' + self.get_current_date())
-        serv.action(cm.CHANNEL, "Database is backed up.")
-        LOGGER.info("ADMIN: DB backup done")
+        # Pending events are included in the backup
+        committed = self._writer.flush()
+
+        def report(message):
+            self.reactor.execute_delayed(0, serv.action,
+                                         (self._home_channel,
+                                          "Database backup: " + message))
+
+        if not committed:
+            report("pending events not committed, they are not included")
+
+        DatabaseBackup(report).start()
+        LOGGER.info("ADMIN: DB backup started")
+
+
+def create_bots(bot_class, db_session, writer):
+    """Return one bot for each network of NETWORKS in commons.
+
+    :param arg1: Class of the bots.
+    :param arg2: SQLAlchemy session shared by the bots.
+    :param arg3: Write-behind buffer shared by the bots.
+    :type arg1: <class IRCAnalytics>
+    :type arg2: <SQL session object>
+    :type arg3: <WriteBehind>
+    :rtype: <list <IRCAnalytics>>
+    """
+    return [bot_class(network=network, channels=channels,
+                      db_session=db_session, writer=writer,
+                      server_list=[(server, port)],
+                      nickname=cm.BOT_NAME,
+                      realname=cm.BOT_REALNAME)
+            for network, server, port, channels in cm.NETWORKS]
 
 
 def main():
-    """Start the bot"""
+    """Start the bots (one per network)"""
+
+    cm.init()
+    if cm.IRC_ENGINE == 'asyncio':
+        from irc_bot import aio_connection
+        aio_connection.main()
+        return
+
+    db_session, writer = open_database()
+    metrics.MetricsExporter().start()
+    bots = create_bots(IRCAnalytics, db_session, writer)
 
-    bot_instance = IRCAnalytics(server_list=[(cm.SERVER_URL, cm.SERVER_PORT)],
-                                nickname=cm.BOT_NAME,
-                                realname=cm.BOT_REALNAME)
+    # Each reactor runs in its own thread; all bots share the buffer
+    for bot_instance in bots[1:]:
+        Thread(target=bot_instance.start, daemon=True).start()
 
     # Start the bot
-    bot_instance.start()
+    try:
+        bots[0].start()
+    finally:
+        # Pending events are saved on exit (KeyboardInterrupt, SystemExit...)
+        LOGGER.info("Saving pending events...")
+        writer.stop()
 
 if __name__ == "__main__":
 
@@ -1,16 +1,31 @@
 # -*- coding: utf-8 -*-
 """
 Data caching used to avoid useless delay when a user refresh the website.
+
+Data is shared between all the processes (Gunicorn workers) through
+a snapshot file: only one process (the leader) forges data & publishes it,
+the others only read the snapshot.
 """
 
 # Standard imports
+import os
+import time
+import datetime
+import fcntl
+import pickle
+import tempfile
 from threading import Thread
 # Custom imports
 from irc_bot import commons as cm
+from irc_bot import metrics
 #from irc_bot import database as db
 
 LOGGER = cm.logger()
 
+# Format of the forged data (see database.forge_data()); snapshots written
+# with another format (previous version of the website) are ignored
+SNAPSHOT_FORMAT = 2
+
 class DataCaching(Thread):
     """Overriding the Thread class and only override the __init__()
     and run() methods of this class.
@@ -20,43 +35,267 @@ class DataCaching(Thread):
     This class is used to load an independant thread ables to forge data
     according to the delay fixed in commons.py.
 
+    The thread holding the lock file (the leader) forges data & writes it
+    in the snapshot file (atomic rename); other threads reload the snapshot
+    when it is modified. If the leader dies, another thread takes the lock.
+
+    If a callable giving the revision of the database is provided, data is
+    forged only when the revision changes (see is_due()); otherwise data is
+    forged every DELAY seconds.
+
     Attributes:
         - private: _sqla_session
         - private: _forge_data, a callable used to interrogate database.
+        - private: _get_revision, optional callable giving the revision
+            of the database.
+        - private: _producer, False if this thread must never forge data.
+        - private: _lock_file, file object of the lock (if leader)
+        - private: _snapshot_mtime, modification time of the loaded snapshot
         - public: data, data ready to be used by Flask;
-            A dictionary of all parameters used in the template.
-            <dict>
+            For each channel, a dictionary of all parameters used
+            in the template.
+            <dict <tuple <str>, <str>>: <dict>>
+        - public: generation, number of the current version of data.
+            <int>
+        - public: timestamp, time of the forge of data (seconds since epoch).
+            <float>
+        - public: forge_seconds, duration of the forge of data (seconds).
+            <float>
     """
 
-    def __init__(self, sqla_session, forge_data):
+    def __init__(self, sqla_session, forge_data, get_revision=None,
+                 producer=True):
         """Constructor
         :param arg1: SQLAlchemy session.
         :param arg2: Callable used to interrogate database.
+        :param arg3: Optional callable used to get the revision of database.
+        :param arg4: Optional boolean; if False the thread only reads the
+            snapshot (data is forged by another process).
         :type arg1: <SQL session object>
         :type arg2: <callable>
+        :type arg3: <callable>
+        :type arg4: <boolean>
+        """
+        Thread.__init__(self, daemon=True)
+
+        self.data            = dict()
+        self.generation      = 0
+        self.timestamp       = 0
+        self.forge_seconds   = None
+        self._sqla_session   = sqla_session
+        self._forge_data     = forge_data
+        self._get_revision   = get_revision
+        self._producer       = producer
+        self._lock_file      = None
+        self._snapshot_mtime = None
+
+    @property
+    def is_leader(self):
+        """Return True if this thread forges data for all processes"""
+        return self._lock_file is not None
+
+    def acquire_leadership(self):
+        """Try to become the process which forges data.
+
+        :return: True if this thread is the leader.
+        :rtype: <boolean>
+        """
+        if self.is_leader:
+            return True
+        if not self._producer:
+            return False
+
+        lock_file = open(cm.CACHE_LOCK_FILE, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Lock already held by another process
+            lock_file.close()
+            return False
+
+        LOGGER.info("Caching: pid <" + str(os.getpid()) + "> is the leader")
+        self._lock_file = lock_file
+        return True
+
+    def release_leadership(self):
+        """Let another process forge data (the lock file is closed)"""
+        if not self.is_leader:
+            return
+        LOGGER.info("Caching: pid <" + str(os.getpid()) + \
+                    "> is no longer the leader")
+        self._lock_file.close()
+        self._lock_file = None
+
+    def publish(self, data, forge_seconds=None):
+        """Write data in the snapshot file.
+
+        ..Note: The file is written beside the snapshot and renamed;
+            readers never see a partial file.
+
+        :param arg1: Data forged by the leader.
+        :param arg2: Optional duration of the forge (seconds).
+        :type arg1: <dict>
+        :type arg2: <float>
+        """
+        snapshot = {'format': SNAPSHOT_FORMAT,
+                    'generation': self.generation + 1,
+                    'timestamp': time.time(),
+                    'forge_seconds': forge_seconds,
+                    'data': data}
+
+        # Data is updated before its generation number (see reload())
+        self.data       = data
+        self.timestamp  = snapshot['timestamp']
+        self.forge_seconds = forge_seconds
+        self.generation = snapshot['generation']
+
+        directory = os.path.dirname(cm.CACHE_SNAPSHOT) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(snapshot, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cm.CACHE_SNAPSHOT)
+        except OSError as e:
+            LOGGER.error("Caching: snapshot not written; " + str(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self._snapshot_mtime = os.stat(cm.CACHE_SNAPSHOT).st_mtime_ns
+
+    def reload(self):
+        """Load the snapshot file if it was modified since the last load.
+
+        :return: True if new data is loaded.
+        :rtype: <boolean>
         """
-        Thread.__init__(self)
+        try:
+            mtime = os.stat(cm.CACHE_SNAPSHOT).st_mtime_ns
+            if mtime == self._snapshot_mtime:
+                return False
+
+            with open(cm.CACHE_SNAPSHOT, 'rb') as file:
+                snapshot = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            LOGGER.debug("Caching: snapshot not loaded; " + str(e))
+            return False
+
+        if snapshot.get('format') != SNAPSHOT_FORMAT:
+            LOGGER.debug("Caching: snapshot of another format ignored")
+            self._snapshot_mtime = mtime
+            return False
+
+        # A new generation number must never be seen with old data
+        self.data            = snapshot['data']
+        self.timestamp       = snapshot['timestamp']
+        self.forge_seconds   = snapshot.get('forge_seconds')
+        self.generation      = snapshot['generation']
+        self._snapshot_mtime = mtime
+        return True
+
+    @staticmethod
+    def is_due(now, last_forge, pending_since, last_change):
+        """Tell if data must be forged again.
+
+        Changes of the database are debounced:
+        data is forged when no change is seen for CACHE_DEBOUNCE seconds,
+        or when the oldest change waits for CACHE_MAX_STALENESS seconds;
+        but never more than once every CACHE_MIN_INTERVAL seconds.
 
-        self.data          = dict()
-        self._sqla_session = sqla_session
-        self._forge_data   = forge_data
+        :param arg1: Current time (monotonic clock).
+        :param arg2: Time of the last forge.
+        :param arg3: Time of the first change not yet forged (or None).
+        :param arg4: Time of the last change seen.
+        :type arg1: <float>
+        :type arg2: <float>
+        :type arg3: <float>
+        :type arg4: <float>
+        :rtype: <boolean>
+        """
+        if pending_since is None:
+            return False
+        if now - last_forge < cm.CACHE_MIN_INTERVAL:
+            return False
+        return (now - last_change >= cm.CACHE_DEBOUNCE) or \
+               (now - pending_since >= cm.CACHE_MAX_STALENESS)
 
+    def forge(self):
+        """Forge data & make it visible from parent thread & other processes"""
+        start = time.perf_counter()
+        data = self._forge_data(self._sqla_session)
+        forge_seconds = time.perf_counter() - start
+        metrics.FORGE_SECONDS.observe(forge_seconds)
+        self.publish(data, forge_seconds)
+        self._sqla_session.remove()
 
     def run(self):
         """Heart of the class; This method forges data.
 
         Data is accessible by Flask from the public attribute self.data
+
+        ..Note: If data can't be forged (database locked, archive not
+            attached...), the error is logged & a new attempt is made
+            CACHE_RETRY_DELAY seconds later; the leadership is released
+            if the thread stops.
         """
 
-        import time
         LOGGER.info("Caching thread started !")
 
-        while True:
+        # Start from the last published data (generation number included)
+        self.reload()
+
+        seen_revision = None
+        pending_since = None
+        last_change   = None
+        last_forge    = float('-inf')
+        forge_day     = None
+
+        try:
+            while True:
+
+                if not self.acquire_leadership():
+                    # Follower: reload data published by the leader
+                    self.reload()
+                    time.sleep(cm.CACHE_POLL_DELAY)
+                    continue
+
+                try:
+                    # Without revision: forge data every DELAY seconds
+                    if self._get_revision is None:
+                        self.forge()
+                        time.sleep(cm.DELAY)
+                        continue
+
+                    now = time.monotonic()
+                    revision = self._get_revision(self._sqla_session)
+                    self._sqla_session.remove()
+
+                    if revision != seen_revision:
+                        seen_revision = revision
+                        last_change   = now
+                        if pending_since is None:
+                            pending_since = now
+
+                    # Data depends on the current day even without new events
+                    new_day = forge_day != datetime.date.today()
 
-            # Get all data
-            # Make data visible from parent thread
-            self.data = self._forge_data(self._sqla_session)
+                    if new_day or self.is_due(now, last_forge, pending_since,
+                                              last_change):
+                        LOGGER.debug("Caching: forge data for revision " + \
+                                     str(revision))
+                        today = datetime.date.today()
+                        self.forge()
+                        forge_day     = today
+                        last_forge    = now
+                        pending_since = None
 
-            # Wait 30 seconds before new processing
-            time.sleep(cm.DELAY)
+                except Exception as e:
+                    LOGGER.error("Caching: data not forged, retry in " + \
+                                 str(cm.CACHE_RETRY_DELAY) + "s; " + str(e))
+                    self._sqla_session.remove()
+                    time.sleep(cm.CACHE_RETRY_DELAY)
+                    continue
 
+                time.sleep(cm.CACHE_POLL_DELAY)
+        finally:
+            self.release_leadership()
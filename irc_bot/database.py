@@ -6,21 +6,33 @@ The class Log is used to insert events in db.
 """
 # Custom imports
 from irc_bot import commons as cm
+from irc_bot import metrics
+from irc_bot import graph_metrics
+from irc_bot import graph_pruning
 
 # Standard imports
 import datetime
 # https://docs.python.org/3.5/library/datetime.html
 import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from shutil import copyfile, copy2
+from urllib.request import pathname2url
 from collections import Counter
 from operator import itemgetter
 import itertools as it
-# Don't import networkx if flag is False
-if cm.USE_NETWORKX:
-    import networkx as nx
+import importlib.util
+from threading import Lock
 
 # SQL Alchemy
 from sqlalchemy import *
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker, column_property
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -31,6 +43,44 @@ LOGGER = cm.logger()
 # /!\ This line MUST BE CALLED before any loading of SQL Engine
 Base = declarative_base()
 
+
+def sql_day(column):
+    """SQL expression of the day (YYYY-MM-DD) of the given timestamp column"""
+    return func.date(column)
+
+def sql_hour(column):
+    """SQL expression of the hour (0-23) of the given timestamp column"""
+    return cast(func.strftime('%H', column), Integer)
+
+def sql_weekday(column):
+    """SQL expression of the weekday of the given timestamp column.
+
+    ..Note: Same as Python's weekday(): 0 is Monday
+        (but for SQLite %w: 0 is Sunday).
+    """
+    return (cast(func.strftime('%w', column), Integer) + 6) % 7
+
+def channel_filter(model, network=None, channel=None):
+    """Return the SQL conditions selecting the rows of the given channel.
+
+    ..Note: Without network & channel, rows of all channels are selected.
+
+    :param arg1: Mapped class with network & channel columns.
+    :param arg2: Optional network name.
+    :param arg3: Optional channel.
+    :type arg1: <Base>
+    :type arg2: <str>
+    :type arg3: <str>
+    :return: List of SQL conditions.
+    :rtype: <list>
+    """
+    conditions = list()
+    if network is not None:
+        conditions.append(model.network == network)
+    if channel is not None:
+        conditions.append(model.channel == channel)
+    return conditions
+
 ################################################################################
 class SQLA_Wrapper():
     """Context manager for DB wrapper
@@ -71,10 +121,76 @@ class SQLA_Wrapper():
         self._session.commit()
 
 
+def apply_profile(dbapi_connection, profile, read_only=False):
+    """Execute the PRAGMA statements of the given SQLite profile.
+
+    ..Note: The journal mode is stored in the database; it can't be
+        changed by a read-only connection.
+
+    :param arg1: sqlite3 connection.
+    :param arg2: Name of the profile (see SQLITE_PROFILES in commons).
+    :param arg3: Optional boolean; True for a read-only connection.
+    :type arg1: <sqlite3.Connection>
+    :type arg2: <str>
+    :type arg3: <boolean>
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma, value in cm.SQLITE_PROFILES[profile].items():
+        if read_only and pragma in ('journal_mode', 'synchronous'):
+            continue
+        cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    cursor.close()
+
+
+def sqlite_uri(db_file, read_only=False):
+    """Return the URI filename of the given database
+
+    :param arg1: Path of the database.
+    :param arg2: Optional boolean; if True the URI opens the database
+        in read-only mode (mode=ro).
+    :type arg1: <str>
+    :type arg2: <boolean>
+    :rtype: <str>
+    """
+    uri = 'file:' + pathname2url(os.path.abspath(db_file))
+    return uri + '?mode=ro' if read_only else uri
+
+
+def create_sqlite_engine(db_file, profile=None, read_only=False):
+    """Create an engine whose connections are tuned by the given profile
+
+    :param arg1: Path of the database.
+    :param arg2: Optional name of the profile (default: SQLITE_PROFILE).
+    :param arg3: Optional boolean; if True connections are opened
+        in read-only mode (mode=ro).
+    :type arg1: <str>
+    :type arg2: <str>
+    :type arg3: <boolean>
+    :rtype: <Engine>
+    """
+    profile = profile or cm.SQLITE_PROFILE
+    # URI filenames are also accepted by ATTACH (archives are read-only)
+    uri = sqlite_uri(db_file, read_only)
+    # Same pool as a file database (not a memory one)
+    engine = create_engine(
+        'sqlite://', echo=False, poolclass=NullPool,
+        creator=lambda: sqlite3.connect(uri, uri=True,
+                                        check_same_thread=False)
+    )
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        apply_profile(dbapi_connection, profile, read_only)
+
+    return engine
+
+
 def loading_sql(**kwargs):
     """Create an engine & create all the tables we need
 
     :param: Optional boolean allowing to reuse the database instead of deleting it.
+    :param: Optional boolean read_only; if True the returned session uses
+        read-only connections (the schema is updated beforehand).
     :type: <boolean>
     :return: session object
     :rtype: <Session()>
@@ -91,10 +207,16 @@ def loading_sql(**kwargs):
     if kwargs.get('reuse', True) is False and db_exists:
         os.remove(db_file)
 
-    engine = create_engine('sqlite:///' + db_file, echo=False)
+    engine = create_sqlite_engine(db_file)
     # The pymysql DBAPI is a pure Python port of the MySQL-python (MySQLdb) driver, and targets 100% compatibility.
 #    engine = create_engine('mysql+pymysql://root:@localhost/symfony')
     Base.metadata.create_all(engine)
+    # Columns & indexes are not created by create_all() on existing tables
+    rebuilt_tables = migrate_columns(engine)
+    rebuilt_tables += migrate_users(engine)
+    migrate_indexes(engine)
+    # Ids of users may differ from the ones of a previous database
+    USERS.clear()
 
     #returns an object for building the particular session you want
 
@@ -114,10 +236,277 @@ def loading_sql(**kwargs):
 
     # PAY ATTENTION HERE:
     # http://stackoverflow.com/questions/21078696/why-is-my-scoped-session-raising-an-attributeerror-session-object-has-no-attr
-    return scoped_session(sessionmaker(bind=engine, autoflush=True))
+    session = scoped_session(sessionmaker(bind=engine, autoflush=True))
+
+    if rebuilt_tables:
+        # Aggregates were dropped by the migration
+        backfill_rollups(session)
+        session.remove()
+
+    if kwargs.get('read_only', False):
+        # Readers never lock the database for writing
+        engine.dispose()
+        session = scoped_session(sessionmaker(
+            bind=create_sqlite_engine(db_file, read_only=True),
+            autoflush=True
+        ))
+    return session
 #    Session =
 #    return Session()
 
+def migrate_columns(engine):
+    """Add the columns declared in the models but missing in the database.
+
+    - Logs & edges recorded before the support of several channels are
+        assigned to the default channel (see NETWORKS in commons).
+    - Columns of the primary key can't be added by SQLite: such tables
+        (aggregates) are rebuilt empty; they must be backfilled.
+
+    :param: SQLAlchemy engine.
+    :type: <Engine>
+    :return: Names of the rebuilt tables.
+    :rtype: <list <str>>
+    """
+    inspector = inspect(engine)
+    legacy_values = dict(zip(('network', 'channel'), cm.default_channel()))
+    rebuilt = list()
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns
+                   if column.name not in existing]
+        if not missing:
+            continue
+
+        if any(column.primary_key for column in missing):
+            LOGGER.info("Migration: rebuild table <" + table.name + ">...")
+            table.drop(engine)
+            table.create(engine)
+            rebuilt.append(table.name)
+            continue
+
+        for column in missing:
+            LOGGER.info("Migration: add column <" + table.name + "." + \
+                        column.name + ">...")
+            statement = "ALTER TABLE {} ADD COLUMN {} {}".format(
+                table.name, column.name, column.type.compile(engine.dialect))
+            if column.name in legacy_values:
+                statement += " NOT NULL DEFAULT '{}'".format(
+                    legacy_values[column.name].replace("'", "''"))
+            try:
+                engine.execute(statement)
+            except OperationalError as e:
+                # Column added meanwhile by another process
+                LOGGER.debug("Migration: " + str(e))
+
+    return rebuilt
+
+
+# Columns of pseudos replaced by user ids, by table (see migrate_users())
+LEGACY_PSEUDO_COLUMNS = {
+    'log': {'user_id': 'pseudo'},
+    'edge': {'user1_id': 'pseudo1', 'user2_id': 'pseudo2'},
+}
+
+
+def rebuild_with_user_ids(connection, table, pseudo_columns):
+    """Replace the pseudos of the given table by the ids of their users.
+
+    SQLite can't drop indexed columns: missing users are added to the user
+    table, rows are copied in a new table which replaces the old one,
+    then indexes are created.
+
+    :param arg1: SQLAlchemy connection (in a transaction).
+    :param arg2: Table with the new columns (its schema is used).
+    :param arg3: Legacy column of pseudos, by column of user ids.
+    :type arg1: <Connection>
+    :type arg2: <Table>
+    :type arg3: <dict <str>: <str>>
+    """
+    name = (table.schema + '.' if table.schema else '') + table.name
+    for pseudo_column in pseudo_columns.values():
+        connection.execute('INSERT OR IGNORE INTO main.user (name) '
+                           'SELECT DISTINCT {} FROM {}'.format(pseudo_column,
+                                                               name))
+
+    connection.execute(CreateTable(
+        table.tometadata(MetaData(), name=table.name + '_new')))
+    columns, joins = list(), list()
+    for column in table.columns:
+        if column.name not in pseudo_columns:
+            columns.append('old.' + column.name)
+            continue
+        alias = 'user_' + str(len(joins))
+        joins.append('JOIN main.user AS {0} ON {0}.name = old.{1}'.format(
+            alias, pseudo_columns[column.name]))
+        columns.append(alias + '.id')
+    connection.execute('INSERT INTO {0}_new ({1}) SELECT {2} FROM {0} AS old '
+                       '{3}'.format(name,
+                                    ', '.join(column.name
+                                              for column in table.columns),
+                                    ', '.join(columns),
+                                    ' '.join(joins)))
+
+    connection.execute('DROP TABLE ' + name)
+    connection.execute('ALTER TABLE {}_new RENAME TO {}'.format(name,
+                                                                 table.name))
+    for index in table.indexes:
+        index.create(connection)
+
+
+def migrate_users(engine):
+    """Replace the pseudos of logs & edges by the ids of their users.
+
+    - Logs & edges recorded before the user table are rebuilt,
+    - archives of logs are rebuilt in temporary copies which replace them.
+
+    ..Note: Aggregates are rebuilt empty by migrate_columns() beforehand.
+
+    :param: SQLAlchemy engine.
+    :type: <Engine>
+    :return: Names of the rebuilt tables.
+    :rtype: <list <str>>
+    """
+    inspector = inspect(engine)
+    rebuilt = list()
+    with engine.begin() as connection:
+        for table in (Log.__table__, Edge.__table__):
+            pseudo_columns = LEGACY_PSEUDO_COLUMNS[table.name]
+            existing = {column['name']
+                        for column in inspector.get_columns(table.name)}
+            if not existing.issuperset(pseudo_columns.values()):
+                continue
+
+            LOGGER.info("Migration: rebuild table <" + table.name + \
+                        "> with user ids...")
+            rebuild_with_user_ids(connection, table, pseudo_columns)
+            rebuilt.append(table.name)
+
+    for month in archived_months():
+        path = archive_path(month)
+        connection = sqlite3.connect(sqlite_uri(path, read_only=True),
+                                     uri=True)
+        existing = {row[1] for row in
+                    connection.execute('PRAGMA table_info(log)')}
+        connection.close()
+        if 'pseudo' not in existing:
+            continue
+
+        LOGGER.info("Migration: rebuild archive <" + path + \
+                    "> with user ids...")
+        tmp_path = path + '.tmp'
+        copyfile(path, tmp_path)
+        os.chmod(tmp_path, 0o644)
+        with engine.connect() as connection:
+            connection.execute('ATTACH DATABASE ? AS archive_new',
+                               sqlite_uri(tmp_path))
+            with connection.begin():
+                rebuild_with_user_ids(connection, archive_table('archive_new'),
+                                      LEGACY_PSEUDO_COLUMNS['log'])
+            connection.execute('DETACH DATABASE archive_new')
+        seal_archive(tmp_path, path)
+        rebuilt.append(os.path.basename(path))
+
+    return rebuilt
+
+
+# Indexes replaced by other ones (dropped by migrate_indexes())
+OBSOLETE_INDEXES = ('ix_log_event_timestamp',)
+
+
+def migrate_indexes(engine):
+    """Create the indexes declared in the models but missing in the database.
+
+    Existing databases are updated without rebuild of the tables.
+    The query plans of forge_data() that are modified by the new indexes
+    are reported in the log.
+
+    :param: SQLAlchemy engine.
+    :type: <Engine>
+    :return: Names of the created indexes.
+    :rtype: <list <str>>
+    """
+    inspector = inspect(engine)
+    missing = list()
+    obsolete = list()
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing += [index for index in table.indexes
+                    if index.name not in existing]
+        obsolete += [name for name in OBSOLETE_INDEXES if name in existing]
+
+    if not missing and not obsolete:
+        return list()
+
+    statements = get_forge_data_statements()
+    plans_before = explain_statements(engine, statements)
+
+    for index in missing:
+        LOGGER.info("Migration: create index <" + index.name + ">...")
+        try:
+            index.create(engine)
+        except OperationalError as e:
+            # Index created meanwhile by another process
+            LOGGER.debug("Migration: " + str(e))
+
+    for name in obsolete:
+        LOGGER.info("Migration: drop index <" + name + ">...")
+        engine.execute("DROP INDEX IF EXISTS " + name)
+
+    plans_after = explain_statements(engine, statements)
+
+    for (statement, _), before, after in \
+        zip(statements, plans_before, plans_after):
+        if before == after:
+            continue
+        LOGGER.info("Migration: query plan changed for:\n" + \
+                    " ".join(statement.split()) + \
+                    "\n\tbefore: " + " | ".join(before) + \
+                    "\n\tafter: " + " | ".join(after))
+
+    return [index.name for index in missing]
+
+
+def get_forge_data_statements():
+    """Return the distinct SQL statements made by forge_data() with all the
+    backends.
+
+    ..Note: Statements are captured on an empty in-memory database.
+
+    :return: List of SQL statements & their parameters.
+    :rtype: <list <tuple <str>, <tuple>>>
+    """
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    statements = list()
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        # Each distinct SELECT is kept once
+        if statement.lstrip().upper().startswith('SELECT') and \
+            statement not in (known for known, _ in statements):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    session = sessionmaker(bind=engine)()
+    for backend in get_installed_backends():
+        forge_data(session, backend, RelationGraph())
+    session.close()
+    return statements
+
+
+def explain_statements(engine, statements):
+    """Return the query plans of the given statements.
+
+    :param arg1: SQLAlchemy engine.
+    :param arg2: List of SQL statements & their parameters.
+    :type arg1: <Engine>
+    :type arg2: <list <tuple <str>, <tuple>>>
+    :return: For each statement, the details of the query plan.
+    :rtype: <list <tuple <str>>>
+    """
+    return [tuple(row[-1] for row in
+                  engine.execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+            for statement, parameters in statements]
+
 ################################################################################
 class Item():
     """Some usefull methods to handle the objects in database"""
@@ -151,6 +540,261 @@ class Item():
         return session.query(cls).all()
 
 
+class Revision(Base, Item):
+    """Counters of modifications of the database.
+
+    Readers (website) compare these values to know if data has changed.
+    - 'data': incremented on each insertion or deletion of events.
+    - 'edge_purge': incremented on each deletion of edges
+        (see RelationGraph).
+    """
+
+    __tablename__ = 'revision'
+    name  = Column(String(20), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "name:{}, value:{}".format(self.name, self.value)
+
+
+    @staticmethod
+    def bump(session, name='data'):
+        """Increment the given counter.
+
+        ..Note: The session is not committed; the counter is updated
+            in the transaction of the modification.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Optional name of the counter.
+        :type arg1: <SQL session object>
+        :type arg2: <str>
+
+        """
+        ret = session.query(Revision).filter(Revision.name == name).update(
+            {Revision.value: Revision.value + 1}, synchronize_session=False)
+
+        if ret == 0:
+            session.add(Revision(name=name, value=1))
+
+    @staticmethod
+    def get(session, name='data'):
+        """Get the value of the given counter.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Optional name of the counter.
+        :type arg1: <SQL session object>
+        :type arg2: <str>
+        :return: Value of the counter (0 if never incremented).
+        :rtype: <int>
+
+        """
+        value = session.query(Revision.value).filter(
+            Revision.name == name).scalar()
+        return value or 0
+
+
+class User(Base, Item):
+    """Dictionary of pseudos; logs & edges reference the id of their users.
+
+    ..Note: Users are never deleted: ids are cached by the processes
+        & referenced by the archives of logs.
+    """
+
+    __tablename__ = 'user'
+    id   = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+
+    def __repr__(self):
+        return "id:{}, name:{}".format(self.id, self.name)
+
+
+    @staticmethod
+    def get_id(session, name):
+        """Return the id of the given pseudo (None if unknown)
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Pseudo of the user.
+        :type arg1: <SQL session object>
+        :type arg2: <str>
+        :rtype: <int>
+        """
+        return USERS.get_ids(session, [name], create=False).get(name)
+
+    @staticmethod
+    def get_names(session, ids):
+        """Return the pseudos of the given user ids (see UserCache)
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Iterable of user ids.
+        :type arg1: <SQL session object>
+        :type arg2: <iterable <int>>
+        :return: Pseudo of each id.
+        :rtype: <dict <int>: <str>>
+        """
+        return USERS.get_names(session, ids)
+
+    @staticmethod
+    def find_ids(session, names=(), pattern=None):
+        """Return the ids of the given pseudos & of the pseudos matching
+        the given regular expression.
+
+        ..Note: Unknown pseudos are ignored; the expression must match
+            the whole pseudo.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Optional iterable of pseudos.
+        :param arg3: Optional regular expression.
+        :type arg1: <SQL session object>
+        :type arg2: <iterable <str>>
+        :type arg3: <str>
+        :return: Pseudo of each id found.
+        :rtype: <dict <int>: <str>>
+        """
+        users = {user_id: name for name, user_id in
+                 USERS.get_ids(session, names, create=False).items()}
+        if pattern is not None:
+            regex = re.compile(pattern)
+            users.update((user_id, name) for user_id, name in
+                         session.query(User.id, User.name)
+                         if regex.fullmatch(name))
+        return users
+
+
+class UserCache():
+    """In-process map of pseudos & user ids.
+
+    Inserts of logs & edges don't need a lookup query once the pseudos
+    are known; only the pseudos missing from the map are searched
+    (then created) in the database.
+
+    ..Note: Ids of users created in the current transaction are not cached:
+        the transaction may be rolled back (see WriteBehind); they are
+        cached the next time they are read.
+
+    Attributes:
+        - private: _ids, id of each pseudo <dict <str>: <int>>
+        - private: _names, pseudo of each id <dict <int>: <str>>
+        - private: _lock, lock protecting updates <Lock>
+    """
+
+    # Maximum number of parameters of a SQL query
+    CHUNK_SIZE = 500
+
+    def __init__(self):
+        """Constructor"""
+        self._ids   = dict()
+        self._names = dict()
+        self._lock  = Lock()
+
+    def clear(self):
+        """Forget all the users (the database is replaced)"""
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+
+    def _load(self, session, column, values):
+        """Read the users matching the given values of the given column
+
+        :return: List of (id, name).
+        :rtype: <list <tuple <int>, <str>>>
+        """
+        values = list(values)
+        users = list()
+        for i in range(0, len(values), self.CHUNK_SIZE):
+            users += session.query(User.id, User.name).filter(
+                column.in_(values[i:i + self.CHUNK_SIZE])).all()
+        return users
+
+    def get_ids(self, session, names, create=True):
+        """Return the ids of the given pseudos.
+
+        ..Note: Unknown pseudos are inserted in the user table if create
+            is True; the session is not committed.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Iterable of pseudos.
+        :param arg3: Optional boolean; if False unknown pseudos are ignored.
+        :type arg1: <SQL session object>
+        :type arg2: <iterable <str>>
+        :type arg3: <boolean>
+        :return: Id of each pseudo.
+        :rtype: <dict <str>: <int>>
+        """
+        with self._lock:
+            ids = dict()
+            missing = set()
+            for name in names:
+                user_id = self._ids.get(name)
+                if user_id is None:
+                    missing.add(name)
+                else:
+                    ids[name] = user_id
+            if not missing:
+                return ids
+
+            for user_id, name in self._load(session, User.name, missing):
+                self._ids[name] = user_id
+                self._names[user_id] = name
+                ids[name] = user_id
+            missing.difference_update(ids)
+            if not missing or not create:
+                return ids
+
+            # Pseudos may be inserted meanwhile by another process
+            session.execute(User.__table__.insert().prefix_with('OR IGNORE'),
+                            [{'name': name} for name in missing])
+            ids.update((name, user_id) for user_id, name in
+                       self._load(session, User.name, missing))
+            LOGGER.debug("UserCache: " + str(len(missing)) + " new users")
+            return ids
+
+    def get_names(self, session, ids):
+        """Return the pseudos of the given user ids (see User.get_names())"""
+        ids = set(ids)
+        with self._lock:
+            names = {user_id: self._names[user_id]
+                     for user_id in ids if user_id in self._names}
+            missing = ids.difference(names)
+            for user_id, name in self._load(session, User.id, missing):
+                self._ids[name] = user_id
+                self._names[user_id] = name
+                names[user_id] = name
+            return names
+
+
+# Pseudos & ids of the users known by this process
+USERS = UserCache()
+
+
+def top_posters_names(session, posters):
+    """Return the 15 users with the most messages, with their pseudos.
+
+    ..Note: Users with the same number of messages are sorted by id
+        (the oldest users first).
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Iterable of (user id, number of messages).
+    :type arg1: <SQL session object>
+    :type arg2: <iterable <tuple <int>, <int>>>
+    :return: Lists of labels & number of messages
+    :rtype: [[labels], [values]]
+    """
+    unzip = lambda liste: [tuple(li) for li in zip(*liste)]
+
+    top = sorted(posters, key=lambda item: (-item[1], item[0]))[:15]
+    names = User.get_names(session, (user_id for user_id, _ in top))
+    return unzip((names[user_id], number) for user_id, number in top)
+
+
+def pseudo_of(user_id_column):
+    """Return the SQL expression of the pseudo of the given user id column
+
+    ..Note: Used to load the pseudo with Log & Edge objects.
+    """
+    return column_property(
+        select([User.name]).where(User.id == user_id_column).as_scalar())
+
+
 class Edge(Base, Item):
     """ """
 
@@ -159,32 +803,54 @@ class Edge(Base, Item):
 
     # use utcnow to avoid timezones
     timestamp = Column(DateTime, default=datetime.datetime.now, nullable=False)
-    pseudo1   = Column(String(20), nullable=False)
-    pseudo2   = Column(String(20), nullable=False)
-
-    # Unicity constraint
-    # Note for MySQL, unicity & index is the same thing
-    Index('index_1', 'pesudo1', 'pseudo2', unique=True)
-
-    def __init__(self, pseudo1, pseudo2):
+    network   = Column(String(50), nullable=False)
+    channel   = Column(String(50), nullable=False)
+    user1_id  = Column(Integer, nullable=False)
+    user2_id  = Column(Integer, nullable=False)
+    # Pseudos: given to the constructor, or loaded from the user table
+    pseudo1   = pseudo_of(user1_id)
+    pseudo2   = pseudo_of(user2_id)
+
+    # Indexes used to find the relationships of a user & of a channel
+    __table_args__ = (
+        Index('ix_edge_user1', 'user1_id'),
+        Index('ix_edge_user2', 'user2_id'),
+        Index('ix_edge_channel', 'network', 'channel'),
+    )
+
+    def __init__(self, pseudo1, pseudo2, network=None, channel=None):
         """Constructor takes pseudo of the poster & the event type
 
-        ..note: timestamp is setup automatically
+        ..note: timestamp is setup automatically at the creation of the object
+        ..note: The default channel is the first one of NETWORKS in commons.
 
         :param arg1: Poster's pseudo
         :param arg2: Event's type
+        :param arg3: Optional network name.
+        :param arg4: Optional channel.
         :type arg1: <str>
         :type arg2: <str>
+        :type arg3: <str>
+        :type arg4: <str>
 
         """
+        # Timestamp of the event, not of the (possibly delayed) insertion
+        self.timestamp = datetime.datetime.now()
+        if network is None:
+            network, channel = cm.default_channel()
+        self.network = network
+        self.channel = channel
         # Lexicographic sort
+        # Ids of the users are set before the insertion (see resolve_users())
         self.pseudo1, self.pseudo2 = \
             (pseudo1, pseudo2) if (pseudo1 < pseudo2) else (pseudo2, pseudo1)
 
     def __repr__(self):
-        return "id:{}, timestamp:{}, pseudo1:{}, pseudo2:{}".format(
+        return "id:{}, timestamp:{}, channel:{}/{}, pseudo1:{}, pseudo2:{}".format(
             self.id,
             self.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            self.network,
+            self.channel,
             self.pseudo1,
             self.pseudo2)
 
@@ -201,9 +867,12 @@ class Edge(Base, Item):
         :rtype: <int>
 
         """
-        ret = session.query(Edge).filter(or_(Edge.pseudo1 == user,
-                                             Edge.pseudo2 == user)).delete()
-        session.commit()
+        user_id = User.get_id(session, user)
+        ret = 0
+        if user_id is not None:
+            # Committed chunk by chunk (see purge_users())
+            for _, _, _, ret in purge_users(session, [user_id], logs=False):
+                pass
 
         LOGGER.debug(str(ret) + " relationships deleted")
         return ret
@@ -285,19 +954,67 @@ class Edge(Base, Item):
         :rtype: <str>
         """
 
+        # Counters of pseudos & edges in a single pass
+        graph = RelationGraph()
+        graph.add_edges((edge.pseudo1, edge.pseudo2) for edge in edges)
+        return Edge.get_dot(graph.nodes, graph.edges)
+
+    @staticmethod
+    def get_dot(all_nodes, all_edges, node_metrics=None):
+        """Return a relation graph in dot format according to the given
+        weights of nodes & edges.
+
+        ..Note: There is an autodetection of the use of NetworkX lib
+
+        ..Note: Protection of node names with quotes "" => avoid curious
+            things with composite names
+
+        ..Note: With metrics, nodes are sized by PageRank & grouped
+            by community (Vis.js colours each group).
+
+        :param arg1: Counter of pseudonyms.
+        :param arg2: Counter of edges (pseudo1, pseudo2).
+        :param arg3: Optional metrics of pseudonyms (degree, PageRank,
+            betweenness, community; see graph_metrics).
+        :type arg1: <Counter <str> : <int>>
+        :type arg2: <Counter <tuple <str>, <str>> : <int>>
+        :type arg3: <dict <str>: <tuple <int>, <float>, <float>, <int>>>
+        :return: dot string ready to be used.
+        :rtype: <str>
+        """
+        node_metrics = dict() if node_metrics is None else node_metrics
+        # Integer sizes; 100 is the mean PageRank
+        scale = len(all_nodes) * 100
+
+        def node_attributes(pseudo, weight):
+            """Return value, group (or None) & title of a node"""
+            degree, rank, centrality, community = \
+                node_metrics.get(pseudo, (0, 0.0, 0.0, -1))
+            if community < 0:
+                return weight, None, str(weight) + " message(s)"
+            return max(1, round(rank * scale)), community, \
+                "{} message(s), {} user(s), PageRank {:.2%}, " \
+                "betweenness {:.2%}".format(weight, degree, rank, centrality)
+
         # Without Networkx
         if cm.USE_NETWORKX is not True:
-            return 'graph "" { ' + \
-            ' '.join(Edge.get_formatted_nodes(edges)) + \
-            ' '.join(Edge.get_formatted_edges(edges)) + \
-            '}'
+            # chaman_gitan [value=51, group=0, title="3 message(s), ..."];
+            nodes = list()
+            for pseudo, weight in all_nodes.items():
+                value, group, title = node_attributes(pseudo, weight)
+                nodes.append('"{}" [value={}, {}title="{}"];'.format(
+                    pseudo, value,
+                    '' if group is None else 'group={}, '.format(group),
+                    title))
+            # neolem -- gentilbot397  [title="7 message(s)", value=7];
+            edges = ['"{}" -- "{}" [value={}, title="{} message(s)"];'.format(
+                pseudo1, pseudo2, value, value)
+                for (pseudo1, pseudo2), value in all_edges.items()]
+            return 'graph "" { ' + ' '.join(nodes) + ' '.join(edges) + '}'
 
         # With Networkx
-        # Counter of pseudos
-        all_nodes = Edge.get_nodes(edges)
-        # Counter of edges
-        all_edges = Counter((edge.pseudo1, edge.pseudo2) for edge in edges)
-
+        # Imported only here: networkx & pydotplus are slow to load
+        import networkx as nx
         # Add nodes automatically by adding weighted edges directly
         # Problem : this creates weight attribute but Vis uses value attribute..
         G = nx.Graph()
@@ -313,17 +1030,13 @@ class Edge(Base, Item):
         [nx.set_edge_attributes(G, 'value',
                                 {edge : weight})
             for edge, weight in nx.get_edge_attributes(G, 'weight').items()]
-        # Add weights on nodes
-        [nx.set_node_attributes(G, 'value',
-                                {node : all_nodes[node]})
-            for node in G.nodes_iter()]
-        [nx.set_node_attributes(G, 'title',
-                                {node : str(all_nodes[node]) + " message(s)"})
-            for node in G.nodes_iter()]
-
-#        print(nx.get_edge_attributes(G, 'weight'))
-#        print(nx.get_edge_attributes(G, 'label'))
-#        print(nx.get_node_attributes(G, 'weight'))
+        # Add weights (or metrics) on nodes
+        for node in G.nodes_iter():
+            value, group, title = node_attributes(node, all_nodes[node])
+            nx.set_node_attributes(G, 'value', {node : value})
+            nx.set_node_attributes(G, 'title', {node : title})
+            if group is not None:
+                nx.set_node_attributes(G, 'group', {node : group})
 
         # Write into file => ULGYYY
         # https://networkx.github.io/documentation/latest/_modules/networkx/drawing/nx_pydot.html
@@ -332,6 +1045,189 @@ class Edge(Base, Item):
         return nx.drawing.nx_pydot.to_pydot(G).to_string().replace('\n', ' ')
 
 
+class RelationGraph():
+    """Weighted graph of relationships, updated incrementally.
+
+    Only the edges inserted since the last update are read from the
+    database (id > last id); the graph is reloaded if edges are deleted.
+
+    Attributes:
+        - public: network, network name of the edges (None: all networks)
+        - public: channel, channel of the edges (None: all channels)
+        - public: edges, number of messages for each pair of user ids
+            <Counter <tuple <int>, <int>> : <int>>
+        - public: nodes, weight of each user id (sum of its edges)
+            <Counter <int> : <int>>
+        - public: names, pseudo of each user id <dict <int>: <str>>
+        - public: generation, number of changes of the edges <int>
+        - public: metrics, metrics of each user id (see graph_metrics)
+            <dict <int>: <tuple <int>, <float>, <float>, <int>>>
+        - private: _metrics_generation, generation of the metrics <int>
+        - private: _last_id, id of the last Edge read <int>
+        - private: _purge_revision, revision 'edge_purge' of the data <int>
+        - private: _lock, lock protecting updates <Lock>
+    """
+
+    def __init__(self, network=None, channel=None):
+        """Constructor
+        :param arg1: Optional network name.
+        :param arg2: Optional channel.
+        :type arg1: <str>
+        :type arg2: <str>
+        """
+        self.network         = network
+        self.channel         = channel
+        self.edges           = Counter()
+        self.nodes           = Counter()
+        self.names           = dict()
+        self.generation      = 0
+        self.metrics         = dict()
+        self._metrics_generation = 0
+        self._last_id        = 0
+        self._purge_revision = None
+        self._lock           = Lock()
+
+    def add_edges(self, pairs):
+        """Add the given pairs of user ids to the graph.
+
+        :param: Iterable of (user1_id, user2_id).
+        :type: <iterable <tuple <int>, <int>>>
+        """
+        edges, nodes = self.edges, self.nodes
+        for pair in pairs:
+            edges[pair] += 1
+            nodes[pair[0]] += 1
+            nodes[pair[1]] += 1
+
+    def update(self, session):
+        """Read the edges inserted since the last update.
+
+        :param: SQLAlchemy session.
+        :type: <SQL session object>
+        :return: Number of new edges.
+        :rtype: <int>
+        """
+        with self._lock:
+            purge_revision = Revision.get(session, 'edge_purge')
+            if purge_revision != self._purge_revision:
+                # Some edges are deleted: reload everything
+                LOGGER.debug("RelationGraph: reload all edges")
+                self.edges, self.nodes = Counter(), Counter()
+                self._last_id = 0
+                self._purge_revision = purge_revision
+                self.generation += 1
+
+            query = session.query(Edge.id, Edge.user1_id, Edge.user2_id).filter(
+                Edge.id > self._last_id,
+                *channel_filter(Edge, self.network, self.channel)
+            ).order_by(Edge.id)
+
+            rows = query.all()
+            if not rows:
+                return 0
+
+            self.add_edges((user1_id, user2_id) for _, user1_id, user2_id in rows)
+            self._last_id = rows[-1][0]
+            self.generation += 1
+            # Pseudos are only needed by the output of the graph
+            self.names.update(User.get_names(
+                session, set(self.nodes).difference(self.names)))
+
+            LOGGER.debug("RelationGraph: " + str(len(rows)) + " new edges")
+            return len(rows)
+
+    def update_metrics(self):
+        """Compute the metrics of the nodes if the edges have changed
+        since the last computation (see graph_metrics.get_metrics()).
+
+        ..Note: The graph is not locked during the computation.
+
+        :return: True if the metrics are computed.
+        :rtype: <boolean>
+        """
+        with self._lock:
+            if self._metrics_generation == self.generation:
+                return False
+            generation = self.generation
+            edges = dict(self.edges)
+
+        start = time.perf_counter()
+        node_metrics = graph_metrics.get_metrics(edges)
+        duration = time.perf_counter() - start
+        metrics.GRAPH_METRICS_SECONDS.observe(duration)
+        LOGGER.debug("RelationGraph: metrics of " + str(len(node_metrics)) + \
+                     " nodes in {:.3f}s".format(duration))
+
+        with self._lock:
+            self.metrics = node_metrics
+            self._metrics_generation = generation
+        return True
+
+    def export(self):
+        """Return copies of nodes & edges with the pseudos of the users,
+        ready to be serialized.
+
+        ..Note: Metrics of nodes not computed yet are (0, 0.0, 0.0, -1)
+            (see update_metrics()).
+
+        :return: List of (pseudo, weight, degree, PageRank, betweenness,
+            community) & list of (pseudo1, pseudo2, weight)
+        :rtype: <tuple <list <tuple>>, <list <tuple>>>
+        """
+        with self._lock:
+            names, node_metrics = self.names, self.metrics
+            return ([(names[user_id], weight) +
+                     node_metrics.get(user_id, (0, 0.0, 0.0, -1))
+                     for user_id, weight in self.nodes.items()],
+                    [(names[user1_id], names[user2_id], weight)
+                     for (user1_id, user2_id), weight in self.edges.items()])
+
+    def get_dot(self):
+        """Return the graph in dot format (see Edge.get_dot())
+
+        :return: dot string ready to be used.
+        :rtype: <str>
+        """
+        return graph_to_dot(*self.export())
+
+
+def graph_to_dot(nodes, edges):
+    """Return the given nodes & edges in dot format (see Edge.get_dot())
+
+    :param arg1: List of nodes (see RelationGraph.export()).
+    :param arg2: List of (pseudo1, pseudo2, weight).
+    :type arg1: <list <tuple>>
+    :type arg2: <list <tuple <str>, <str>, <int>>>
+    :return: dot string ready to be used.
+    :rtype: <str>
+    """
+    return Edge.get_dot(
+        {pseudo: weight for pseudo, weight, *_ in nodes},
+        {(pseudo1, pseudo2): weight for pseudo1, pseudo2, weight in edges},
+        {pseudo: node_metrics for pseudo, _, *node_metrics in nodes})
+
+
+# Graphs used by forge_data(), by (network, channel)
+RELATION_GRAPHS = dict()
+
+
+def get_relation_graph(network, channel):
+    """Return the graph of relationships of the given channel.
+
+    ..Note: The graph is created on first use.
+
+    :param arg1: Network name.
+    :param arg2: Channel.
+    :type arg1: <str>
+    :type arg2: <str>
+    :rtype: <RelationGraph>
+    """
+    key = (network, channel)
+    if key not in RELATION_GRAPHS:
+        RELATION_GRAPHS[key] = RelationGraph(network, channel)
+    return RELATION_GRAPHS[key]
+
+
 class Log(Base, Item):
     """Log class definition"""
 
@@ -340,31 +1236,53 @@ class Log(Base, Item):
 
     # use utcnow to avoid timezones
     timestamp = Column(DateTime, default=datetime.datetime.now, nullable=False)
-    pseudo    = Column(String(50), nullable=False)
+    network   = Column(String(50), nullable=False)
+    channel   = Column(String(50), nullable=False)
+    user_id   = Column(Integer, nullable=False)
     event     = Column(Integer, nullable=False)
-
-    # Unicity constraint
-    # Note for MySQL, unicity & index is the same thing
-    Index('index_1', 'event', 'pseudo', unique=True)
-
-    def __init__(self, pseudo, event):
+    # Pseudo: given to the constructor, or loaded from the user table
+    pseudo    = pseudo_of(user_id)
+
+    # Indexes used by range queries on messages of a channel
+    # & to find the logs of a user
+    __table_args__ = (
+        Index('ix_log_channel_event_timestamp',
+              'network', 'channel', 'event', 'timestamp'),
+        Index('ix_log_user', 'user_id'),
+    )
+
+    def __init__(self, pseudo, event, network=None, channel=None):
         """Constructor takes pseudo of the poster & the event type
 
-        ..note: timestamp is setup automatically
+        ..note: timestamp is setup automatically at the creation of the object
+        ..note: The default channel is the first one of NETWORKS in commons.
 
         :param arg1: Poster's pseudo
         :param arg2: Event's type
+        :param arg3: Optional network name.
+        :param arg4: Optional channel.
         :type arg1: <str>
         :type arg2: <str>
+        :type arg3: <str>
+        :type arg4: <str>
 
         """
+        # Timestamp of the event, not of the (possibly delayed) insertion
+        self.timestamp = datetime.datetime.now()
+        if network is None:
+            network, channel = cm.default_channel()
+        self.network = network
+        self.channel = channel
+        # Id of the user is set before the insertion (see resolve_users())
         self.pseudo = pseudo
         self.event = event
 
     def __repr__(self):
-        return "id:{}, timestamp:{}, pseudo:{}, event:{}".format(
+        return "id:{}, timestamp:{}, channel:{}/{}, pseudo:{}, event:{}".format(
             self.id,
             self.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            self.network,
+            self.channel,
             self.pseudo,
             self.event)
 
@@ -381,41 +1299,78 @@ class Log(Base, Item):
         :rtype: <int>
 
         """
-        ret = session.query(Log).filter(Log.pseudo == user).delete()
-        session.commit()
+        user_id = User.get_id(session, user)
+        ret = 0
+        if user_id is not None:
+            # Committed chunk by chunk (see purge_users())
+            for _, _, ret, _ in purge_users(session, [user_id], edges=False):
+                pass
 
         LOGGER.debug(str(ret) + " messages deleted")
         return ret
 
     @staticmethod
-    def get_day_messages(session, previous=False):
-        """Get all messages in the current day.
+    def get_day_range(previous=False):
+        """Get the beginning & the end of the current day.
 
-        :param arg1: SQLAlchemy session.
-        :param arg2: A boolean to retrieve messages
-            from the current or previous day.
-        :type arg1: <SQL session object>
-        :type arg2: <boolean>
-        :return: Lists of Log objects.
-        :rtype: <list <Log>>
+        :param: A boolean to get the current or previous day.
+        :type: <boolean>
+        :return: Beginning (included) & end (excluded) of the day.
+        :rtype: <tuple <datetime>, <datetime>>
 
         """
         # Beginning of today
-        d1 = datetime.datetime.now().replace(hour=0, minute=0, second=0)
+        d1 = datetime.datetime.now().replace(hour=0, minute=0, second=0,
+                                             microsecond=0)
 
         # Is starting day the current or previous day ?
         if previous == True:
             d1 = d1 - datetime.timedelta(days=1)
 
-#        d1 = datetime.datetime.today()
-
         # End of today
         d2 = d1 + datetime.timedelta(days=1)
+        return d1, d2
 
-        query = session.query(Log).filter(Log.timestamp >= d1,
-                                          Log.timestamp < d2,
-                                          Log.event == cm.IRC_MSG)
-        results = [entity for entity in query]
+    @staticmethod
+    def get_week_range(previous=False):
+        """Get the beginning & the end of the current week.
+
+        :param: A boolean to get the current or previous week.
+        :type: <boolean>
+        :return: Beginning (included) & end (excluded) of the week.
+        :rtype: <tuple <datetime>, <datetime>>
+
+        """
+        # Today
+        d1 = datetime.datetime.today().replace(hour=0, minute=0, second=0,
+                                               microsecond=0)
+
+        # Is starting day the current or the day of the last week ?
+        if previous == True:
+            d1 = d1 - datetime.timedelta(days=7) # sub 7 days
+
+        # Current week
+        week_start = d1 - datetime.timedelta(days=d1.weekday())
+        week_end = week_start + datetime.timedelta(days=7)
+        LOGGER.debug("week_start: " + str(week_start))
+        LOGGER.debug("week_end: " + str(week_end))
+        return week_start, week_end
+
+    @staticmethod
+    def get_day_messages(session, previous=False):
+        """Get all messages in the current day.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: A boolean to retrieve messages
+            from the current or previous day.
+        :type arg1: <SQL session object>
+        :type arg2: <boolean>
+        :return: Lists of Log objects.
+        :rtype: <list <Log>>
+
+        """
+        d1, d2 = Log.get_day_range(previous)
+        results = Log.get_messages(session, d1, d2)
 
         LOGGER.debug("Messages per day : " + str(len(results)))
         return results
@@ -431,30 +1386,65 @@ class Log(Base, Item):
         :rtype: <list <Log>>
 
         """
-        # Today
-        d1 = datetime.datetime.today().replace(hour=0, minute=0, second=0)
+        week_start, week_end = Log.get_week_range(previous)
+        results = Log.get_messages(session, week_start, week_end)
 
-        # Is starting day the current or the day of the last week ?
-        if previous == True:
-            d1 = d1 - datetime.timedelta(days=7) # sub 7 days
+        LOGGER.debug("Messages per week : " + str(len(results)))
+        return results
 
+    @staticmethod
+    def get_messages(session, start, end):
+        """Get all messages in the given range.
 
-        # Current week
-        week_start = d1 - datetime.timedelta(days=d1.weekday())
-        week_end = week_start + datetime.timedelta(days=7)
-        LOGGER.debug("week_start: " + str(week_start))
-        LOGGER.debug("week_end: " + str(week_end))
+        ..Note: Messages of archived months are rows with the same
+            attributes as Log objects (pseudo included).
 
-        query = session.query(Log).filter(Log.timestamp >= week_start,
-                                          Log.timestamp < week_end,
-                                          Log.event == cm.IRC_MSG)
-        results = [entity for entity in query]
+        :param arg1: SQLAlchemy session.
+        :param arg2: Beginning of the range (included).
+        :param arg3: End of the range (excluded).
+        :type arg1: <SQL session object>
+        :type arg2: <datetime>
+        :type arg3: <datetime>
+        :return: Lists of Log objects.
+        :rtype: <list <Log>>
 
-        LOGGER.debug("Messages per week : " + str(len(results)))
+        """
+        results = list()
+        for table in iter_log_tables(session, start, end):
+            results += query_logs(session, table).filter(
+                table.c.timestamp >= start,
+                table.c.timestamp < end,
+                table.c.event == cm.IRC_MSG).all()
         return results
 
+    @classmethod
+    def get_all(cls, session):
+        """Get all logs, archived months included (see get_messages())
+
+        :param: SQLAlchemy session.
+        :type: <SQL session object>
+        :return: List of logs.
+        :rtype: <list <Log>>
+        """
+        results = list()
+        for table in iter_log_tables(session):
+            results += query_logs(session, table).all()
+        return results
+
+    @classmethod
+    def get_number(cls, session):
+        """Get the number of logs, archived months included
+
+        :param: SQLAlchemy session.
+        :type: <SQL session object>
+        :rtype: <int>
+        """
+        return sum(session.query(func.count()).select_from(table).scalar()
+                   for table in iter_log_tables(session))
+
 
     @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS, 'Log.get_messages_per_hour')
     def get_messages_per_hour(logs):
         """Extracts number of messages per hour of the day from the log list.
 
@@ -479,6 +1469,7 @@ class Log(Base, Item):
 
 
     @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS, 'Log.get_top_posters')
     def get_top_posters(logs):
         """Extracts pseudo & number of messages from the log list.
 
@@ -498,6 +1489,7 @@ class Log(Base, Item):
 
 
     @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS, 'Log.get_average_msgs_per_day')
     def get_average_msgs_per_day(logs):
         """Return a list of average messages per day
         since the beginning of the logging
@@ -530,47 +1522,1060 @@ class Log(Base, Item):
         return all_messages_by_days
 
 
-def forge_data(session):
-    """This function forges data for the website.
+    @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS, 'Log.sql_messages_per_hour')
+    def sql_messages_per_hour(session, start, end, network=None, channel=None):
+        """Get the number of messages per hour of the day in the given range.
+
+        ..Note: Same as get_messages_per_hour() but the counting is made
+            by SQLite; no Log object is loaded.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Beginning of the range (included).
+        :param arg3: End of the range (excluded).
+        :param arg4: Optional network name (default: all networks).
+        :param arg5: Optional channel (default: all channels).
+        :type arg1: <SQL session object>
+        :type arg2: <datetime>
+        :type arg3: <datetime>
+        :type arg4: <str>
+        :type arg5: <str>
+        :return: Lists of hours & number of messages
+        :rtype: [[labels], [values]]
+
+        """
+        messages_by_hours = Counter()
+        for table in iter_log_tables(session, start, end):
+            hour = sql_hour(table.c.timestamp)
+            query = session.query(hour, func.count()).filter(
+                table.c.timestamp >= start,
+                table.c.timestamp < end,
+                table.c.event == cm.IRC_MSG,
+                *channel_filter(table.c, network, channel)).group_by(hour)
+            messages_by_hours.update(dict(query.all()))
+
+        all_messages_by_hours = [
+            tuple(range(00,24)),
+            tuple(messages_by_hours.get(hour, 0) for hour in range(00,24)),
+        ]
+
+        LOGGER.debug("Messages per hour : " + str(all_messages_by_hours))
+        return all_messages_by_hours
+
+    @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS, 'Log.sql_top_posters')
+    def sql_top_posters(session, start, end, network=None, channel=None):
+        """Get pseudo & number of messages in the given range.
+
+        ..Note: Same as get_top_posters() but the counting is made
+            by SQLite; no Log object is loaded.
+        ..Note: 15 most common
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Beginning of the range (included).
+        :param arg3: End of the range (excluded).
+        :param arg4: Optional network name (default: all networks).
+        :param arg5: Optional channel (default: all channels).
+        :type arg1: <SQL session object>
+        :type arg2: <datetime>
+        :type arg3: <datetime>
+        :type arg4: <str>
+        :type arg5: <str>
+        :return: Lists of labels & number of messages
+        :rtype: [[labels], [values]]
+
+        """
+        # Counts of several partitions are merged
+        partitioned = bool(archived_months(start, end))
+        posters = Counter()
+        for table in iter_log_tables(session, start, end):
+            total = func.count().label('total')
+            query = session.query(table.c.user_id, total).filter(
+                table.c.timestamp >= start,
+                table.c.timestamp < end,
+                table.c.event == cm.IRC_MSG,
+                *channel_filter(table.c, network, channel)).group_by(
+                table.c.user_id).order_by(desc(total), table.c.user_id)
+            if not partitioned:
+                query = query.limit(15)
+            posters.update(dict(query.all()))
+
+        return top_posters_names(session, posters.items())
+
+    @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS, 'Log.sql_average_msgs_per_day')
+    def sql_average_msgs_per_day(session, network=None, channel=None):
+        """Return a list of average messages per day
+        since the beginning of the logging
+
+        ..Note: Same as get_average_msgs_per_day() but the counting is made
+            by SQLite; no Log object is loaded.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Optional network name (default: all networks).
+        :param arg3: Optional channel (default: all channels).
+        :type arg1: <SQL session object>
+        :type arg2: <str>
+        :type arg3: <str>
+        :return: List of values.
+        :rtype: <list>
+
+        """
+        # Number of events & of days for each day of the week
+        numbers, nb_days = Counter(), Counter()
+        for table in iter_log_tables(session):
+            query = session.query(sql_weekday(table.c.timestamp),
+                                  func.count()).filter(
+                *channel_filter(table.c, network, channel)).group_by(
+                sql_day(table.c.timestamp))
+            for weekday, number in query.all():
+                numbers[weekday] += number
+                nb_days[weekday] += 1
+
+        averages = {weekday: numbers[weekday] / nb_days[weekday]
+                    for weekday in nb_days}
+        LOGGER.debug("Average per day:" + str(averages))
+
+        # Extract an ordered list : each day and average messages
+        return [averages.get(day, 0.0) for day in range(0,7)]
+
+
+class HourlyRollup(Base, Item):
+    """Number of events per (network, channel, day, hour, user, event).
+
+    This table is maintained along with the insertion of logs;
+    it avoids the scan of the log table for the website.
+    """
+
+    __tablename__ = 'rollup_hourly'
+    network = Column(String(50), primary_key=True)
+    channel = Column(String(50), primary_key=True)
+    day    = Column(Date, primary_key=True)
+    hour   = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    event  = Column(Integer, primary_key=True, autoincrement=False)
+    count  = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "channel:{}/{}, day:{}, hour:{}, user_id:{}, event:{}, count:{}".format(
+            self.network,
+            self.channel,
+            self.day,
+            self.hour,
+            self.user_id,
+            self.event,
+            self.count)
+
+
+    @staticmethod
+    def update(session, logs):
+        """Add the given logs to the aggregates.
+
+        ..Note: The session is not committed.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: List of logs
+        :type arg1: <SQL session object>
+        :type arg2: <list <Log>>
+
+        """
+        keys = Counter((log.network,
+                        log.channel,
+                        log.timestamp.date(),
+                        log.timestamp.hour,
+                        log.user_id,
+                        log.event) for log in logs)
+
+        for (network, channel, day, hour, user_id, event), number in keys.items():
+            ret = session.query(HourlyRollup).filter(
+                HourlyRollup.network == network,
+                HourlyRollup.channel == channel,
+                HourlyRollup.day == day,
+                HourlyRollup.hour == hour,
+                HourlyRollup.user_id == user_id,
+                HourlyRollup.event == event,
+            ).update({HourlyRollup.count: HourlyRollup.count + number},
+                     synchronize_session=False)
+
+            if ret == 0:
+                session.add(HourlyRollup(network=network, channel=channel,
+                                         day=day, hour=hour, user_id=user_id,
+                                         event=event, count=number))
+
+    @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS,
+                   'HourlyRollup.get_messages_per_hour')
+    def get_messages_per_hour(session, start, end, network=None, channel=None):
+        """Get the number of messages per hour of the day in the given range.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Beginning of the range (included).
+        :param arg3: End of the range (excluded).
+        :param arg4: Optional network name (default: all networks).
+        :param arg5: Optional channel (default: all channels).
+        :type arg1: <SQL session object>
+        :type arg2: <datetime>
+        :type arg3: <datetime>
+        :type arg4: <str>
+        :type arg5: <str>
+        :return: Lists of hours & number of messages
+        :rtype: [[labels], [values]]
+
+        """
+        unzip = lambda liste: [tuple(li) for li in zip(*liste)]
+
+        query = session.query(HourlyRollup.hour,
+                              func.sum(HourlyRollup.count)).filter(
+            HourlyRollup.day >= start.date(),
+            HourlyRollup.day < end.date(),
+            HourlyRollup.event == cm.IRC_MSG,
+            *channel_filter(HourlyRollup, network, channel)).group_by(
+            HourlyRollup.hour)
+
+        # Initialize all hours of a day
+        all_messages_by_hours = Counter({hour : 0 for hour in range(00,24)})
+        # Update with data
+        all_messages_by_hours.update(dict(query.all()))
+        # Sort on day hours & return 2 lists [labels][values]
+        all_messages_by_hours = unzip(sorted(all_messages_by_hours.items(),
+                                             key=itemgetter(0)))
+
+        LOGGER.debug("Messages per hour : " + str(all_messages_by_hours))
+        return all_messages_by_hours
+
+    @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS, 'HourlyRollup.get_top_posters')
+    def get_top_posters(session, start, end, network=None, channel=None):
+        """Get pseudo & number of messages in the given range.
+
+        ..Note: 15 most common
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Beginning of the range (included).
+        :param arg3: End of the range (excluded).
+        :param arg4: Optional network name (default: all networks).
+        :param arg5: Optional channel (default: all channels).
+        :type arg1: <SQL session object>
+        :type arg2: <datetime>
+        :type arg3: <datetime>
+        :type arg4: <str>
+        :type arg5: <str>
+        :return: Lists of labels & number of messages
+        :rtype: [[labels], [values]]
+
+        """
+        total = func.sum(HourlyRollup.count).label('total')
+        query = session.query(HourlyRollup.user_id, total).filter(
+            HourlyRollup.day >= start.date(),
+            HourlyRollup.day < end.date(),
+            HourlyRollup.event == cm.IRC_MSG,
+            *channel_filter(HourlyRollup, network, channel)).group_by(
+            HourlyRollup.user_id).order_by(desc(total),
+                                           HourlyRollup.user_id).limit(15)
+
+        return top_posters_names(session, query.all())
+
+
+class DailyRollup(Base, Item):
+    """Number of events (of all types) per (network, channel, day).
+
+    This table is maintained along with the insertion of logs;
+    it avoids the scan of the log table for the website.
+    """
+
+    __tablename__ = 'rollup_daily'
+    network = Column(String(50), primary_key=True)
+    channel = Column(String(50), primary_key=True)
+    day     = Column(Date, primary_key=True)
+    weekday = Column(Integer, nullable=False)
+    count   = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "channel:{}/{}, day:{}, weekday:{}, count:{}".format(
+            self.network,
+            self.channel,
+            self.day,
+            self.weekday,
+            self.count)
+
+
+    @staticmethod
+    def update(session, logs):
+        """Add the given logs to the aggregates.
+
+        ..Note: The session is not committed.
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: List of logs
+        :type arg1: <SQL session object>
+        :type arg2: <list <Log>>
+
+        """
+        days = Counter((log.network, log.channel, log.timestamp.date())
+                       for log in logs)
+
+        for (network, channel, day), number in days.items():
+            ret = session.query(DailyRollup).filter(
+                DailyRollup.network == network,
+                DailyRollup.channel == channel,
+                DailyRollup.day == day,
+            ).update({DailyRollup.count: DailyRollup.count + number},
+                     synchronize_session=False)
+
+            if ret == 0:
+                session.add(DailyRollup(network=network, channel=channel,
+                                        day=day, weekday=day.weekday(),
+                                        count=number))
+
+    @staticmethod
+    @metrics.timed(metrics.AGGREGATION_SECONDS,
+                   'DailyRollup.get_average_msgs_per_day')
+    def get_average_msgs_per_day(session, network=None, channel=None):
+        """Return a list of average messages per day
+        since the beginning of the logging
+
+        :param arg1: SQLAlchemy session.
+        :param arg2: Optional network name (default: all networks).
+        :param arg3: Optional channel (default: all channels).
+        :type arg1: <SQL session object>
+        :type arg2: <str>
+        :type arg3: <str>
+        :return: List of values.
+        :rtype: <list>
+
+        """
+        # A day is counted once even if several channels are selected
+        query = session.query(DailyRollup.weekday,
+                              func.sum(DailyRollup.count),
+                              func.count(distinct(DailyRollup.day))).filter(
+            *channel_filter(DailyRollup, network, channel)).group_by(
+            DailyRollup.weekday)
+
+        averages = {weekday: number / nb_days
+                    for weekday, number, nb_days in query.all()}
+        LOGGER.debug("Average per day:" + str(averages))
+
+        # Extract an ordered list : each day and average messages
+        return [averages.get(day, 0.0) for day in range(0,7)]
+
+
+def update_rollups(session, rows):
+    """Add the logs found in the given rows to the aggregates.
+
+    ..Note: The session is not committed.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: List of rows (other objects than Log are ignored).
+    :type arg1: <SQL session object>
+    :type arg2: <list>
+    """
+    logs = [row for row in rows if isinstance(row, Log)]
+    if not logs:
+        return
+    HourlyRollup.update(session, logs)
+    DailyRollup.update(session, logs)
+
+
+def count_rollups(session, table, conditions, sign=1):
+    """Add (sign 1) or remove (sign -1) the logs matching the given
+    conditions to (from) the aggregates.
+
+    ..Note: Everything is done by SQLite: the logs are grouped by key
+        of aggregate, then the aggregates are replaced with their new values
+        (INSERT OR REPLACE). Aggregates without events are deleted
+        (days without events must not be counted in averages).
+    ..Note: The session is not committed.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Log table (see iter_log_tables()).
+    :param arg3: List of SQL conditions on the columns of the table.
+    :param arg4: Optional sign of the modification.
+    :type arg1: <SQL session object>
+    :type arg2: <Table>
+    :type arg3: <list>
+    :type arg4: <int>
+    """
+    day = sql_day(table.c.timestamp).label('day')
+    columns = {
+        HourlyRollup: [table.c.network, table.c.channel, day,
+                       sql_hour(table.c.timestamp).label('hour'),
+                       table.c.user_id, table.c.event],
+        DailyRollup: [table.c.network, table.c.channel, day],
+    }
+
+    for model, keys in columns.items():
+        rollup = model.__table__
+        values = keys[:]
+        if model is DailyRollup:
+            # Same weekday for all the logs of a day
+            values.append(sql_weekday(table.c.timestamp).label('weekday'))
+        logs = select(values + [func.count().label('number')]).where(
+            and_(*conditions)).group_by(*keys).alias('logs')
+        names = [column.name for column in values]
+        on = and_(*(rollup.c[column.name] == logs.c[column.name]
+                    for column in keys))
+        count = func.coalesce(rollup.c.count, 0) + sign * logs.c.number
+
+        if sign < 0:
+            session.execute(rollup.delete().where(
+                literal_column('rowid').in_(
+                    select([literal_column(rollup.name + '.rowid')]).select_from(
+                        logs.join(rollup, on)).where(count <= 0))))
+        session.execute(rollup.insert().prefix_with('OR REPLACE').from_select(
+            names + ['count'],
+            select([logs.c[name] for name in names] + [count]).select_from(
+                logs.outerjoin(rollup, on)).where(count > 0)))
+
+
+def resolve_users(session, rows):
+    """Set the user ids of the logs & edges found in the given rows.
+
+    ..Note: Ids are read from USERS; unknown pseudos are added to the user
+        table. The session is not committed.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: List of rows (other objects than Log & Edge are ignored).
+    :type arg1: <SQL session object>
+    :type arg2: <list>
+    """
+    logs = [row for row in rows if isinstance(row, Log)]
+    edges = [row for row in rows if isinstance(row, Edge)]
+    names = {log.pseudo for log in logs}
+    names.update(pseudo for edge in edges for pseudo in (edge.pseudo1,
+                                                         edge.pseudo2))
+    if not names:
+        return
+
+    ids = USERS.get_ids(session, names)
+    for log in logs:
+        log.user_id = ids[log.pseudo]
+    for edge in edges:
+        edge.user1_id, edge.user2_id = ids[edge.pseudo1], ids[edge.pseudo2]
+
+
+@event.listens_for(Session, 'before_flush')
+def resolve_new_users(session, flush_context, instances):
+    """Set the user ids of the logs & edges added to a session.
+
+    ..Note: Rows inserted by WriteBehind (without the unit of work)
+        are resolved by prepare_commit().
+    """
+    resolve_users(session, [row for row in session.new
+                            if getattr(row, 'user_id', 0) is None or
+                            getattr(row, 'user1_id', 0) is None])
+
+
+def prepare_commit(session, rows):
+    """Update the users, the aggregates & the revision of data
+    for the given new rows.
+
+    ..Note: Used by WriteBehind before each commit.
+    ..Note: The session is not committed.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: List of rows about to be inserted.
+    :type arg1: <SQL session object>
+    :type arg2: <list>
+    """
+    resolve_users(session, rows)
+    update_rollups(session, rows)
+    Revision.bump(session)
+
+
+def rollups_are_missing(session):
+    """Return True if there are logs but no aggregates in database.
+
+    :param: SQLAlchemy session.
+    :type: <SQL session object>
+    :rtype: <boolean>
+    """
+    return session.query(DailyRollup.day).first() is None and \
+        (session.query(Log.id).first() is not None or bool(archived_months()))
 
-    It's used by Flask or DataCaching object to generate data.
+
+def backfill_rollups(session):
+    """(Re)build the aggregates from all the logs in database.
+
+    ..Note: Everything is done by SQLite; the log table is aggregated
+        in a single transaction, then each archive in its own transaction.
 
     :param: SQLAlchemy session.
     :type: <SQL session object>
+    """
+    session.query(HourlyRollup).delete()
+    session.query(DailyRollup).delete()
+
+    for log in iter_log_tables(session):
+        day = sql_day(log.c.timestamp)
+        hour = sql_hour(log.c.timestamp)
+        weekday = sql_weekday(log.c.timestamp)
+
+        session.execute(HourlyRollup.__table__.insert().from_select(
+            ['network', 'channel', 'day', 'hour', 'user_id', 'event', 'count'],
+            session.query(log.c.network, log.c.channel, day, hour,
+                          log.c.user_id, log.c.event, func.count()).group_by(
+                log.c.network, log.c.channel, day, hour, log.c.user_id,
+                log.c.event).statement
+        ))
+        session.execute(DailyRollup.__table__.insert().from_select(
+            ['network', 'channel', 'day', 'weekday', 'count'],
+            session.query(log.c.network, log.c.channel, day, weekday,
+                          func.count()).group_by(
+                log.c.network, log.c.channel, day).statement
+        ))
+        Revision.bump(session)
+        session.commit()
+
+    LOGGER.info("Rollups built: " + \
+                str(HourlyRollup.get_number(session)) + " hourly, " + \
+                str(DailyRollup.get_number(session)) + " daily")
+
+
+################################################################################
+# Archives of logs
+# Logs of closed months are moved from the log table (hot partition)
+# to read-only SQLite files (one per month); they are attached to the
+# connection only when a query covers their month (see iter_log_tables()).
+# Aggregates of archived months are kept in the rollup tables.
+
+_ARCHIVE_NAME = re.compile(r'^log_(\d{4})_(\d{2})\.sqlite$')
+# Copies of the log table in the archives, by alias of the attached database
+_ARCHIVE_TABLES = dict()
+
+
+def archive_directory():
+    """Return the directory of the archives of logs"""
+    return cm.DIR_DATA + 'archives/'
+
+
+def month_start(date):
+    """Return the beginning of the month of the given date
+
+    :type: <datetime>
+    :rtype: <datetime>
+    """
+    return datetime.datetime(date.year, date.month, 1)
+
+
+def next_month(month):
+    """Return the beginning of the month following the given one
+
+    :type: <datetime>
+    :rtype: <datetime>
+    """
+    return month_start(month_start(month) + datetime.timedelta(days=32))
+
+
+def archive_path(month):
+    """Return the path of the archive of the given month
+
+    :type: <datetime>
+    :rtype: <str>
+    """
+    return archive_directory() + month.strftime('log_%Y_%m.sqlite')
+
+
+def archived_months(start=None, end=None):
+    """Return the archived months covering the given range
+
+    :param arg1: Optional beginning of the range (included).
+    :param arg2: Optional end of the range (excluded).
+    :type arg1: <datetime>
+    :type arg2: <datetime>
+    :return: Beginning of each month (sorted).
+    :rtype: <list <datetime>>
+    """
+    try:
+        names = os.listdir(archive_directory())
+    except FileNotFoundError:
+        return list()
+
+    months = list()
+    for name in names:
+        match = _ARCHIVE_NAME.match(name)
+        if match is None:
+            continue
+        month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+        if (start is None or next_month(month) > start) and \
+            (end is None or month < end):
+            months.append(month)
+    return sorted(months)
+
+
+def archive_table(alias):
+    """Return the log table of the database attached with the given alias
+
+    :type: <str>
+    :rtype: <Table>
+    """
+    if alias not in _ARCHIVE_TABLES:
+        _ARCHIVE_TABLES[alias] = Log.__table__.tometadata(MetaData(),
+                                                          schema=alias)
+    return _ARCHIVE_TABLES[alias]
+
+
+@contextmanager
+def attached_database(session, path, alias, read_only=True):
+    """Attach the given database to the connection of the session.
+
+    ..Note: A database can't be detached during a transaction; it is then
+        detached when the connection is closed (end of the transaction).
+        No more than 9 databases can be attached at the same time.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Path of the database.
+    :param arg3: Alias of the database in SQL statements.
+    :param arg4: Optional boolean; if False the database can be modified.
+    :type arg1: <SQL session object>
+    :type arg2: <str>
+    :type arg3: <str>
+    :type arg4: <boolean>
+    :return: Log table of the attached database.
+    :rtype: <Table>
+    """
+    session.execute('ATTACH DATABASE :path AS ' + alias,
+                    {'path': sqlite_uri(path, read_only)})
+    try:
+        yield archive_table(alias)
+    finally:
+        attached = {name for _, name, _ in
+                    session.execute('PRAGMA database_list')}
+        if alias in attached and \
+            not session.connection().connection.in_transaction:
+            session.execute('DETACH DATABASE ' + alias)
+
+
+def query_logs(session, table):
+    """Return a query on the logs of the given log table.
+
+    ..Note: Logs of the log table are Log objects; logs of the archives
+        are rows with the same attributes.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Log table (see iter_log_tables()).
+    :type arg1: <SQL session object>
+    :type arg2: <Table>
+    :rtype: <Query>
+    """
+    if table is Log.__table__:
+        return session.query(Log)
+    return session.query(*table.c, User.name.label('pseudo')).outerjoin(
+        User, User.id == table.c.user_id)
+
+
+def iter_log_tables(session, start=None, end=None):
+    """Route a query on logs to the partitions covering the given range.
+
+    The log table is yielded first, then the archives of the range;
+    each archive is attached during its iteration only.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Optional beginning of the range (included).
+    :param arg3: Optional end of the range (excluded).
+    :type arg1: <SQL session object>
+    :type arg2: <datetime>
+    :type arg3: <datetime>
+    :return: Generator of log tables.
+    :rtype: <generator <Table>>
+    """
+    yield Log.__table__
+    for month in archived_months(start, end):
+        with attached_database(session, archive_path(month),
+                               month.strftime('archive_%Y_%m')) as table:
+            yield table
+
+
+def seal_archive(tmp_path, path):
+    """Compact (VACUUM) the given temporary archive, make it read-only,
+    then rename it to the given path.
+
+    :param arg1: Path of the temporary archive.
+    :param arg2: Path of the archive.
+    :type arg1: <str>
+    :type arg2: <str>
+    """
+    connection = sqlite3.connect(tmp_path)
+    connection.execute('VACUUM')
+    connection.close()
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, path)
+
+
+def archive_month(session, month, chunk_size=None):
+    """Move the logs of the given month into its archive.
+
+    - Logs are copied in a temporary file (the archive if it already
+        exists is completed: logs are identified by their id),
+    - the file is compacted (VACUUM), made read-only & renamed,
+    - logs are deleted from the log table, by ranges of chunk_size ids.
+
+    ..Note: If the process stops in the meantime, the next call
+        completes the work.
+    ..Note: Aggregates of the month are not modified.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Beginning of the month.
+    :param arg3: Optional number of ids in each range
+        (default: PURGE_CHUNK_SIZE).
+    :type arg1: <SQL session object>
+    :type arg2: <datetime>
+    :type arg3: <int>
+    :return: Number of archived logs.
+    :rtype: <int>
+    """
+    chunk_size = chunk_size or cm.PURGE_CHUNK_SIZE
+    start, end = month, next_month(month)
+    path = archive_path(month)
+    tmp_path = path + '.tmp'
+    os.makedirs(archive_directory(), exist_ok=True)
+
+    if os.path.isfile(path):
+        copyfile(path, tmp_path)
+        os.chmod(tmp_path, 0o644)
+    else:
+        engine = create_engine('sqlite:///' + tmp_path)
+        Log.__table__.create(engine, checkfirst=True)
+        engine.dispose()
+
+    # Copy (logs already archived are ignored)
+    columns = [column.name for column in Log.__table__.columns]
+    with attached_database(session, tmp_path, 'archive_new',
+                           read_only=False) as table:
+        logs = select([Log.__table__.c[name] for name in columns]).where(
+            and_(Log.timestamp >= start, Log.timestamp < end))
+        ret = session.execute(
+            table.insert().prefix_with('OR IGNORE').from_select(columns, logs)
+        ).rowcount
+        session.commit()
+
+    seal_archive(tmp_path, path)
+
+    # The archive is complete: logs are deleted by ranges of ids
+    # (one transaction per range) to let the bot write meanwhile
+    in_month = and_(Log.timestamp >= start, Log.timestamp < end)
+    first, last = session.query(func.min(Log.id), func.max(Log.id)).filter(
+        in_month).one()
+    session.commit()
+    if first is not None:
+        for lo in range(first, last + 1, chunk_size):
+            session.execute(Log.__table__.delete().where(and_(
+                Log.id >= lo, Log.id < lo + chunk_size, in_month)))
+            session.commit()
+            time.sleep(cm.PURGE_STEP_DELAY)
+
+    LOGGER.info("Archives: " + str(ret) + " logs moved to " + path)
+    return ret
+
+
+def archive_logs(session, now=None):
+    """Move the logs of closed months into archives.
+
+    ..Note: The current month & the ARCHIVE_HOT_MONTHS - 1 previous ones
+        stay in the log table.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Optional current date.
+    :type arg1: <SQL session object>
+    :type arg2: <datetime>
+    :return: Archived months.
+    :rtype: <list <datetime>>
+    """
+    # Beginning of the oldest month kept in the log table
+    limit = month_start(now or datetime.datetime.now())
+    for _ in range(cm.ARCHIVE_HOT_MONTHS - 1):
+        limit = month_start(limit - datetime.timedelta(days=1))
+
+    months = list()
+    while True:
+        # Logs are not always inserted in chronological order (imports)
+        oldest = session.query(func.min(Log.timestamp)).filter(
+            Log.timestamp < limit).scalar()
+        if oldest is None:
+            break
+        months.append(month_start(oldest))
+        archive_month(session, months[-1])
+    return months
+
+
+def rewrite_archive(month, statement, params=None):
+    """Execute the given statement on the archive of the given month,
+    then compact it.
+
+    ..Note: Archives are read-only; the archive is modified in a temporary
+        copy which replaces it (only if rows are modified).
+
+    :param arg1: Beginning of the month.
+    :param arg2: SQL statement on the log table.
+    :param arg3: Optional parameters of the statement.
+    :type arg1: <datetime>
+    :type arg2: <str>
+    :type arg3: <dict>
+    :return: Number of modified rows.
+    :rtype: <int>
+    """
+    path = archive_path(month)
+    tmp_path = path + '.tmp'
+    copyfile(path, tmp_path)
+    os.chmod(tmp_path, 0o644)
+
+    connection = sqlite3.connect(tmp_path)
+    rowcount = connection.execute(statement, params or {}).rowcount
+    connection.commit()
+    connection.close()
+
+    if not rowcount:
+        os.remove(tmp_path)
+        return 0
+    seal_archive(tmp_path, path)
+    return rowcount
+
+
+def backup_archives(directory):
+    """Copy the archives which are not yet in the given directory.
+
+    ..Note: Archives are modified only by the deletion of users;
+        a copy is made again if the modification time differs.
+
+    :param: Directory of the backups.
+    :type: <str>
+    :return: Number of copied archives.
+    :rtype: <int>
+    """
+    os.makedirs(directory, exist_ok=True)
+    copied = 0
+    for month in archived_months():
+        path = archive_path(month)
+        backup_path = os.path.join(directory, os.path.basename(path))
+        if os.path.isfile(backup_path) and \
+            os.stat(backup_path).st_mtime == os.stat(path).st_mtime:
+            continue
+        copy2(path, backup_path)
+        copied += 1
+    return copied
+
+
+################################################################################
+# Deletion of users
+# Logs & relationships of users are deleted by ranges of ids, one transaction
+# per range: the bot (writer) & the website are never blocked for long.
+# Aggregates are decreased & revisions are bumped in the transaction of
+# each range; the archives are then rewritten one by one.
+
+def purge_users(session, user_ids, logs=True, edges=True, chunk_size=None):
+    """Delete the logs and/or the relationships of the given users.
+
+    ..Note: This is a generator; each step is committed before being
+        yielded. Rows inserted after the first step are kept.
+    ..Note: On error, the session must be rolled back by the caller;
+        the steps already yielded are kept.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Iterable of user ids.
+    :param arg3: Optional boolean; if False logs are kept.
+    :param arg4: Optional boolean; if False relationships are kept.
+    :param arg5: Optional number of ids in each range
+        (default: PURGE_CHUNK_SIZE).
+    :type arg1: <SQL session object>
+    :type arg2: <iterable <int>>
+    :type arg3: <boolean>
+    :type arg4: <boolean>
+    :type arg5: <int>
+    :return: Generator of (done steps, number of steps, deleted logs,
+        deleted edges).
+    :rtype: <generator <tuple <int>, <int>, <int>, <int>>>
+    """
+    chunk_size = chunk_size or cm.PURGE_CHUNK_SIZE
+    user_ids = sorted(set(user_ids))
+    # Number of parameters of a query is limited
+    groups = [user_ids[i:i + UserCache.CHUNK_SIZE]
+              for i in range(0, len(user_ids), UserCache.CHUNK_SIZE)]
+
+    # Ranges of ids existing now (later rows are not read)
+    ranges = list()
+    for table, enabled in ((Log.__table__, logs), (Edge.__table__, edges)):
+        # min() & max() are read with the index only if they are alone
+        first = session.query(func.min(table.c.id)).scalar()
+        last = session.query(func.max(table.c.id)).scalar()
+        if enabled and first is not None:
+            ranges.extend((table, lo, min(lo + chunk_size, last + 1))
+                          for lo in range(first, last + 1, chunk_size))
+    months = archived_months() if logs else list()
+    session.commit()
+
+    deleted = {Log.__table__: 0, Edge.__table__: 0}
+    steps = len(ranges) + len(months)
+    step = 0
+    for table, lo, hi in ranges:
+        number = 0
+        for group in groups:
+            if table is Log.__table__:
+                conditions = [table.c.user_id.in_(group)]
+                count_rollups(session, table, conditions +
+                              [table.c.id >= lo, table.c.id < hi], -1)
+            else:
+                conditions = [or_(table.c.user1_id.in_(group),
+                                  table.c.user2_id.in_(group))]
+            number += session.execute(table.delete().where(and_(
+                table.c.id >= lo, table.c.id < hi, *conditions))).rowcount
+        if number:
+            Revision.bump(session)
+            if table is Edge.__table__:
+                # In-memory graphs must be reloaded
+                Revision.bump(session, 'edge_purge')
+        session.commit()
+
+        deleted[table] += number
+        step += 1
+        yield step, steps, deleted[Log.__table__], deleted[Edge.__table__]
+
+    # User ids are integers: the statement has no parameter
+    statement = 'DELETE FROM log WHERE user_id IN (' + \
+        ','.join(str(int(user_id)) for user_id in user_ids) + ')'
+    for month in months:
+        with attached_database(session, archive_path(month),
+                               'archive_purge') as table:
+            for group in groups:
+                count_rollups(session, table, [table.c.user_id.in_(group)], -1)
+            number = rewrite_archive(month, statement)
+            if number:
+                Revision.bump(session)
+            session.commit()
+
+        deleted[Log.__table__] += number
+        step += 1
+        yield step, steps, deleted[Log.__table__], deleted[Edge.__table__]
+
+
+# Available backends for the aggregation of data (see ANALYTICS_BACKEND)
+ANALYTICS_BACKENDS = ('rollup', 'sql', 'numpy')
+
+
+def get_installed_backends():
+    """Return the analytics backends whose dependencies are installed.
+
+    ..Note: The 'numpy' backend requires NumPy.
+
+    :rtype: <list <str>>
+    """
+    return [backend for backend in ANALYTICS_BACKENDS
+            if backend != 'numpy' or importlib.util.find_spec('numpy')]
+
+
+def get_analytics_functions(backend=None):
+    """Return the functions used to aggregate data for the given backend.
+
+    - 'rollup': aggregates are read from HourlyRollup & DailyRollup tables,
+    - 'sql': aggregates are computed by SQLite from the log table,
+    - 'numpy': columns of the log table are read into NumPy arrays
+        & aggregated by NumPy (see analytics_numpy).
+
+    :param: Name of the backend (default: ANALYTICS_BACKEND in commons).
+    :type: <str>
+    :return: Functions to get top posters, messages per hour & average
+        of messages per day.
+    :rtype: <tuple <callable>, <callable>, <callable>>
+    """
+    backend = cm.ANALYTICS_BACKEND if backend is None else backend
+
+    if backend == 'sql':
+        return (Log.sql_top_posters,
+                Log.sql_messages_per_hour,
+                Log.sql_average_msgs_per_day)
+
+    if backend == 'numpy':
+        # NumPy is imported only if this backend is used
+        from irc_bot import analytics_numpy
+        return (analytics_numpy.get_top_posters,
+                analytics_numpy.get_messages_per_hour,
+                analytics_numpy.get_average_msgs_per_day)
+
+    return (HourlyRollup.get_top_posters,
+            HourlyRollup.get_messages_per_hour,
+            DailyRollup.get_average_msgs_per_day)
+
+
+@metrics.timed(metrics.AGGREGATION_SECONDS, 'forge_data')
+def forge_data(session, backend=None, graph=None, network=None,
+               channel=None):
+    """This function forges data of a channel for the website.
+
+    It's used by Flask or DataCaching object to generate data.
+
+    ..Note: The way data is aggregated depends on ANALYTICS_BACKEND
+        in commons; see get_analytics_functions().
+    ..Note: The relationship graph is updated with the new edges only;
+        its metrics are computed only if edges have changed.
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Optional name of the analytics backend.
+    :param arg3: Optional graph of relationships
+        (default: the one of the channel in RELATION_GRAPHS).
+    :param arg4: Optional network name (default: the default channel).
+    :param arg5: Optional channel (default: the default channel).
+    :type arg1: <SQL session object>
+    :type arg2: <str>
+    :type arg3: <RelationGraph>
+    :type arg4: <str>
+    :type arg5: <str>
     :return: Dictionary of all parameters used in the template.
     :rtype: <dict>
     """
 
-    prev_day_msgs  = Log.get_day_messages(session, previous=True)
-    prev_week_msgs = Log.get_week_messages(session, previous=True)
-    day_msgs       = Log.get_day_messages(session)
-    week_msgs      = Log.get_week_messages(session)
-    edges          = Edge.get_all(session)
+    if network is None:
+        network, channel = cm.default_channel()
+    where = {'network': network, 'channel': channel}
+    top_posters, per_hour, average = get_analytics_functions(backend)
+
+    prev_day  = Log.get_day_range(previous=True)
+    prev_week = Log.get_week_range(previous=True)
+    day       = Log.get_day_range()
+    week      = Log.get_week_range()
+    graph     = get_relation_graph(network, channel) if graph is None else graph
+    graph.update(session)
+    graph.update_metrics()
+    graph_nodes, graph_edges = graph.export()
+    # Levels of detail: the page of each level is small & fast to lay out
+    graph_levels = graph_pruning.prune_levels(graph_nodes, graph_edges)
 
     return {
         'nginx_prefix' : cm.STATIC_PREFIX,
-        'data_bar_day' : Log.get_top_posters(
-            day_msgs),
-        'data_bar_prev_day' : Log.get_top_posters(
-            prev_day_msgs),
-        'data_bar_week' : Log.get_top_posters(
-            week_msgs),
-        'data_line_prev_week' : Log.get_messages_per_hour(
-            prev_week_msgs),
-        'data_line_week' : Log.get_messages_per_hour(
-            week_msgs),
-        'data_line_prev_day' : Log.get_messages_per_hour(
-            prev_day_msgs),
-        'data_line_day' : Log.get_messages_per_hour(
-            day_msgs),
-        'data_average' : Log.get_average_msgs_per_day(
-            Log.get_all(session)),
-        'data_graph' : Edge.get_graph(edges)
+        'network' : network,
+        'channel' : channel,
+        'data_bar_day' : top_posters(session, *day, **where),
+        'data_bar_prev_day' : top_posters(session, *prev_day, **where),
+        'data_bar_week' : top_posters(session, *week, **where),
+        'data_line_prev_week' : per_hour(session, *prev_week, **where),
+        'data_line_week' : per_hour(session, *week, **where),
+        'data_line_prev_day' : per_hour(session, *prev_day, **where),
+        'data_line_day' : per_hour(session, *day, **where),
+        'data_average' : average(session, **where),
+        # Graph of the page (dot format), in the default level of detail
+        'data_graph' : graph_to_dot(*graph_levels[cm.GRAPH_DEFAULT_LEVEL]),
+        # Raw graph used by the API (full & pruned) & by other levels
+        'graph_nodes' : graph_nodes,
+        'graph_edges' : graph_edges,
+        'graph_levels' : graph_levels,
     }
 
 
+def forge_all_data(session, backend=None):
+    """Forge data of all the watched channels (see NETWORKS in commons).
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Optional name of the analytics backend.
+    :type arg1: <SQL session object>
+    :type arg2: <str>
+    :return: Data of each channel (see forge_data()).
+    :rtype: <dict <tuple <str>, <str>>: <dict>>
+    """
+    return {(network, channel): forge_data(session, backend,
+                                           network=network, channel=channel)
+            for network, channel in cm.get_channels()}
+
+
 if __name__ == "__main__":
 
+    cm.init()
     with SQLA_Wrapper() as session:
 
 #        session.add(Edge("a", "b"))
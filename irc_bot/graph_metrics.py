@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of the graphs of relationships: degree, PageRank, betweenness
+centrality (approximated) & communities of each user.
+
+Metrics are computed by pure Python functions (NetworkX is optional & slow
+to import) in a pool of processes: the Gunicorn worker which forges data
+keeps serving requests meanwhile (no GIL contention).
+They are computed again only when the edges of a graph change
+(see database.RelationGraph.update_metrics()).
+
+Graphs are given as {(node1, node2): weight}, weights being numbers
+of messages.
+"""
+
+# Standard imports
+import os
+import random
+import multiprocessing
+import multiprocessing.util
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+# Custom imports
+from irc_bot import commons as cm
+
+LOGGER = cm.logger()
+
+# Pool shared by the graphs of all the channels (created on first use)
+_POOL = None
+_POOL_LOCK = Lock()
+
+
+def _reset_pool():
+    """Forget the pool of the parent in a forked process
+
+    The processes of the pool belong to the parent: a forked process
+    (multiprocessing child, Gunicorn worker) creates its own pool.
+    """
+    global _POOL, _POOL_LOCK
+    _POOL = None
+    _POOL_LOCK = Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pool)
+
+
+def shutdown_pool():
+    """Stop the processes of the pool (if any)
+
+    ..Note: Called at the exit of the process, including multiprocessing
+        children: the processes of the pool are not daemonic & would be
+        joined forever.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def get_adjacency(edges):
+    """Return the weighted neighbours of each node
+
+    :param: Weight of each pair of nodes.
+    :type: <dict <tuple>: <int>>
+    :rtype: <dict <object>: <dict <object>: <int>>>
+    """
+    adjacency = defaultdict(dict)
+    for (node1, node2), weight in edges.items():
+        adjacency[node1][node2] = adjacency[node1].get(node2, 0) + weight
+        adjacency[node2][node1] = adjacency[node2].get(node1, 0) + weight
+    return adjacency
+
+
+def pagerank(adjacency, damping=0.85, tolerance=1e-6, max_iterations=100):
+    """Return the PageRank of each node (power iteration on weighted edges)
+
+    ..Note: Values sum to 1.
+
+    :param arg1: Weighted neighbours of each node (see get_adjacency()).
+    :param arg2: Damping factor.
+    :param arg3: Convergence threshold (sum of the variations).
+    :param arg4: Maximum number of iterations.
+    :rtype: <dict <object>: <float>>
+    """
+    size = len(adjacency)
+    if not size:
+        return dict()
+    # Share of the rank given to each neighbour
+    links = {node: [(neighbour, weight / sum(neighbours.values()))
+                    for neighbour, weight in neighbours.items()]
+             for node, neighbours in adjacency.items()}
+    ranks = dict.fromkeys(adjacency, 1 / size)
+    for _ in range(max_iterations):
+        new_ranks = dict.fromkeys(adjacency, (1 - damping) / size)
+        for node, rank in ranks.items():
+            rank *= damping
+            for neighbour, share in links[node]:
+                new_ranks[neighbour] += rank * share
+        delta = sum(abs(new_ranks[node] - ranks[node]) for node in ranks)
+        ranks = new_ranks
+        if delta < tolerance:
+            break
+    return ranks
+
+
+def betweenness(adjacency, samples=0, seed=0):
+    """Return the betweenness centrality of each node (Brandes algorithm)
+
+    Shortest paths are counted in hops. The centrality is approximated
+    from the given number of sources drawn at random (exact if 0 or
+    greater than the number of nodes), then normalized in [0, 1].
+
+    :param arg1: Weighted neighbours of each node (see get_adjacency()).
+    :param arg2: Number of sources.
+    :param arg3: Seed of the draw of sources.
+    :rtype: <dict <object>: <float>>
+    """
+    nodes = sorted(adjacency, key=str)
+    centrality = dict.fromkeys(nodes, 0.0)
+    sources = nodes
+    if 0 < samples < len(nodes):
+        sources = random.Random(seed).sample(nodes, samples)
+
+    for source in sources:
+        # Number of shortest paths & predecessors of each node
+        stack = list()
+        predecessors = defaultdict(list)
+        paths = defaultdict(int)
+        paths[source] = 1
+        distances = {source: 0}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            stack.append(node)
+            for neighbour in adjacency[node]:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[node] + 1
+                    queue.append(neighbour)
+                if distances[neighbour] == distances[node] + 1:
+                    paths[neighbour] += paths[node]
+                    predecessors[neighbour].append(node)
+        # Accumulation of the dependencies
+        dependencies = defaultdict(float)
+        while stack:
+            node = stack.pop()
+            for predecessor in predecessors[node]:
+                dependencies[predecessor] += paths[predecessor] / paths[node] * \
+                    (1 + dependencies[node])
+            if node != source:
+                centrality[node] += dependencies[node]
+
+    # Undirected graph: each path is seen from both ends
+    size = len(nodes)
+    if size > 2:
+        scale = size / len(sources) / ((size - 1) * (size - 2))
+        for node in centrality:
+            centrality[node] *= scale
+    return centrality
+
+
+def communities(adjacency, max_iterations=20, seed=0):
+    """Return the community of each node (weighted label propagation)
+
+    Each node takes the label with the heaviest weight among its neighbours,
+    in a random order, until no label changes.
+    Communities are numbered by decreasing size (0: the biggest).
+
+    :param arg1: Weighted neighbours of each node (see get_adjacency()).
+    :param arg2: Maximum number of iterations.
+    :param arg3: Seed of the random order.
+    :rtype: <dict <object>: <int>>
+    """
+    rand = random.Random(seed)
+    nodes = sorted(adjacency, key=str)
+    labels = {node: index for index, node in enumerate(nodes)}
+    for _ in range(max_iterations):
+        rand.shuffle(nodes)
+        changed = False
+        for node in nodes:
+            weights = defaultdict(int)
+            for neighbour, weight in adjacency[node].items():
+                if neighbour != node:
+                    weights[labels[neighbour]] += weight
+            if not weights:
+                continue
+            best = max(weights.values())
+            candidates = [label for label, weight in weights.items()
+                          if weight == best]
+            if labels[node] not in candidates:
+                labels[node] = min(candidates)
+                changed = True
+        if not changed:
+            break
+
+    sizes = defaultdict(int)
+    for label in labels.values():
+        sizes[label] += 1
+    numbers = {label: number for number, label in enumerate(
+        sorted(sizes, key=lambda label: (-sizes[label], label)))}
+    return {node: numbers[label] for node, label in labels.items()}
+
+
+def compute_metrics(edges, samples=0, seed=0):
+    """Return the metrics of each node of the given graph
+
+    ..Note: Called in a process of the pool: arguments & result are pickled.
+
+    :param arg1: Weight of each pair of nodes.
+    :param arg2: Number of sources of the betweenness (see betweenness()).
+    :param arg3: Seed of the random draws.
+    :type arg1: <dict <tuple>: <int>>
+    :type arg2: <int>
+    :type arg3: <int>
+    :return: Degree, PageRank, betweenness & community of each node.
+    :rtype: <dict <object>: <tuple <int>, <float>, <float>, <int>>>
+    """
+    adjacency = get_adjacency(edges)
+    ranks = pagerank(adjacency)
+    centrality = betweenness(adjacency, samples, seed)
+    groups = communities(adjacency, seed=seed)
+    return {node: (len(neighbours), ranks[node], centrality[node],
+                   groups[node])
+            for node, neighbours in adjacency.items()}
+
+
+def get_pool():
+    """Return the pool of processes (created on first use)
+
+    ..Note: Processes are spawned, not forked: the caller is a thread
+        of a multithreaded process (Gunicorn worker).
+
+    :rtype: <ProcessPoolExecutor>
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=cm.GRAPH_METRICS_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'))
+            # Run by atexit in the main process & at the end of
+            # multiprocessing children, before they join their children
+            multiprocessing.util.Finalize(None, shutdown_pool, exitpriority=20)
+        return _POOL
+
+
+def get_metrics(edges):
+    """Compute the metrics of the given graph in the pool of processes
+    (in the current thread if GRAPH_METRICS_PROCESSES is 0).
+
+    ..Note: If the pool is broken (killed process...), the metrics
+        are computed in the current thread & a new pool is used next time.
+
+    :param: Weight of each pair of nodes.
+    :type: <dict <tuple>: <int>>
+    :return: Metrics of each node (see compute_metrics()).
+    :rtype: <dict <object>: <tuple <int>, <float>, <float>, <int>>>
+    """
+    global _POOL
+    args = (edges, cm.GRAPH_BETWEENNESS_SAMPLES)
+    if not cm.GRAPH_METRICS_PROCESSES:
+        return compute_metrics(*args)
+    pool = get_pool()
+    try:
+        return pool.submit(compute_metrics, *args).result()
+    except (OSError, RuntimeError) as e:
+        # BrokenProcessPool is a RuntimeError
+        LOGGER.error("Graph metrics: pool of processes failed; " + str(e))
+        with _POOL_LOCK:
+            if _POOL is pool:
+                _POOL = None
+        pool.shutdown(wait=False)
+        return compute_metrics(*args)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Levels of detail of the graphs of relationships.
+
+A graph is pruned before being sent to the browser, which lays out every
+node & edge it receives: the heaviest edges are kept (top-K, minimum
+weight), users with few relationships are removed (k-core) and the users
+who talk only to one hub are collapsed into a single node.
+
+Standard levels (see GRAPH_LEVELS in commons) are pruned once per
+generation of data, along with the forge of data, and only if the graph
+exceeds their number of edges; other parameters are pruned on demand
+(see website.api_graph()).
+
+Nodes & edges are the ones exported by database.RelationGraph.export():
+(pseudo, weight, degree, PageRank, betweenness, community)
+& (pseudo1, pseudo2, weight).
+"""
+
+# Standard imports
+import heapq
+from collections import defaultdict
+from operator import itemgetter
+# Custom imports
+from irc_bot import commons as cm
+
+LOGGER = cm.logger()
+
+# Parameters of prune() accepted in the query string of the website
+PARAMETERS = ('top_edges', 'min_weight', 'k_core', 'collapse_leaves')
+
+
+def keep_top_edges(edges, number):
+    """Return the given number of heaviest edges
+
+    ..Note: Edges of the same weight are sorted by pseudos
+        (the result doesn't depend on the order of the edges).
+
+    :param arg1: List of (pseudo1, pseudo2, weight).
+    :param arg2: Number of edges.
+    :type arg1: <list <tuple <str>, <str>, <int>>>
+    :type arg2: <int>
+    :rtype: <list <tuple <str>, <str>, <int>>>
+    """
+    if len(edges) <= number:
+        return edges
+    return heapq.nsmallest(number, edges,
+                           key=lambda edge: (-edge[2], edge[0], edge[1]))
+
+
+def keep_k_core(edges, k):
+    """Return the edges of the k-core of the graph: users with less
+    than k relationships are removed until none is left.
+
+    :param arg1: List of (pseudo1, pseudo2, weight).
+    :param arg2: Minimum degree.
+    :type arg1: <list <tuple <str>, <str>, <int>>>
+    :type arg2: <int>
+    :rtype: <list <tuple <str>, <str>, <int>>>
+    """
+    neighbours = defaultdict(set)
+    for pseudo1, pseudo2, _ in edges:
+        if pseudo1 != pseudo2:
+            neighbours[pseudo1].add(pseudo2)
+            neighbours[pseudo2].add(pseudo1)
+
+    removed = set()
+    pending = [pseudo for pseudo, others in neighbours.items()
+               if len(others) < k]
+    while pending:
+        pseudo = pending.pop()
+        if pseudo in removed:
+            continue
+        removed.add(pseudo)
+        for other in neighbours[pseudo]:
+            neighbours[other].discard(pseudo)
+            if len(neighbours[other]) < k and other not in removed:
+                pending.append(other)
+
+    return [edge for edge in edges
+            if edge[0] in neighbours and edge[1] in neighbours
+            and edge[0] not in removed and edge[1] not in removed]
+
+
+def collapse_leaf_nodes(nodes, edges):
+    """Collapse the leaves of each hub (users with a single relationship,
+    with the hub) into one node named "<hub> +<number of leaves>".
+
+    ..Note: The weights of the leaves & of their edges are summed;
+        the collapsed node is in the community of the hub.
+        A hub with a single leaf is not modified.
+
+    :param arg1: Nodes by pseudo (see module documentation).
+    :param arg2: List of (pseudo1, pseudo2, weight).
+    :type arg1: <dict <str>: <tuple>>
+    :type arg2: <list <tuple <str>, <str>, <int>>>
+    :return: Nodes & edges.
+    :rtype: <tuple <dict <str>: <tuple>>, <list <tuple>>>
+    """
+    degrees = defaultdict(int)
+    for pseudo1, pseudo2, _ in edges:
+        degrees[pseudo1] += 1
+        degrees[pseudo2] += 1
+
+    # Edges between a leaf & its hub, by hub
+    leaves = defaultdict(list)
+    for edge in edges:
+        pseudo1, pseudo2, _ = edge
+        if pseudo1 == pseudo2:
+            continue
+        if degrees[pseudo1] == 1 and degrees[pseudo2] > 1:
+            leaves[pseudo2].append(edge)
+        elif degrees[pseudo2] == 1 and degrees[pseudo1] > 1:
+            leaves[pseudo1].append(edge)
+
+    collapsed = set()
+    new_nodes, new_edges = dict(nodes), list()
+    for hub, hub_edges in leaves.items():
+        if len(hub_edges) < 2:
+            continue
+        pseudos = [pseudo1 if pseudo2 == hub else pseudo2
+                   for pseudo1, pseudo2, _ in hub_edges]
+        collapsed.update(pseudos)
+        name = '{} +{}'.format(hub, len(pseudos))
+        leaf_nodes = [new_nodes.pop(pseudo) for pseudo in pseudos]
+        new_nodes[name] = (
+            name,
+            sum(node[1] for node in leaf_nodes),
+            1,
+            sum(node[3] for node in leaf_nodes),
+            0.0,
+            nodes[hub][5],
+        )
+        new_edges.append((hub, name, sum(map(itemgetter(2), hub_edges))))
+
+    new_edges.extend(edge for edge in edges
+                     if edge[0] not in collapsed and edge[1] not in collapsed)
+    return new_nodes, new_edges
+
+
+def prune(nodes, edges, top_edges=None, min_weight=1, k_core=0,
+          collapse_leaves=False):
+    """Return a level of detail of the given graph
+
+    Edges lighter than min_weight are removed, then only the top_edges
+    heaviest ones are kept, then the k-core is extracted & the leaves
+    are collapsed. Users without relationship are removed.
+
+    ..Note: The size of the result is bounded by top_edges edges
+        & 2 * top_edges nodes.
+
+    :param arg1: List of nodes (see module documentation).
+    :param arg2: List of (pseudo1, pseudo2, weight).
+    :param arg3: Optional maximum number of edges (None: all).
+    :param arg4: Optional minimum weight of edges.
+    :param arg5: Optional minimum degree of users (0: all).
+    :param arg6: Optional boolean; if True leaves are collapsed.
+    :type arg1: <list <tuple>>
+    :type arg2: <list <tuple <str>, <str>, <int>>>
+    :type arg3: <int>
+    :type arg4: <int>
+    :type arg5: <int>
+    :type arg6: <boolean>
+    :return: Nodes & edges.
+    :rtype: <tuple <list <tuple>>, <list <tuple>>>
+    """
+    if min_weight > 1:
+        edges = [edge for edge in edges if edge[2] >= min_weight]
+    if top_edges is not None:
+        edges = keep_top_edges(edges, top_edges)
+    if k_core > 1:
+        edges = keep_k_core(edges, k_core)
+
+    kept = {pseudo for edge in edges for pseudo in edge[:2]}
+    nodes = {node[0]: node for node in nodes if node[0] in kept}
+    if collapse_leaves:
+        nodes, edges = collapse_leaf_nodes(nodes, edges)
+    return list(nodes.values()), edges
+
+
+def prune_levels(nodes, edges):
+    """Return the standard levels of detail of the given graph
+    (see GRAPH_LEVELS in commons)
+
+    ..Note: Levels only bound the size of big graphs: a graph which has
+        no more edges than the top_edges of a level is not pruned
+        (pairs of users seen once are kept on small channels).
+
+    :param arg1: List of nodes (see module documentation).
+    :param arg2: List of (pseudo1, pseudo2, weight).
+    :type arg1: <list <tuple>>
+    :type arg2: <list <tuple <str>, <str>, <int>>>
+    :return: Nodes & edges of each level.
+    :rtype: <dict <str>: <tuple <list <tuple>>, <list <tuple>>>>
+    """
+    full_graph = prune(nodes, edges)
+    levels = dict()
+    for level, parameters in cm.GRAPH_LEVELS.items():
+        top_edges = parameters.get('top_edges')
+        if top_edges is not None and len(edges) <= top_edges:
+            levels[level] = full_graph
+        else:
+            levels[level] = prune(nodes, edges, **parameters)
+    return levels
@@ -1,7 +1,10 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-from irc_bot.website import app
+from irc_bot.website import create_app
+
+# Gunicorn: irc_bot.irc_bot:app
+app = create_app()
 
 if __name__ == '__main__':
     app.run()
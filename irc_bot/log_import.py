@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Import of the logs of IRC clients (irssi, weechat, ZNC).
+
+Files are read as streams of lines; events are replayed like the handlers
+of the bot do it (connected users of the channel, detection of
+relationships) and inserted in bulk with executemany() on the SQLite
+connection, IMPORT_BATCH_SIZE rows per transaction.
+No ORM object is built: memory doesn't depend on the size of the logs.
+
+Indexes of the log & edge tables are dropped during the import; they are
+created again at the end, then the aggregates of the imported logs
+are computed by SQLite.
+
+..Note: The bot must be stopped during the import.
+..Note: One file contains the events of one channel; files are imported
+    in the given order. Events already in database are not detected.
+"""
+
+# Standard imports
+import os
+import re
+import sys
+import time
+from sqlalchemy import func
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import database as db
+from irc_bot.nick_tracker import NickTracker
+
+LOGGER = cm.logger()
+
+# Type of event of nick changes (not saved in database)
+NICK_CHANGE = -1
+
+# Months of the dates written by irssi (not localized)
+MONTHS = {name: '{:02d}'.format(number) for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+     'Nov', 'Dec'), 1)}
+
+# Characters of the modes of users before their nicks (@op, +voice...)
+MODE_PREFIXES = ' @+%&~!'
+
+
+################################################################################
+# Parsers
+# Each parser yields the events of the given lines of a file:
+# (timestamp 'YYYY-MM-DD HH:MM:SS', type of event, nick, text or new nick).
+# Quits & parts are both IRC_QUIT events (see the handlers of the bot).
+
+_IRSSI_DAY = re.compile(r'^--- (?:Log opened|Day changed) \w{3} (\w{3}) '
+                        r'(\d{2}) (?:[\d:]+ )?(\d{4})')
+_IRSSI_MSG = re.compile(r'^(\d\d:\d\d(?::\d\d)?) <[ @+%&~]?([^>]+)> (.*)$')
+_IRSSI_EVENT = re.compile(r'^(\d\d:\d\d(?::\d\d)?) -!- (\S+) (?:'
+                          r'\[[^\]]*\] has (joined|left|quit)|'
+                          r'was (kicked) from|'
+                          r'is now known as (\S+))')
+
+
+def parse_irssi(lines, path):
+    """Yield the events of an irssi log
+
+    ..Note: Days are given by the lines 'Log opened' & 'Day changed';
+        events before the first one are ignored.
+    """
+    day = None
+    for line in lines:
+        match = _IRSSI_MSG.match(line)
+        if match is not None:
+            if day is not None:
+                clock, nick, text = match.groups()
+                yield (day + clock + (':00' if len(clock) == 5 else ''),
+                       cm.IRC_MSG, nick, text)
+            continue
+
+        match = _IRSSI_EVENT.match(line)
+        if match is not None:
+            if day is None:
+                continue
+            clock, nick, action, kick, new_nick = match.groups()
+            timestamp = day + clock + (':00' if len(clock) == 5 else '')
+            if action == 'joined':
+                yield timestamp, cm.IRC_JOIN, nick, None
+            elif action is not None:
+                yield timestamp, cm.IRC_QUIT, nick, None
+            elif kick is not None:
+                yield timestamp, cm.IRC_KICK, nick, None
+            else:
+                yield timestamp, NICK_CHANGE, nick, new_nick
+            continue
+
+        match = _IRSSI_DAY.match(line)
+        if match is not None and match.group(1) in MONTHS:
+            month, mday, year = match.groups()
+            day = year + '-' + MONTHS[month] + '-' + mday + ' '
+
+
+_WEECHAT_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\t([^\t]*)\t(.*)$')
+_WEECHAT_JOIN = re.compile(r'^(\S+) \(.*\) has joined ')
+_WEECHAT_QUIT = re.compile(r'^(\S+) \(.*\) has (?:left|quit)')
+_WEECHAT_KICK = re.compile(r'^\S+ has kicked (\S+)')
+_WEECHAT_NICK = re.compile(r'^(\S+) is now known as (\S+)$')
+
+
+def parse_weechat(lines, path):
+    """Yield the events of a weechat log"""
+    for line in lines:
+        match = _WEECHAT_LINE.match(line)
+        if match is None:
+            continue
+        timestamp, prefix, text = match.groups()
+
+        if prefix == '-->':
+            match = _WEECHAT_JOIN.match(text)
+            if match is not None:
+                yield timestamp, cm.IRC_JOIN, match.group(1), None
+        elif prefix == '<--':
+            match = _WEECHAT_QUIT.match(text)
+            if match is not None:
+                yield timestamp, cm.IRC_QUIT, match.group(1), None
+                continue
+            match = _WEECHAT_KICK.match(text)
+            if match is not None:
+                yield timestamp, cm.IRC_KICK, match.group(1), None
+        elif prefix == '--':
+            match = _WEECHAT_NICK.match(text)
+            if match is not None:
+                yield timestamp, NICK_CHANGE, match.group(1), match.group(2)
+        elif prefix and prefix[-1] not in '*!=-' and ' ' not in prefix:
+            # Other prefixes are the nicks of the authors
+            yield timestamp, cm.IRC_MSG, prefix.lstrip(MODE_PREFIXES), text
+
+
+_ZNC_DATE = re.compile(r'(\d{4})-?(\d\d)-?(\d\d)(?:\.log)?$')
+_ZNC_LINE = re.compile(r'^\[(\d\d:\d\d:\d\d)\] (?:<([^>]+)> (.*)|\*\*\* (.*))$')
+_ZNC_EVENT = re.compile(r'^(?:(Joins|Parts|Quits): (\S+) |'
+                        r'(\S+) was kicked by |'
+                        r'(\S+) is now known as (\S+))')
+
+
+def parse_znc(lines, path):
+    """Yield the events of a ZNC log (log module)
+
+    ..Note: The day is given by the name of the file
+        (<...>YYYY-MM-DD.log or <...>YYYYMMDD.log).
+    """
+    match = _ZNC_DATE.search(os.path.basename(path))
+    if match is None:
+        raise ValueError("No date in the name of the ZNC log <" + path + ">")
+    day = '-'.join(match.groups()) + ' '
+
+    for line in lines:
+        match = _ZNC_LINE.match(line)
+        if match is None:
+            continue
+        clock, nick, text, status = match.groups()
+        if nick is not None:
+            yield day + clock, cm.IRC_MSG, nick.lstrip(MODE_PREFIXES), text
+            continue
+
+        match = _ZNC_EVENT.match(status)
+        if match is None:
+            continue
+        action, nick, kicked, old_nick, new_nick = match.groups()
+        if action == 'Joins':
+            yield day + clock, cm.IRC_JOIN, nick, None
+        elif action is not None:
+            yield day + clock, cm.IRC_QUIT, nick, None
+        elif kicked is not None:
+            yield day + clock, cm.IRC_KICK, kicked, None
+        else:
+            yield day + clock, NICK_CHANGE, old_nick, new_nick
+
+
+# Parser of each format of logs
+FORMATS = {
+    'irssi': parse_irssi,
+    'weechat': parse_weechat,
+    'znc': parse_znc,
+}
+
+
+################################################################################
+# Import
+
+class LogImport():
+    """Replay of the events of a channel & insertion in bulk.
+
+    The connected users of the channel are known from joins, parts, quits,
+    kicks & nick changes; users who speak are connected too (the logs
+    don't contain the list of the users already connected).
+    Relationships are detected like in IRCAnalytics.on_pubmsg().
+
+    Attributes:
+        - private: _session, SQLAlchemy session
+        - private: _batch_size, number of rows inserted in each transaction
+        - private: _logs, pending logs (timestamp, pseudo, event)
+        - private: _edges, pending edges (timestamp, pseudo1, pseudo2)
+        - public: network, network name of the events <str>
+        - public: channel, channel of the events <str>
+        - public: lines, number of read lines <int>
+        - public: inserted_logs, number of inserted logs <int>
+        - public: inserted_edges, number of inserted edges <int>
+    """
+
+    def __init__(self, session, network=None, channel=None, batch_size=None):
+        """Constructor
+        :param arg1: SQLAlchemy session.
+        :param arg2: Optional network name (default: the first network).
+        :param arg3: Optional channel (default: the first channel).
+        :param arg4: Optional number of rows in each transaction
+            (default: IMPORT_BATCH_SIZE).
+        :type arg1: <SQL session object>
+        :type arg2: <str>
+        :type arg3: <str>
+        :type arg4: <int>
+        """
+        if channel is None:
+            network, channel = cm.default_channel()
+        elif network is None:
+            network = cm.default_channel()[0]
+        self._session = session
+        self._batch_size = batch_size or cm.IMPORT_BATCH_SIZE
+        self._logs = list()
+        self._edges = list()
+        self._start = time.monotonic()
+        self.network = network
+        self.channel = channel
+        self.lines = 0
+        self.inserted_logs = 0
+        self.inserted_edges = 0
+
+    def read(self, path, parser):
+        """Replay the events of the given file
+
+        :param arg1: Path of the file ('-': standard input).
+        :param arg2: Parser of the lines (see FORMATS).
+        :type arg1: <str>
+        :type arg2: <callable>
+        """
+        # The users of the channel are unknown at the beginning of a file
+        nicks = NickTracker()
+        nicks.join(self.channel)
+        channel = self.channel
+        logs, edges = self._logs, self._edges
+
+        if path == '-':
+            file = sys.stdin
+        else:
+            file = open(path, 'r', encoding='utf-8', errors='replace')
+        try:
+            for timestamp, event, nick, text in parser(self._count(file), path):
+                if event == cm.IRC_MSG:
+                    if cm.ENABLE_USERS_WHITELIST and \
+                        nick not in cm.USERS_WHITELIST:
+                        continue
+                    nicks.add_users(channel, [nick])
+                    # Detection of relationships (see on_pubmsg())
+                    for dest in nicks.get_addressees(channel, nick, text):
+                        edges.append((timestamp,) + ((nick, dest)
+                                                     if nick < dest else
+                                                     (dest, nick)))
+                elif event == cm.IRC_JOIN:
+                    nicks.add_users(channel, [nick])
+                elif event == NICK_CHANGE:
+                    nicks.rename_user(nick, text)
+                    continue
+                else:
+                    nicks.remove_user(channel, nick)
+
+                logs.append((timestamp, nick, event))
+                if len(logs) >= self._batch_size:
+                    self.flush()
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+    def _count(self, lines):
+        """Count the given lines while they are read"""
+        for line in lines:
+            self.lines += 1
+            yield line.rstrip('\n')
+
+    def flush(self):
+        """Insert the pending logs & edges in a single transaction"""
+        logs, edges = self._logs, self._edges
+        if not logs and not edges:
+            return
+        session = self._session
+        names = {pseudo for _, pseudo, _ in logs}
+        names.update(pseudo for _, pseudo1, pseudo2 in edges
+                     for pseudo in (pseudo1, pseudo2))
+        ids = db.USERS.get_ids(session, names)
+
+        # Format of the timestamps stored by SQLAlchemy
+        network, channel = self.network, self.channel
+        cursor = session.connection().connection.cursor()
+        cursor.executemany(
+            "INSERT INTO log (network, channel, timestamp, user_id, event) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((network, channel, timestamp + '.000000', ids[pseudo], event)
+             for timestamp, pseudo, event in logs))
+        cursor.executemany(
+            "INSERT INTO edge (network, channel, timestamp, user1_id, user2_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((network, channel, timestamp + '.000000', ids[pseudo1],
+              ids[pseudo2]) for timestamp, pseudo1, pseudo2 in edges))
+        session.commit()
+
+        self.inserted_logs += len(logs)
+        self.inserted_edges += len(edges)
+        logs.clear()
+        edges.clear()
+        LOGGER.info("Import: {} lines, {} logs & {} edges ({:.0f} lines/s)"
+                    "".format(self.lines, self.inserted_logs,
+                              self.inserted_edges,
+                              self.lines / (time.monotonic() - self._start)))
+
+
+def import_logs(session, paths, log_format, network=None, channel=None):
+    """Import the given log files of an IRC client.
+
+    ..Note: Indexes are created & aggregates are computed even if the
+        import fails (for the rows already inserted).
+
+    :param arg1: SQLAlchemy session.
+    :param arg2: Paths of the files ('-': standard input).
+    :param arg3: Format of the files (see FORMATS).
+    :param arg4: Optional network name (default: the first network).
+    :param arg5: Optional channel (default: the first channel).
+    :type arg1: <SQL session object>
+    :type arg2: <list <str>>
+    :type arg3: <str>
+    :type arg4: <str>
+    :type arg5: <str>
+    :return: Number of read lines, inserted logs & inserted edges.
+    :rtype: <tuple <int>, <int>, <int>>
+    """
+    start = time.monotonic()
+    parser = FORMATS[log_format]
+    importer = LogImport(session, network, channel)
+    # Imported logs are the ones after the last log
+    last_id = session.query(func.max(db.Log.id)).scalar() or 0
+    indexes = [index for model in (db.Log, db.Edge)
+               for index in model.__table__.indexes]
+
+    # Indexes are built once at the end
+    for index in indexes:
+        session.execute('DROP INDEX IF EXISTS ' + index.name)
+    session.commit()
+    try:
+        for path in paths:
+            LOGGER.info("Import: <" + path + ">...")
+            importer.read(path, parser)
+        importer.flush()
+    finally:
+        session.rollback()
+        LOGGER.info("Import: create indexes...")
+        for index in indexes:
+            index.create(session.connection())
+        LOGGER.info("Import: update rollups...")
+        table = db.Log.__table__
+        db.count_rollups(session, table, [table.c.id > last_id])
+        db.Revision.bump(session)
+        session.commit()
+
+    LOGGER.info("Import: done; {} lines, {} logs & {} edges in {:.0f}s".format(
+        importer.lines, importer.inserted_logs, importer.inserted_edges,
+        time.monotonic() - start))
+    return importer.lines, importer.inserted_logs, importer.inserted_edges
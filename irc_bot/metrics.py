@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the hot paths (Prometheus text format).
+
+Metrics are kept in memory by each process:
+- the bot writes them in a file (textfile collector of node_exporter)
+    & serves them on a Unix socket (see MetricsExporter),
+- the website serves them on its /metrics route.
+
+The cost of a measure is a call to perf_counter() & a locked update.
+"""
+
+# Standard imports
+import os
+import time
+import bisect
+import tempfile
+import socketserver
+from threading import Thread, Lock
+from functools import wraps
+# Custom imports
+from irc_bot import commons as cm
+
+LOGGER = cm.logger()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (in seconds) of the buckets of histograms
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5,
+                   10)
+
+# All the declared metrics
+REGISTRY = list()
+
+
+def _format_labels(names, values, extra=''):
+    """Return the labels of a sample: {name="value",...}"""
+    labels = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                               .replace('"', '\\"').replace('\n', '\\n'))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _format_value(value):
+    """Return the given number as a sample value (integers are kept)"""
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric():
+    """Base class of metrics.
+
+    Attributes:
+        - public: name, name of the metric <str>
+        - public: documentation, help text <str>
+        - public: labelnames, names of the labels <tuple <str>>
+        - private: _values, value(s) for each tuple of labels <dict>
+        - private: _lock, lock protecting updates
+    """
+
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        """Constructor
+        :param arg1: Name of the metric.
+        :param arg2: Help text.
+        :param arg3: Optional names of the labels.
+        :type arg1: <str>
+        :type arg2: <str>
+        :type arg3: <tuple <str>>
+        """
+        self.name          = name
+        self.documentation = documentation
+        self.labelnames    = tuple(labelnames)
+        self._values       = dict()
+        self._lock         = Lock()
+        REGISTRY.append(self)
+
+    def samples(self):
+        """Return the samples of the metric
+
+        :return: List of (suffix, label values, extra label, value).
+        :rtype: <list <tuple>>
+        """
+        with self._lock:
+            return [('', labels, '', value)
+                    for labels, value in sorted(self._values.items())]
+
+    def render(self):
+        """Return the metric in Prometheus text format (empty if no sample)
+
+        :rtype: <str>
+        """
+        samples = self.samples()
+        if not samples:
+            return ''
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type_name)]
+        lines += ['{}{}{} {}'.format(self.name, suffix,
+                                     _format_labels(self.labelnames, labels,
+                                                    extra),
+                                     _format_value(value))
+                  for suffix, labels, extra, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """Value which only increases (number of events...)"""
+
+    type_name = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """Increment the counter of the given label values"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Value which goes up & down; it can be computed at each rendering.
+
+    Attributes:
+        - private: _function, optional callable returning the value
+            (without labels)
+    """
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        """Constructor (see Metric)"""
+        Metric.__init__(self, name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, *labels):
+        """Set the value of the given label values"""
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, function):
+        """Compute the value with the given callable at each rendering.
+
+        ..Note: The callable may return None if the value is unknown.
+        """
+        self._function = function
+
+    def samples(self):
+        """Return the samples of the metric (see Metric.samples())"""
+        if self._function is None:
+            return Metric.samples(self)
+        value = self._function()
+        return [] if value is None else [('', (), '', value)]
+
+
+class Histogram(Metric):
+    """Distribution of durations (or sizes) in cumulative buckets.
+
+    Attributes:
+        - public: buckets, upper bounds of the buckets <tuple <float>>
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        """Constructor (see Metric)
+        :param arg4: Optional upper bounds of the buckets.
+        :type arg4: <tuple <float>>
+        """
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """Add the given value to the distribution of the label values"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Counts of buckets (+Inf included), sum of values
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) \
+                    + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        """Return the samples of the metric (see Metric.samples())"""
+        with self._lock:
+            values = sorted((labels, list(counts))
+                            for labels, counts in self._values.items())
+        samples = list()
+        for labels, counts in values:
+            cumulated = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulated += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                samples.append(('_bucket', labels, 'le="' + le + '"',
+                                cumulated))
+            samples.append(('_sum', labels, '', counts[-1]))
+            samples.append(('_count', labels, '', cumulated))
+        return samples
+
+
+def timed(histogram, *labels):
+    """Decorator which observes the duration of the decorated function
+    in the given histogram.
+
+    :param arg1: Histogram of durations.
+    :param arg2: Label values of the observations.
+    :type arg1: <Histogram>
+    """
+    def decorator(func):
+        @wraps(func)
+        def modified_func(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return modified_func
+    return decorator
+
+
+def render():
+    """Return all the metrics in Prometheus text format
+
+    :rtype: <str>
+    """
+    return ''.join(metric.render() for metric in REGISTRY)
+
+
+################################################################################
+# Bot
+IRC_EVENTS = Counter('pirc_irc_events_total',
+                     "IRC events received by the bot.", ('type',))
+HANDLER_SECONDS = Histogram('pirc_handler_seconds',
+                            "Duration of the handlers of IRC events.",
+                            ('handler',))
+COMMIT_SECONDS = Histogram('pirc_commit_seconds',
+                           "Duration of the commits of the write-behind "
+                           "buffer.")
+COMMIT_FAILURES = Counter('pirc_commit_failures_total',
+                          "Failed commits of the write-behind buffer "
+                          "(retried: database locked, lost: rows dropped).",
+                          ('outcome',))
+COMMITTED_ROWS = Counter('pirc_committed_rows_total',
+                         "Rows inserted by the write-behind buffer.",
+                         ('table',))
+DROPPED_ROWS = Counter('pirc_dropped_rows_total',
+                       "Rows dropped by the write-behind buffer "
+                       "(database locked for too long).", ('table',))
+PENDING_ROWS = Gauge('pirc_pending_rows',
+                     "Rows queued in the write-behind buffer.")
+
+# Website
+FORGE_SECONDS = Histogram('pirc_forge_seconds',
+                          "Duration of the forge of data (this process).")
+LAST_FORGE_SECONDS = Gauge('pirc_last_forge_seconds',
+                           "Duration of the last forge of data.")
+AGGREGATION_SECONDS = Histogram('pirc_aggregation_seconds',
+                                "Duration of the aggregations of data.",
+                                ('function',))
+CACHE_AGE = Gauge('pirc_cache_age_seconds', "Age of the forged data.")
+CACHE_GENERATION = Gauge('pirc_cache_generation',
+                         "Generation of the forged data.")
+GRAPH_METRICS_SECONDS = Histogram('pirc_graph_metrics_seconds',
+                                  "Duration of the computation of the "
+                                  "metrics of graphs (this process).")
+GRAPH_SIZE = Gauge('pirc_graph_size',
+                   "Number of nodes & edges of the graphs of relationships.",
+                   ('network', 'channel', 'kind'))
+################################################################################
+
+
+class _MetricsHandler(socketserver.StreamRequestHandler):
+    """Send the metrics to the client & close the connection"""
+
+    def handle(self):
+        self.wfile.write(render().encode('utf-8'))
+
+
+class MetricsExporter(Thread):
+    """Overriding the Thread class and only override the __init__()
+    and run() methods of this class.
+
+    This class is used to load an independant thread able to export the
+    metrics of the bot every METRICS_EXPORT_DELAY seconds in METRICS_FILE
+    (atomic rename), and to serve them on the METRICS_SOCKET Unix socket.
+
+    Attributes:
+        - private: _server, Unix socket server (if METRICS_SOCKET is set)
+    """
+
+    def __init__(self):
+        """Constructor"""
+        Thread.__init__(self, name="MetricsExporter", daemon=True)
+        self._server = None
+
+    def write_file(self):
+        """Write the metrics in METRICS_FILE"""
+        directory = os.path.dirname(cm.METRICS_FILE) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(render())
+            # mkstemp() creates the file readable only by its owner;
+            # node_exporter may run as another user
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, cm.METRICS_FILE)
+        except OSError as e:
+            LOGGER.error("Metrics: file not written; " + str(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def serve_socket(self):
+        """Serve the metrics on METRICS_SOCKET (in a dedicated thread)"""
+        if os.path.exists(cm.METRICS_SOCKET):
+            os.remove(cm.METRICS_SOCKET)
+        self._server = socketserver.UnixStreamServer(cm.METRICS_SOCKET,
+                                                     _MetricsHandler)
+        Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def run(self):
+        """Heart of the class; This method exports the metrics."""
+
+        LOGGER.info("Metrics exporter started !")
+        if cm.METRICS_SOCKET:
+            self.serve_socket()
+
+        while cm.METRICS_FILE:
+            self.write_file()
+            time.sleep(cm.METRICS_EXPORT_DELAY)
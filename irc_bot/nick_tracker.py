@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Connected users of each channel.
+
+Nicks are case-folded according to the IRC RFC 1459 (Foo[] == foo{})
+and used as keys of dicts mapping them to their current spelling;
+a membership test costs a translation & a hash lookup.
+"""
+
+# Standard imports
+import re
+import time
+import string
+import logging
+# Custom imports
+from irc_bot import commons as cm
+
+LOGGER = cm.logger()
+
+# RFC 1459: []\^ are the upper case of {}|~
+_RFC1459_TABLE = str.maketrans(string.ascii_uppercase + '[]\\^',
+                               string.ascii_lowercase + '{}|~')
+
+
+def irc_lower(name):
+    """Return the given nick or channel case-folded according to RFC 1459
+
+    :param: Nick or channel.
+    :type: <str>
+    :rtype: <str>
+    """
+    return name.translate(_RFC1459_TABLE)
+
+
+# Message addressed to a nick: "<nick>: <text>"
+ADDRESSEE_REG = re.compile(r'^(\w*): (.*)$')
+# Words that may be nicks (RFC 2812: letters, digits & []\`_^{|}-,
+# ~ is the case-folded ^); the group keeps them in the result of split()
+NICK_REG = re.compile(r'([\w\[\]\\`^{|}~-]+)')
+_NOT_WORD_REG = re.compile(r'\W+')
+
+
+class NickTracker():
+    """Connected users of each channel joined by the bot.
+
+    Users are maintained from join/part/quit/kick/nick/namreply events
+    (see register()), or by the public methods (replay of logs).
+
+    ..Note: Handlers of the bot are called after the arrival of a user
+        (join, nick, namreply) and before its departure (part, kick, quit):
+        during the handling of an event, the user is still a member
+        of the channel.
+
+    Attributes:
+        - private: _users, folded nicks of each channel mapped to
+            their current spelling <dict <str>: <dict <str>: <str>>>
+        - private: _names, name of each channel (as joined)
+            <dict <str>: <str>>
+        - private: _last_dumps, time of the last dump of each channel
+            (see log_users()) <dict <str>: <float>>
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self._users      = dict()
+        self._names      = dict()
+        self._last_dumps = dict()
+
+    def register(self, connection):
+        """Maintain the users from the events of the given connection.
+
+        :param: Server connection (or reactor) of the bot.
+        :type: <ServerConnection>
+        """
+        # Before the handlers of the bot (priority -10)
+        for event in ("join", "nick", "namreply", "disconnect"):
+            connection.add_global_handler(event,
+                                          getattr(self, "_on_" + event), -25)
+        # After the handlers of the bot
+        for event in ("part", "kick", "quit"):
+            connection.add_global_handler(event,
+                                          getattr(self, "_on_" + event), 10)
+
+    def has_user(self, channel, nick):
+        """Return True if the given nick is connected on the given channel
+
+        :param arg1: Channel.
+        :param arg2: Nick.
+        :type arg1: <str>
+        :type arg2: <str>
+        :rtype: <boolean>
+        """
+        users = self._users.get(irc_lower(channel))
+        return users is not None and irc_lower(nick) in users
+
+    def get_channels(self, nick):
+        """Return the channels where the given nick is connected
+
+        :param: Nick.
+        :type: <str>
+        :return: Names of channels.
+        :rtype: <list <str>>
+        """
+        nick = irc_lower(nick)
+        return [self._names[channel]
+                for channel, users in self._users.items() if nick in users]
+
+    def get_users(self, channel):
+        """Return the nicks connected on the given channel
+
+        ..Note: The returned dict must not be modified.
+
+        :param: Channel.
+        :type: <str>
+        :return: Folded nicks mapped to their current spelling.
+        :rtype: <dict <str>: <str>>
+        """
+        return self._users.get(irc_lower(channel), dict())
+
+    def get_mentions(self, channel, message):
+        """Return the connected users mentioned in the given message
+
+        Nicks are whole words found anywhere in the message
+        ("nick: ", "nick,", "@nick", "thanks nick!"...). The message is split
+        by NICK_REG & the words are looked up in the users of the channel
+        (maintained by the events): the cost is linear in the length
+        of the message, whatever the number of connected users.
+
+        ..Note: Each user is returned once, with its current nick
+            (not the spelling used in the message: "BOB" or "bob" is "Bob").
+
+        :param arg1: Channel.
+        :param arg2: Message.
+        :type arg1: <str>
+        :type arg2: <str>
+        :return: Mentioned nicks & the message without them.
+        :rtype: <tuple <list <str>>, <str>>
+        """
+        users = self._users.get(irc_lower(channel))
+        # Case folding keeps the words at the same positions:
+        # words are at odd indexes of both lists
+        folded = NICK_REG.split(irc_lower(message))
+        if not users or users.keys().isdisjoint(folded[1::2]):
+            # Most messages: no loop in Python
+            return [], message
+        parts = NICK_REG.split(message)
+        mentions = dict()
+        for index in range(1, len(folded), 2):
+            if folded[index] in users:
+                mentions.setdefault(folded[index], users[folded[index]])
+                parts[index] = ''
+        return list(mentions.values()), ''.join(parts)
+
+    def get_addressees(self, channel, author, message):
+        """Return the users to whom the given message is addressed
+        (relationships with its author)
+
+        ..Note: The author is excluded; micro messages (at most 3 letters
+            or digits without the mentioned nicks) are addressed to nobody.
+
+        :param arg1: Channel.
+        :param arg2: Nick of the author.
+        :param arg3: Message.
+        :type arg1: <str>
+        :type arg2: <str>
+        :type arg3: <str>
+        :return: Mentioned nicks.
+        :rtype: <list <str>>
+        """
+        mentions, text = self.get_mentions(channel, message)
+        if not mentions or len(_NOT_WORD_REG.sub('', text)) <= 3:
+            return []
+        author = irc_lower(author)
+        return [nick for nick in mentions if irc_lower(nick) != author]
+
+    def log_users(self, channel):
+        """Log the users of the given channel (debug level).
+
+        ..Note: The list is dumped at most once every NICKS_LOG_DELAY seconds
+            for each channel.
+
+        :param: Channel.
+        :type: <str>
+        """
+        if not LOGGER.isEnabledFor(logging.DEBUG):
+            return
+        folded = irc_lower(channel)
+        now = time.monotonic()
+        if now - self._last_dumps.get(folded, float('-inf')) < \
+            cm.NICKS_LOG_DELAY:
+            return
+        self._last_dumps[folded] = now
+        LOGGER.debug("Connected users on <" + channel + ">: " + \
+                     str(sorted(self.get_users(channel).values())))
+
+    def join(self, channel):
+        """Start the tracking of the given channel (joined by the bot)
+
+        :param: Channel.
+        :type: <str>
+        """
+        self._users[irc_lower(channel)] = dict()
+        self._names[irc_lower(channel)] = channel
+
+    def leave(self, channel):
+        """Stop the tracking of the given channel (left by the bot)
+
+        :param: Channel.
+        :type: <str>
+        """
+        self._users.pop(irc_lower(channel), None)
+        self._names.pop(irc_lower(channel), None)
+
+    def add_users(self, channel, nicks):
+        """Add the given nicks to the given channel (if tracked)
+
+        :param arg1: Channel.
+        :param arg2: Iterable of nicks.
+        :type arg1: <str>
+        :type arg2: <iterable <str>>
+        """
+        users = self._users.get(irc_lower(channel))
+        if users is not None:
+            users.update((irc_lower(nick), nick) for nick in nicks)
+
+    def remove_user(self, channel, nick):
+        """Remove the given nick from the given channel
+        (from all the channels if channel is None)
+
+        :param arg1: Channel.
+        :param arg2: Nick.
+        :type arg1: <str>
+        :type arg2: <str>
+        """
+        nick = irc_lower(nick)
+        if channel is None:
+            for users in self._users.values():
+                users.pop(nick, None)
+            return
+        users = self._users.get(irc_lower(channel))
+        if users is not None:
+            users.pop(nick, None)
+
+    def rename_user(self, before, after):
+        """Rename the given nick in all the channels
+
+        :param arg1: Old nick.
+        :param arg2: New nick.
+        :type arg1: <str>
+        :type arg2: <str>
+        """
+        folded_before = irc_lower(before)
+        folded_after = irc_lower(after)
+        for users in self._users.values():
+            if folded_before in users:
+                # Also updates the spelling of a case change (foo -> Foo)
+                del users[folded_before]
+                users[folded_after] = after
+
+    def _on_join(self, connection, event):
+        if event.source.nick == connection.get_nickname():
+            # The bot joins a channel
+            self.join(event.target)
+        self.add_users(event.target, [event.source.nick])
+
+    def _on_namreply(self, connection, event):
+        # arguments: channel type, channel, list of nicks with their modes
+        # (a reply to a NAMES command on a channel not joined is ignored)
+        _, channel, nick_list = event.arguments
+        prefixes = ''.join(connection.features.prefix)
+        self.add_users(channel, (nick.lstrip(prefixes)
+                                 for nick in nick_list.split()))
+
+    def _on_nick(self, connection, event):
+        self.rename_user(event.source.nick, event.target)
+
+    def _on_part(self, connection, event):
+        self._remove(connection, event.target, event.source.nick)
+
+    def _on_kick(self, connection, event):
+        self._remove(connection, event.target, event.arguments[0])
+
+    def _on_quit(self, connection, event):
+        self.remove_user(None, event.source.nick)
+
+    def _on_disconnect(self, connection, event):
+        self._users.clear()
+        self._names.clear()
+
+    def _remove(self, connection, channel, nick):
+        """Remove the nick from the channel (or the channel if nick is the bot)"""
+        if nick == connection.get_nickname():
+            self.leave(channel)
+            return
+        self.remove_user(channel, nick)
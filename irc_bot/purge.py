@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Deletion of the logs & relationships of users in background.
+
+Rows are deleted by ranges of ids, one transaction per range (see
+database.purge_users()): the bot keeps committing events meanwhile.
+"""
+
+# Standard imports
+import re
+import time
+from threading import Thread, Lock
+from sqlalchemy.exc import SQLAlchemyError
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import database as db
+
+LOGGER = cm.logger()
+
+# Only one purge at a time (ranges of ids are read at the beginning)
+_RUNNING = Lock()
+
+
+class UserPurge(Thread):
+    """Overriding the Thread class and only override the __init__()
+    and run() methods of this class.
+
+    This class is used to load an independant thread able to delete
+    the logs and/or the relationships of several users in a single
+    operation: the logs, the edges, then the archives are read only once
+    for all the users.
+
+    Users are given by their pseudos and/or by a regular expression
+    matching the whole pseudos.
+
+    Attributes:
+        - private: _db_session, SQLAlchemy scoped session
+        - private: _writer, optional write-behind buffer; pending events
+            are committed before the deletion.
+        - private: _report, optional callable used to send messages
+            about the progress of the purge (called from this thread).
+        - public: names, pseudos to delete <list <str>>
+        - public: pattern, regular expression of pseudos to delete <str>
+        - public: logs, if True logs are deleted <boolean>
+        - public: edges, if True relationships are deleted <boolean>
+        - public: deleted, number of deleted logs & edges (once done)
+            <tuple <int>, <int>>
+    """
+
+    def __init__(self, db_session, names=(), pattern=None, logs=True,
+                 edges=True, writer=None, report=None):
+        """Constructor
+        :param arg1: SQLAlchemy scoped session.
+        :param arg2: Optional iterable of pseudos.
+        :param arg3: Optional regular expression.
+        :param arg4: Optional boolean; if False logs are kept.
+        :param arg5: Optional boolean; if False relationships are kept.
+        :param arg6: Optional write-behind buffer.
+        :param arg7: Optional callable taking a message.
+        :type arg1: <SQL session object>
+        :type arg2: <iterable <str>>
+        :type arg3: <str>
+        :type arg4: <boolean>
+        :type arg5: <boolean>
+        :type arg6: <WriteBehind>
+        :type arg7: <callable>
+        """
+        Thread.__init__(self, name="UserPurge", daemon=True)
+        self._db_session = db_session
+        self._writer = writer
+        self._report = report
+        self._next_report = cm.PURGE_REPORT_PERCENT
+        self.names = list(names)
+        self.pattern = pattern
+        self.logs = logs
+        self.edges = edges
+        self.deleted = None
+
+    def report(self, message):
+        """Send the given message (if a callable is given) & log it"""
+        LOGGER.info("Purge: " + message)
+        if self._report is not None:
+            self._report(message)
+
+    def _progress(self, step, steps):
+        """Called after each step of the purge"""
+        done = 100 * step // steps
+        if step < steps and done >= self._next_report:
+            self.report("{}% done".format(done))
+            while self._next_report <= done:
+                self._next_report += cm.PURGE_REPORT_PERCENT
+        # Leave the database to the bot
+        time.sleep(cm.PURGE_STEP_DELAY)
+
+    def purge(self, user_ids):
+        """Delete the rows of the given users
+
+        :param: Iterable of user ids.
+        :type: <iterable <int>>
+        :return: Number of deleted logs & edges.
+        :rtype: <tuple <int>, <int>>
+        """
+        deleted = (0, 0)
+        for step, steps, *deleted in db.purge_users(self._db_session,
+                                                    user_ids, self.logs,
+                                                    self.edges):
+            self._progress(step, steps)
+        return tuple(deleted)
+
+    def run(self):
+        """Heart of the class; This method deletes the rows."""
+
+        if not _RUNNING.acquire(blocking=False):
+            self.report("a purge is already running")
+            return
+
+        start = time.monotonic()
+        try:
+            # Pending events of the users must be deleted too: they would
+            # be inserted after the purge
+            if self._writer is not None and not self._writer.flush():
+                self.report("aborted; pending events not committed "
+                            "(database locked ?)")
+                return
+
+            users = db.User.find_ids(self._db_session, self.names,
+                                     self.pattern)
+            if not users:
+                self.report("no user found")
+                return
+            pseudos = sorted(users.values())
+            pseudos = ', '.join(pseudos[:10]) + \
+                (', ...' if len(pseudos) > 10 else '')
+            self.report("started for " + str(len(users)) + " user(s): <" + \
+                        pseudos + ">")
+
+            self.deleted = self.purge(users)
+            self.report("{} deleted logs & {} deleted edges in {:.0f}s. "
+                        "Have a nice day.".format(*self.deleted,
+                                                  time.monotonic() - start))
+        except re.error as e:
+            self.report("invalid regular expression; " + str(e))
+        except (OSError, SQLAlchemyError) as e:
+            # Steps already done are kept
+            self._db_session.rollback()
+            self.report("failed; " + str(e))
+        finally:
+            self._db_session.remove()
+            _RUNNING.release()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the pages of the website.
+
+Pages are rendered & compressed once per generation of data
+(see DataCaching); a hit costs a dict lookup.
+Responses carry ETag & Last-Modified headers so that Nginx & browsers
+can revalidate their copy (304 Not Modified).
+"""
+
+# Standard imports
+import gzip
+import hashlib
+import datetime
+from threading import Lock
+from flask import Response
+# Custom imports
+from irc_bot import commons as cm
+
+LOGGER = cm.logger()
+
+
+class RenderedPage():
+    """A page rendered for a given generation of data.
+
+    Attributes:
+        - public: body, utf-8 encoded page <bytes>
+        - public: gzip_body, compressed page <bytes>
+        - public: etag, hash of the page <str>
+        - public: generation, generation of data used by the page <int>
+        - public: last_modified, date of data <datetime>
+    """
+
+    def __init__(self, html, generation, timestamp):
+        """Constructor
+        :param arg1: Rendered page.
+        :param arg2: Generation of data used by the page.
+        :param arg3: Date of data (seconds since epoch).
+        :type arg1: <str>
+        :type arg2: <int>
+        :type arg3: <float>
+        """
+        self.body          = html.encode('utf-8')
+        # Done once: the best compression level is affordable
+        self.gzip_body     = gzip.compress(self.body, compresslevel=9)
+        self.etag          = hashlib.sha1(self.body).hexdigest()
+        self.generation    = generation
+        self.last_modified = datetime.datetime.utcfromtimestamp(int(timestamp))
+
+    def make_response(self, request, mimetype='text/html', max_age=None):
+        """Return a Flask response for the given request.
+
+        ..Note: The compressed page is sent if the client accepts it.
+        ..Note: 304 status is returned if the client has the same version.
+
+        :param arg1: Flask request.
+        :param arg2: Optional mimetype of the page.
+        :param arg3: Optional time (in seconds) during which caches can
+            use the page without revalidation.
+        :type arg1: <Request>
+        :type arg2: <str>
+        :type arg3: <int>
+        :return: Flask response
+        :rtype: <Response>
+        """
+        if 'gzip' in request.accept_encodings:
+            response = Response(self.gzip_body, mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+            # Each representation has its own tag
+            response.set_etag(self.etag + '-gz')
+        else:
+            response = Response(self.body, mimetype=mimetype)
+            response.set_etag(self.etag)
+
+        response.headers['Vary'] = 'Accept-Encoding'
+        set_cache_headers(response, self.last_modified, max_age)
+
+        return response.make_conditional(request)
+
+
+def set_cache_headers(response, last_modified, max_age=None):
+    """Set Last-Modified & Cache-Control headers of the given response.
+
+    :param arg1: Flask response.
+    :param arg2: Date of data.
+    :param arg3: Optional time (in seconds) during which caches can use
+        the response without revalidation; by default caches must
+        revalidate their copy.
+    :type arg1: <Response>
+    :type arg2: <datetime>
+    :type arg3: <int>
+    """
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = max_age
+
+
+class PageCache():
+    """Pages rendered once per generation of data.
+
+    Attributes:
+        - private: _pages, rendered pages by key <dict <str>: <RenderedPage>>
+        - private: _lock, lock used to render a page only once
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self._pages = dict()
+        self._lock  = Lock()
+
+    def get(self, key, generation, timestamp, render):
+        """Return the page for the given key & generation of data.
+
+        The page is rendered only if the cached one is outdated.
+
+        :param arg1: Key of the page.
+        :param arg2: Generation of data.
+        :param arg3: Date of data (seconds since epoch).
+        :param arg4: Callable returning the rendered page.
+        :type arg1: <str>
+        :type arg2: <int>
+        :type arg3: <float>
+        :type arg4: <callable>
+        :return: Rendered page.
+        :rtype: <RenderedPage>
+        """
+        page = self._pages.get(key)
+        if page is not None and page.generation == generation:
+            return page
+
+        with self._lock:
+            # The page may be rendered by another thread meanwhile
+            page = self._pages.get(key)
+            if page is not None and page.generation == generation:
+                return page
+
+            LOGGER.debug("PageCache: render <" + key + "> for generation " + \
+                         str(generation))
+            page = RenderedPage(render(), generation, timestamp)
+            self._pages[key] = page
+            return page
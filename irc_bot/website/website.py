@@ -12,11 +12,18 @@ http://visjs.org/docs/network/
 """
 
 # Standard imports
-from flask import Flask, render_template
+import json
+import time
+import datetime
+from flask import Flask, Response, abort, render_template, request
 
 # Custom imports
 from irc_bot import commons as cm
 from irc_bot import database as db
+from irc_bot import metrics
+from irc_bot import graph_pruning
+from irc_bot.website.page_cache import PageCache, RenderedPage, \
+    set_cache_headers
 
 LOGGER = cm.logger()
 
@@ -31,21 +38,184 @@ app = Flask(__name__,
 			static_url_path=cm.STATIC_PREFIX,
             static_folder='../../' + cm.DIR_W_STATIC,
             template_folder='../../' + cm.DIR_W_TEMPLATES)
-# Initialize SQLAlchemy session (flask auto-removes the session later
-session = db.loading_sql()
+# SQLAlchemy session & data caching thread (see create_app())
+session = None
+thread = None
 
-# Data caching
-if not cm.ENABLE_REALTIME:
-    from irc_bot.data_caching import DataCaching
 
-    # Pass the callable for database interrogation (have a look to database.py)
-    thread = DataCaching(session, db.forge_data)
-    thread.start()
+def create_app():
+    """Initialize the website & return the Flask app.
 
+    Importing this module has no side effect (no database, no thread):
+    this function is called once by each process serving the website
+    (see irc_bot/irc_bot.py for Gunicorn). Next calls return the same app.
 
-@app.route(cm.NGINX_PREFIX)
-def index():
-    """Main page with graphs.
+    :return: Flask app.
+    :rtype: <Flask>
+    """
+    global session, thread
+    if session is not None:
+        return app
+
+    cm.init()
+    # Initialize SQLAlchemy session (flask auto-removes the session later
+    session = db.loading_sql(read_only=cm.WEBSITE_READ_ONLY)
+
+    # Data caching
+    if not cm.ENABLE_REALTIME:
+        from irc_bot.data_caching import DataCaching
+
+        # Pass the callable for database interrogation (have a look to database.py)
+        # Only one worker (the leader) forges data, the others read its snapshot
+        # Data is forged again only when the revision of the database changes
+        # Data of all the channels is forged at once
+        thread = DataCaching(session, db.forge_all_data, db.Revision.get,
+                             producer=not cm.CACHE_EXTERNAL_PRODUCER)
+        thread.start()
+
+        # Forged data as seen by this worker
+        metrics.CACHE_AGE.set_function(
+            lambda: time.time() - thread.timestamp if thread.timestamp else None
+        )
+        metrics.CACHE_GENERATION.set_function(lambda: thread.generation)
+        metrics.LAST_FORGE_SECONDS.set_function(lambda: thread.forge_seconds)
+    return app
+
+# Pages rendered once per generation of data
+pages = PageCache()
+
+# Pages of the default channel are also available without the channel
+# in their URL
+CHANNEL_PREFIX   = cm.NGINX_PREFIX + '/channel/<network>/<channel>'
+CHANNEL_DEFAULTS = {'network': None, 'channel': None}
+
+
+def get_channel(network, channel):
+    """Return the requested channel, or the default one.
+
+    ..Note: 404 status is returned if the channel is not watched.
+
+    :param arg1: Network name (None for the default channel).
+    :param arg2: Channel.
+    :type arg1: <str>
+    :type arg2: <str>
+    :return: Network name & channel.
+    :rtype: <tuple <str>, <str>>
+    """
+    if network is None:
+        return cm.default_channel()
+    if (network, channel) not in cm.get_channels():
+        abort(404)
+    return network, channel
+
+
+def get_data(network=None, channel=None):
+    """Return the generation, the date & the forged data of a channel.
+
+    ..Note: With real-time generation, data is forged now
+        & the generation is None.
+
+    :param arg1: Network name (None for the default channel).
+    :param arg2: Channel.
+    :type arg1: <str>
+    :type arg2: <str>
+    :return: Generation, date (seconds since epoch) & data.
+    :rtype: <tuple <int>, <float>, <dict>>
+    """
+    network, channel = get_channel(network, channel)
+    if not cm.ENABLE_REALTIME:
+        if (network, channel) not in thread.data:
+            # Data is not forged yet
+            abort(503)
+        return thread.generation, thread.timestamp, \
+            thread.data[(network, channel)]
+    return None, time.time(), db.forge_data(session, network=network,
+                                            channel=channel)
+
+
+def get_graph_level():
+    """Return the level of detail of the graph requested in the query string
+    (see GRAPH_LEVELS in commons).
+
+    ..Note: 400 status is returned if the level is unknown.
+
+    :return: Name of the level.
+    :rtype: <str>
+    """
+    level = request.args.get('level', cm.GRAPH_DEFAULT_LEVEL)
+    if level not in cm.GRAPH_LEVELS:
+        abort(400)
+    return level
+
+
+def get_pruning_parameters():
+    """Return the parameters of pruning given in the query string
+    (see graph_pruning.prune()).
+
+    ..Note: 400 status is returned if a value is not a positive integer.
+
+    :return: Parameters & their values.
+    :rtype: <dict <str>: <int>>
+    """
+    parameters = dict()
+    for name in graph_pruning.PARAMETERS:
+        if name not in request.args:
+            continue
+        value = request.args[name]
+        if not value.isdigit():
+            abort(400)
+        parameters[name] = int(value)
+    return parameters
+
+
+def json_response(key, network, channel, build):
+    """Return a JSON response with a slice of the forged data of a channel.
+
+    ..Note: The JSON document is serialized once per generation of data.
+
+    :param arg1: Name of the endpoint (see API_MAX_AGE in commons).
+    :param arg2: Network name (None for the default channel).
+    :param arg3: Channel.
+    :param arg4: Callable returning the slice of data to be sent.
+    :type arg1: <str>
+    :type arg2: <str>
+    :type arg3: <str>
+    :type arg4: <callable>
+    :return: Flask response
+    :rtype: <Response>
+    """
+    generation, timestamp, data = get_data(network, channel)
+    render = lambda: json.dumps(build(data))
+
+    if generation is None:
+        page = RenderedPage(render(), 0, timestamp)
+    else:
+        page_key = 'api_{}_{}/{}'.format(key, data['network'], data['channel'])
+        page = pages.get(page_key, generation, timestamp, render)
+    return page.make_response(request, 'application/json',
+                              cm.API_MAX_AGE[key])
+
+
+def iter_json_array(items):
+    """Yield a JSON array chunk by chunk (see API_CHUNK_SIZE in commons).
+
+    :param: List of serializable items.
+    :type: <list>
+    :return: Generator of JSON parts.
+    :rtype: <generator <str>>
+    """
+    yield '['
+    for start in range(0, len(items), cm.API_CHUNK_SIZE):
+        chunk = ','.join(json.dumps(item) for item in
+                         items[start:start + cm.API_CHUNK_SIZE])
+        yield chunk if start == 0 else ',' + chunk
+    yield ']'
+
+
+@app.route(cm.NGINX_PREFIX, defaults=CHANNEL_DEFAULTS)
+@app.route(CHANNEL_PREFIX)
+def index(network, channel):
+    """Main page with graphs (dashboard of a channel).
 
     This func gets all data to be displayed on the html template
 
@@ -56,12 +226,138 @@ def index():
 
     """
 
-    # Data caching
-    if not cm.ENABLE_REALTIME:
-        return render_template('index.html', **thread.data)
+    generation, timestamp, data = get_data(network, channel)
+    level = get_graph_level()
+
+    def render():
+        page_data = dict(data)
+        if level != cm.GRAPH_DEFAULT_LEVEL:
+            # Done once per generation of data (see below)
+            page_data['data_graph'] = db.graph_to_dot(
+                *data['graph_levels'][level])
+        return render_template('index.html', channels=cm.get_channels(),
+                               graph_level=level,
+                               level_names=list(cm.GRAPH_LEVELS),
+                               **page_data)
+
+    # Data caching: the page is rendered once per generation of data
+    # & level of detail of the graph
+    if generation is not None:
+        page_key = 'index_{}/{}_{}'.format(data['network'], data['channel'],
+                                           level)
+        page = pages.get(page_key, generation, timestamp, render)
+        return page.make_response(request)
 
     # With data caching: realtime
-    return render_template('index.html', **db.forge_data(session))
+    return render()
+
+
+@app.route(cm.NGINX_PREFIX + '/api/top_posters', defaults=CHANNEL_DEFAULTS)
+@app.route(CHANNEL_PREFIX + '/api/top_posters')
+def api_top_posters(network, channel):
+    """Top posters of the current day, previous day & current week.
+
+    Each value is: [[labels], [values]]
+    """
+    return json_response('top_posters', network, channel, lambda data: {
+        'day': data['data_bar_day'],
+        'prev_day': data['data_bar_prev_day'],
+        'week': data['data_bar_week'],
+    })
+
+
+@app.route(cm.NGINX_PREFIX + '/api/hourly', defaults=CHANNEL_DEFAULTS)
+@app.route(CHANNEL_PREFIX + '/api/hourly')
+def api_hourly(network, channel):
+    """Number of messages per hour during the current & previous days/weeks.
+
+    Each value is: [[hours], [values]]
+    """
+    return json_response('hourly', network, channel, lambda data: {
+        'day': data['data_line_day'],
+        'prev_day': data['data_line_prev_day'],
+        'week': data['data_line_week'],
+        'prev_week': data['data_line_prev_week'],
+    })
+
+
+@app.route(cm.NGINX_PREFIX + '/api/average', defaults=CHANNEL_DEFAULTS)
+@app.route(CHANNEL_PREFIX + '/api/average')
+def api_average(network, channel):
+    """Average of messages for each day of the week (Monday first)"""
+    return json_response('average', network, channel,
+                         lambda data: data['data_average'])
+
+
+@app.route(cm.NGINX_PREFIX + '/api/graph', defaults=CHANNEL_DEFAULTS)
+@app.route(CHANNEL_PREFIX + '/api/graph')
+def api_graph(network, channel):
+    """Graph of relationships.
+
+    The document is: {"nodes": [[pseudo, weight, degree, pagerank,
+                                 betweenness, community], ...],
+                      "edges": [[pseudo1, pseudo2, weight], ...]}
+
+    The level of detail is given by the level parameter (see GRAPH_LEVELS
+    in commons; precomputed), and/or by the parameters of
+    graph_pruning.prune() (top_edges, min_weight, k_core, collapse_leaves)
+    which override the ones of the level; the full graph is then pruned
+    for this request.
+
+    ..Note: The document is streamed; it is never built in memory.
+    ..Note: The graph is pruned while the document is streamed: a request
+        answered with 304 (ETag of the level & parameters) prunes nothing.
+    """
+    generation, timestamp, data = get_data(network, channel)
+    level = get_graph_level()
+    parameters = get_pruning_parameters()
+    if parameters:
+        prune_parameters = dict(cm.GRAPH_LEVELS[level], **parameters)
+        level = '_'.join([level] + ['{}-{}'.format(name, value)
+                                    for name, value in
+                                    sorted(parameters.items())])
+
+    def generate():
+        if parameters:
+            nodes, edges = graph_pruning.prune(
+                data['graph_nodes'], data['graph_edges'], **prune_parameters)
+        else:
+            nodes, edges = data['graph_levels'][level]
+        yield '{"nodes": '
+        yield from iter_json_array(nodes)
+        yield ', "edges": '
+        yield from iter_json_array(edges)
+        yield '}'
+
+    response = Response(generate(), mimetype='application/json')
+    # make_conditional() must not read the stream to set its length
+    response.implicit_sequence_conversion = False
+    if generation is not None:
+        # The tag identifies the version of data; the body is never hashed
+        response.set_etag('graph-{}-{}-{}/{}-{}'.format(
+            generation, int(timestamp), data['network'], data['channel'],
+            level))
+    set_cache_headers(response,
+                      datetime.datetime.utcfromtimestamp(int(timestamp)),
+                      cm.API_MAX_AGE['graph'])
+    return response.make_conditional(request)
+
+
+@app.route(cm.NGINX_PREFIX + '/metrics')
+def metrics_page():
+    """Metrics of this worker in Prometheus text format.
+
+    ..Note: Each Gunicorn worker has its own metrics; data forged by the
+        leader (age, generation, duration, size of graphs) is the same
+        in all workers.
+    """
+    if not cm.ENABLE_REALTIME:
+        for (network, channel), data in thread.data.items():
+            metrics.GRAPH_SIZE.set(len(data['graph_nodes']),
+                                   network, channel, 'nodes')
+            metrics.GRAPH_SIZE.set(len(data['graph_edges']),
+                                   network, channel, 'edges')
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.teardown_appcontext
@@ -70,14 +366,18 @@ def shutdown_session(exception=None):
     http://flask.pocoo.org/docs/0.10/patterns/sqlalchemy/
     PAY ATTENTION HERE:
     http://stackoverflow.com/questions/21078696/why-is-my-scoped-session-raising-an-attributeerror-session-object-has-no-attr
+
+    ..Note: The session doesn't exist before create_app().
     """
+    if session is None:
+        return
     LOGGER.debug("SQLA : Closing session...")
     session.remove()
 
 
 def main():
 
-    app.run()
+    create_app().run()
 
 if __name__ == "__main__":
 
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind buffer used to take database commits out of the IRC reactor.
+
+IRC events are queued by the bot and committed in bulk by a dedicated thread,
+either when the buffer is full or when the flush delay is elapsed.
+"""
+
+# Standard imports
+import time
+import queue
+from threading import Thread, Event
+from sqlalchemy.exc import OperationalError
+# Custom imports
+from irc_bot import commons as cm
+from irc_bot import metrics
+
+LOGGER = cm.logger()
+
+# Marker used to stop the thread
+_STOP = object()
+
+
+class WriteBehind(Thread):
+    """Overriding the Thread class and only override the __init__()
+    and run() methods of this class.
+
+    This class is used to load an independant thread able to commit
+    the rows produced by the bot (db.Log, db.Edge) in a single transaction.
+    The buffer is flushed when it reaches `batch_size` rows, or at most
+    `flush_delay` seconds after the first pending row.
+
+    Attributes:
+        - private: _sqla_session, SQLAlchemy scoped session; the thread
+            gets its own session from it.
+        - private: _before_commit, optional callable used to update
+            other tables (aggregates) in the same transaction.
+        - private: _queue, queue of rows & control markers.
+        - private: _batch_size, maximum number of pending rows.
+        - private: _flush_delay, maximum delay (in seconds) of a pending row.
+        - private: _max_pending, maximum number of rows kept when
+            the database is locked.
+        - private: _stop_timeout, maximum duration (in seconds) of the
+            attempts to commit the rows pending on shutdown.
+        - private: _lost_rows, number of rows lost by failed commits.
+        - private: _drained, True if all the rows were committed
+            on shutdown.
+    """
+
+    def __init__(self, sqla_session, before_commit=None,
+                 batch_size=cm.WRITE_BATCH_SIZE,
+                 flush_delay=cm.WRITE_FLUSH_DELAY,
+                 max_pending=cm.WRITE_MAX_PENDING,
+                 stop_timeout=cm.WRITE_STOP_TIMEOUT):
+        """Constructor
+        :param arg1: SQLAlchemy scoped session.
+        :param arg2: Optional callable called with the session & the rows
+            before each commit.
+        :param arg3: Maximum number of rows in the buffer.
+        :param arg4: Maximum delay before a flush (in seconds).
+        :param arg5: Maximum number of rows kept after failed commits.
+        :param arg6: Maximum duration of the last commit on shutdown
+            (in seconds).
+        :type arg1: <SQL session object>
+        :type arg2: <callable>
+        :type arg3: <int>
+        :type arg4: <int>
+        :type arg5: <int>
+        :type arg6: <int>
+        """
+        Thread.__init__(self, name="WriteBehind", daemon=True)
+
+        self._sqla_session  = sqla_session
+        self._before_commit = before_commit
+        self._queue         = queue.Queue()
+        self._batch_size    = batch_size
+        self._flush_delay   = flush_delay
+        self._max_pending   = max_pending
+        self._stop_timeout  = stop_timeout
+        self._lost_rows     = 0
+        self._drained       = True
+        metrics.PENDING_ROWS.set_function(self._queue.qsize)
+
+    def add(self, row):
+        """Queue the given row; it will be committed later.
+
+        ..Note: This method never blocks the caller.
+
+        :param: Row to insert.
+        :type: <db.Log> or <db.Edge>
+        """
+        self._queue.put(row)
+
+    def flush(self, timeout=None):
+        """Commit all the rows queued before this call & wait for it.
+
+        :param: Optional maximum waiting time (in seconds).
+        :type: <int>
+        :return: True if all the rows are committed; False on timeout
+            or if the commit failed (rows are still pending).
+        :rtype: <boolean>
+        """
+        if not self.is_alive():
+            return True
+        done = Event()
+        done.committed = False
+        self._queue.put(done)
+        return done.wait(timeout) and done.committed
+
+    def stop(self):
+        """Drain the buffer & stop the thread
+
+        ..Note: If the database is locked, the last commit is retried
+            for at most stop_timeout seconds.
+
+        :return: True if all the rows are committed; False if rows
+            were dropped or lost.
+        :rtype: <boolean>
+        """
+        if not self.is_alive():
+            return self._drained
+        self._queue.put(_STOP)
+        self.join()
+        return self._drained
+
+    def _commit(self, pending):
+        """Insert the given rows in a single transaction.
+
+        ..Note: If the database is locked, rows are kept for the next attempt;
+            beyond max_pending rows, the oldest ones are dropped.
+
+        :param: List of rows.
+        :type: <list>
+        :return: Rows that are still pending.
+        :rtype: <list>
+        """
+        if not pending:
+            return pending
+
+        start = time.perf_counter()
+        try:
+            if self._before_commit is not None:
+                self._before_commit(self._sqla_session, pending)
+            self._sqla_session.bulk_save_objects(pending)
+            self._sqla_session.commit()
+        except OperationalError as e:
+            self._sqla_session.rollback()
+            metrics.COMMIT_FAILURES.inc('retried')
+            LOGGER.error("WriteBehind: commit failed, retry later; " + str(e))
+            return self._drop_oldest(pending)
+        except Exception as e:
+            self._sqla_session.rollback()
+            metrics.COMMIT_FAILURES.inc('lost')
+            self._lost_rows += len(pending)
+            LOGGER.error("WriteBehind: " + str(len(pending)) + \
+                         " rows lost; " + str(e))
+            return list()
+
+        metrics.COMMIT_SECONDS.observe(time.perf_counter() - start)
+        for row in pending:
+            metrics.COMMITTED_ROWS.inc(row.__tablename__)
+        LOGGER.debug("WriteBehind: " + str(len(pending)) + " rows committed")
+        return list()
+
+    def _drop_oldest(self, pending):
+        """Drop the oldest rows beyond max_pending rows.
+
+        :param: List of rows.
+        :type: <list>
+        :return: Rows that are still pending.
+        :rtype: <list>
+        """
+        excess = len(pending) - self._max_pending
+        if excess <= 0:
+            return pending
+        for row in pending[:excess]:
+            metrics.DROPPED_ROWS.inc(row.__tablename__)
+        LOGGER.error("WriteBehind: " + str(excess) + \
+                     " rows dropped; database locked for too long")
+        return pending[excess:]
+
+    def _drain(self, pending):
+        """Commit the given rows, retrying until stop_timeout is elapsed.
+
+        ..Note: Rows still pending at the deadline are dropped.
+
+        :param: List of rows.
+        :type: <list>
+        :return: True if all the rows are committed.
+        :rtype: <boolean>
+        """
+        lost_rows = self._lost_rows
+        deadline = time.monotonic() + self._stop_timeout
+        pending = self._commit(pending)
+        while pending and time.monotonic() < deadline:
+            time.sleep(min(self._flush_delay,
+                           max(0, deadline - time.monotonic())))
+            pending = self._commit(pending)
+
+        if pending:
+            for row in pending:
+                metrics.DROPPED_ROWS.inc(row.__tablename__)
+            LOGGER.error("WriteBehind: " + str(len(pending)) + \
+                         " rows dropped on shutdown; database locked")
+            return False
+        return self._lost_rows == lost_rows
+
+    def run(self):
+        """Heart of the class; This method commits the queued rows."""
+
+        LOGGER.info("Write-behind thread started !")
+        pending  = list()
+        deadline = None
+
+        while True:
+
+            timeout = None
+            if pending:
+                timeout = max(0, deadline - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # Flush delay is elapsed
+                pending = self._commit(pending)
+                deadline = time.monotonic() + self._flush_delay
+                continue
+
+            if item is _STOP:
+                self._drained = self._drain(pending)
+                self._sqla_session.remove()
+                LOGGER.info("Write-behind thread stopped !")
+                return
+
+            if isinstance(item, Event):
+                # Explicit flush required
+                pending = self._commit(pending)
+                item.committed = not pending
+                item.set()
+                continue
+
+            if not pending:
+                deadline = time.monotonic() + self._flush_delay
+            pending.append(item)
+
+            if len(pending) >= self._batch_size:
+                pending = self._commit(pending)